@@ -1,3 +1,4 @@
+import asyncio
 import requests
 import numpy as np
 import copy
@@ -6,12 +7,21 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import Flask, render_template, jsonify, request
 import json
 
-#==========================================Database Configuration==========================================
-CLICKHOUSE_HTTP = "http://localhost:8123"
-CLICKHOUSE_USER = "default"
-CLICKHOUSE_PASS = "admin"
-DATABASE = "tictactoe"
+from clickhouse_config import CLICKHOUSE_HTTP, CLICKHOUSE_USER, CLICKHOUSE_PASS, DATABASE
+from position_filter import load_position_filter
+from query_cancellation import (current_move_scope, MoveQueryScope, QueryCancelled, as_cancelled, run_in_scope,
+                                watch_client_disconnect, standalone_query_id)
+from replica_router import ReplicaRouter, EndpointUnavailable
+from query_coalescer import SingleFlight, AsyncSingleFlight
+from async_query_client import AsyncReplicaClient, AsyncQueryRunner
+import query_builder
+from query_builder import (build_outcome_counts_query, build_level_count_query, build_level_count_queries,
+                           where_clause, board_orientations, http_params, DRAW_TABLE,
+                           table_may_match, note_pruned_scans, live_row_counts, watch_live_row_counts)
+from native_query import query_candidate_counts, consolidated_table_available
+from next_move_stats import lookup_next_moves
 
+#==========================================Database Configuration==========================================
 # Connection pooling
 session = requests.Session()
 adapter = requests.adapters.HTTPAdapter(
@@ -21,6 +31,32 @@ adapter = requests.adapters.HTTPAdapter(
 )
 session.mount('http://', adapter)
 
+# Chọn replica theo health/latency, hedge sang replica thứ hai khi quá p95
+read_router = ReplicaRouter(CLICKHOUSE_HTTP)
+# total_rows cho level pruning và position filter: đọc qua read_router, thread nền làm mới
+watch_live_row_counts(read_router)
+
+# Negative-result filter: positions chắc chắn không có data sẽ không query DB
+POSITION_FILTER = load_position_filter()
+
+
+def position_may_have_data(canonical: list) -> bool:
+    """
+    Kiểm tra nhanh (không round trip DB) canonical board có thể có data không
+    
+    Args:
+        canonical: Canonical board (1D, 25 elements)
+        
+    Returns:
+        False nếu filter loại trừ được board, True nếu cần query
+    """
+    # Filter build từ data cũ hơn (load/migrate sau đó) có thể báo nhầm "không có data": không dùng
+    if POSITION_FILTER is None or not POSITION_FILTER.is_current(live_row_counts()):
+        return True
+    if query_builder.MATCH_ALL_ORIENTATIONS:
+        return any(POSITION_FILTER.may_have_data(oriented) for oriented in board_orientations(canonical))
+    return POSITION_FILTER.may_have_data(canonical)
+
 
 def execute_query(sql: str) -> int:
     """
@@ -32,17 +68,37 @@ def execute_query(sql: str) -> int:
     Returns:
         Số lượng rows (int)
     """
-    try:
+    # Query thuộc nước đi đã bị hủy/hết deadline thì không gửi nữa
+    scope = current_move_scope.get()
+    timeout = 10
+    params = {
+        "user": CLICKHOUSE_USER,
+        "password": CLICKHOUSE_PASS,
+        "database": DATABASE,
+        **http_params()
+    }
+    if scope is not None:
+        scope.ensure_active()
+        query_id = scope.begin_query()
+        timeout = scope.remaining(timeout)
+    else:
+        query_id = standalone_query_id()
+    # Luôn có query_id: bản hedge thua bị KILL theo id (sync request không tự hủy khi bị bỏ)
+    params["query_id"] = query_id
+    
+    def post(url: str):
         response = session.post(
-            CLICKHOUSE_HTTP,
-            params={
-                "user": CLICKHOUSE_USER,
-                "password": CLICKHOUSE_PASS,
-                "database": DATABASE
-            },
+            url,
+            params=params,
             data=sql,
-            timeout=10
+            timeout=timeout
         )
+        if response.status_code >= 500:
+            raise EndpointUnavailable(f"HTTP {response.status_code}: {response.text.strip()}")
+        return response
+    
+    try:
+        response = read_router.call(post, timeout, query_id)
         
         if response.status_code != 200:
             print(f"❌ Query error {response.status_code}: {response.text}")
@@ -55,8 +111,15 @@ def execute_query(sql: str) -> int:
         return int(result)
         
     except Exception as e:
+        # Bị hủy/timeout thì không có COUNT: raise thay vì trả 0, request khác có thể đang chờ chung kết quả
+        cancelled = as_cancelled(e, scope)
+        if cancelled is not None:
+            raise cancelled from e
         print(f"❌ Database error: {e}")
         return 0
+    finally:
+        if scope is not None:
+            scope.end_query(query_id)
 
 
 def get_odd_table_names(move_count: int) -> str:
@@ -107,18 +170,9 @@ def build_where_clause(board: list) -> str:
     Returns:
         WHERE clause string
     """
-    n = 5
-    conditions = []
-    
-    for idx, cell in enumerate(board):
-        if cell != 0:
-            row = (idx // n) + 1  # +1 vì index bắt đầu từ 1
-            col = (idx % n) + 1
-            col_name = f"i{row}{col}"
-            player_mark = 'X' if cell == 1 else 'O'
-            conditions.append(f"{col_name} = '{player_mark}'")
-    
-    return " AND ".join(conditions) if conditions else "1=1"
+    # Predicate theo thứ tự cố định tâm -> vòng trong -> vòng ngoài (cùng board = cùng text SQL),
+    # khớp cả 8 orientation nếu bật query_builder.MATCH_ALL_ORIENTATIONS
+    return where_clause(board)
 
 
 def query_odd_table(board: list) -> int:
@@ -136,8 +190,6 @@ def query_odd_table(board: list) -> int:
     if move_count == 0:
         return 0
     
-    where_clause = build_where_clause(board)
-    
     # Đếm trực tiếp từng bảng và cộng lại
     total_count = 0
     for level in range(9, 26, 2):  # 9, 11, 13, ..., 25
@@ -145,7 +197,10 @@ def query_odd_table(board: list) -> int:
             continue
         
         table_name = f"ttt_5_l{level}"
-        sql = f"SELECT COUNT(win_actor) FROM {table_name} WHERE {where_clause} AND win_actor = 'X'"
+        if not table_may_match(table_name, board):
+            note_pruned_scans()
+            continue
+        sql = build_level_count_query(table_name, 'X', board)
         
         count = execute_query(sql)
         total_count += count
@@ -168,8 +223,6 @@ def query_even_table(board: list) -> int:
     if move_count == 0:
         return 0
     
-    where_clause = build_where_clause(board)
-    
     # Đếm trực tiếp từng bảng và cộng lại
     total_count = 0
     for level in range(10, 25, 2):  # 10, 12, 14, ..., 24
@@ -177,7 +230,10 @@ def query_even_table(board: list) -> int:
             continue
         
         table_name = f"ttt_5_l{level}"
-        sql = f"SELECT COUNT(win_actor) FROM {table_name} WHERE {where_clause} AND win_actor = 'O'"
+        if not table_may_match(table_name, board):
+            note_pruned_scans()
+            continue
+        sql = build_level_count_query(table_name, 'O', board)
         
         count = execute_query(sql)
         total_count += count
@@ -200,13 +256,46 @@ def query_draw_table(board: list) -> int:
     if move_count == 0:
         return 0
     
-    where_clause = build_where_clause(board)
-    
     # Query table ttt_5_draw
-    sql = f"SELECT COUNT(win_actor) FROM ttt_5_draw WHERE {where_clause} AND win_actor = 'D'"
+    if not table_may_match(DRAW_TABLE, board):
+        note_pruned_scans()
+        return 0
+    sql = build_level_count_query(DRAW_TABLE, 'D', board)
     
     return execute_query(sql)
 
+# Các game/thread hỏi cùng canonical board cùng lúc chỉ gửi 1 lượt query xuống DB.
+# Nước đi của request dẫn đầu bị hủy -> các request đang chờ tự query lại trong scope của mình
+outcome_flight = SingleFlight(retry_on=(QueryCancelled,))
+
+
+def _query_outcome_counts(canonical: list) -> tuple[int, int, int]:
+    # Đã migrate bảng gộp: 1 câu lệnh, chỉ scan các partition level cần thiết
+    if consolidated_table_available():
+        return tuple(query_candidate_counts([canonical])[0].tolist())
+    return (
+        query_odd_table(canonical),
+        query_even_table(canonical),
+        query_draw_table(canonical)
+    )
+
+
+def query_outcome_counts(canonical: list) -> tuple[int, int, int]:
+    """
+    Đếm số trận X thắng, O thắng và hòa của canonical board
+    Request đồng thời cho cùng board sẽ chờ chung một query đang chạy
+    
+    Args:
+        canonical: Canonical board (list of int, size 25)
+        
+    Returns:
+        (x_win_count, o_win_count, draw_count)
+        
+    Raises:
+        QueryCancelled: Nước đi hiện tại đã bị hủy/hết deadline hoặc query timeout
+    """
+    return outcome_flight.do(tuple(canonical), _query_outcome_counts, canonical)
+
 #=========================================Symmetric==========================================
 N = 5  # Board size constant
 
@@ -313,6 +402,29 @@ def canonical_board(board: list) -> list:
     return list(min(sym_tuples))
 
 #=========================================5x5 Logic==========================================
+def steps_from_next_moves(currBoard: list[list[int]], player: int, next_moves: dict) -> list[list[list[int]]]:
+    """
+    Lưới [5][5][4] từ kết quả lookup_next_moves (một lookup thay cho một lượt query mỗi ô)
+    
+    Args:
+        next_moves: {cell_index: (x_win_count, o_win_count, draw_count)} trên board hiện tại
+    """
+    steps_with_rate = [[[] for _ in range(5)] for _ in range(5)]
+    for r in range(5):
+        for c in range(5):
+            if currBoard[r][c] != 0:
+                continue
+            x_win_count, o_win_count, draw_count = next_moves.get(r * 5 + c, (0, 0, 0))
+            total_count = x_win_count + o_win_count + draw_count
+            if total_count <= 0:
+                steps_with_rate[r][c] = [0.0, 0.0, 0.0, 0.0]
+                continue
+            win_count = x_win_count if player == 1 else o_win_count
+            lose_count = o_win_count if player == 1 else x_win_count
+            steps_with_rate[r][c] = [win_count, lose_count, draw_count, total_count]
+    return steps_with_rate
+
+
 def get_steps_with_rate(currBoard: list[list[int]], player: int) -> list[list[list[int]]]:
     """
     Tìm nước đi tốt nhất cho AI dựa trên database
@@ -328,7 +440,13 @@ def get_steps_with_rate(currBoard: list[list[int]], player: int) -> list[list[li
     empty_cells = sum(1 for cell in currBoard if cell == 0)
     print(f"\n🤔 AI đang suy nghĩ... (Còn {empty_cells} ô trống)")
 
+    # Parent đã có trong ttt_5_next_moves: cả lưới bằng một lookup
+    next_moves = lookup_next_moves(board_2d_to_1d(currBoard), player)
+    if next_moves is not None:
+        return steps_from_next_moves(currBoard, player, next_moves)
+
     steps_with_rate = [[[] for _ in range(5)] for _ in range(5)]
+    skipped_by_filter = 0
 
     for r in range(5):
         for c in range(5):
@@ -342,10 +460,18 @@ def get_steps_with_rate(currBoard: list[list[int]], player: int) -> list[list[li
             newBoard_1d = board_2d_to_1d(newBoard)
             canonical = canonical_board(newBoard_1d)
             
-            # Query với canonical form
-            x_win_count = query_odd_table(canonical)
-            o_win_count = query_even_table(canonical)
-            draw_count = query_draw_table(canonical)
+            # Filter loại trừ được -> không có data, khỏi query 18 bảng
+            if not position_may_have_data(canonical):
+                skipped_by_filter += 1
+                steps_with_rate[r][c] = [0.0, 0.0, 0.0, 0.0]
+                continue
+            
+            # Query với canonical form; nước đi đã hết deadline thì ô chưa có kết quả coi như không có data
+            try:
+                x_win_count, o_win_count, draw_count = query_outcome_counts(canonical)
+            except QueryCancelled:
+                steps_with_rate[r][c] = [0.0, 0.0, 0.0, 0.0]
+                continue
             
             total_count = x_win_count + o_win_count + draw_count
             
@@ -358,14 +484,72 @@ def get_steps_with_rate(currBoard: list[list[int]], player: int) -> list[list[li
             lose_count = o_win_count if player == 1 else x_win_count
             steps_with_rate[r][c] = [win_count, lose_count, draw_count, total_count]
     
+    if skipped_by_filter:
+        print(f"   ⏭️  Filter bỏ qua {skipped_by_filter} nước đi không có data")
+    
+    return steps_with_rate
+
+def get_steps_with_rate_native(currBoard: list[list[int]], player: int) -> list[list[list[int]]]:
+    """
+    Giống get_steps_with_rate nhưng đếm tất cả ô trống bằng một query (Native format + LZ4),
+    kết quả decode thẳng vào NumPy array
+    
+    Returns:
+        3D array [5][5][4] với [win_count, lose_count, draw_count, total_count]
+    """
+    next_moves = lookup_next_moves(board_2d_to_1d(currBoard), player)
+    if next_moves is not None:
+        return steps_from_next_moves(currBoard, player, next_moves)
+
+    steps_with_rate = [[[0.0, 0.0, 0.0, 0.0] for _ in range(5)] for _ in range(5)]
+    cells = []
+    canonicals = []
+
+    for r in range(5):
+        for c in range(5):
+            if currBoard[r][c] != 0:
+                steps_with_rate[r][c] = []
+                continue
+
+            newBoard = copy.deepcopy(currBoard)
+            newBoard[r][c] = player
+            canonical = canonical_board(board_2d_to_1d(newBoard))
+            
+            if not position_may_have_data(canonical):
+                continue
+            
+            cells.append((r, c))
+            canonicals.append(canonical)
+    
+    # Cùng tập candidate (cùng board 5x5) từ request khác đang chạy -> chờ chung một query
+    try:
+        counts = outcome_flight.do(tuple(map(tuple, canonicals)), query_candidate_counts, canonicals)
+    except QueryCancelled:
+        return steps_with_rate
+    
+    for (r, c), (x_win_count, o_win_count, draw_count) in zip(cells, counts.tolist()):
+        total_count = x_win_count + o_win_count + draw_count
+        if total_count <= 0:
+            continue
+        win_count = x_win_count if player == 1 else o_win_count
+        lose_count = o_win_count if player == 1 else x_win_count
+        steps_with_rate[r][c] = [win_count, lose_count, draw_count, total_count]
+    
     return steps_with_rate
 
 #===================================Unlimited Space logic====================================
 BOARD_SIZE = 15
+# Đường query khi AI chọn nước đi (chỉ một đường được dùng):
+#   "async"   mọi COUNT query của nước đi chạy đồng thời trên event loop (get_steps_with_rate_async)
+#   "native"  1 query Native/LZ4 cho mỗi board 5x5 (get_steps_with_rate_native)
+#   "http"    18 COUNT query tuần tự cho mỗi ô (get_steps_with_rate)
+QUERY_PATH = "async"
 
-def best_steps_unlimited(currBoard: list[list[int]], player: int, last_move_col: int, last_move_row: int) -> tuple[int, int]:
-    """Tìm nước đi tốt nhất cho AI trong unlimited space"""
-    
+def get_player_windows(currBoard: list[list[int]], player: int, last_move_col: int, last_move_row: int) -> list[tuple[int, int]]:
+    """
+    Lấy vị trí các quân của player trong vùng 5x5 quanh nước đi cuối
+    Mỗi vị trí là tâm của một board 5x5 cần đánh giá
+    """
     col_index = get_col_index_5_x_5(last_move_col)
     row_index = get_row_index_5_x_5(last_move_row)
 
@@ -375,44 +559,42 @@ def best_steps_unlimited(currBoard: list[list[int]], player: int, last_move_col:
     row_min = last_move_row - 2 + row_index
     row_max = last_move_row + 2 + row_index
 
-    # Accumulate counts cho mỗi ô trống
-    board_accumulated = {}  # ✅ Dùng dictionary với tuple key
-    
+    windows = []
     for r in range(row_min, row_max + 1):
         for c in range(col_min, col_max + 1):
-            if currBoard[r][c] != player:
-                continue
+            if currBoard[r][c] == player:
+                windows.append((r, c))
+    return windows
+
+
+def accumulate_window_rates(currBoard: list[list[int]], board_accumulated: dict, r: int, c: int, steps_with_rate: list):
+    """Map local 5x5 coordinates về global và cộng dồn counts cho mỗi ô trống"""
+    p_col_index = get_col_index_5_x_5(c)
+    p_row_index = get_row_index_5_x_5(r)
+    
+    for local_r in range(5):
+        for local_c in range(5):
+            global_r = r - 2 + p_row_index + local_r
+            global_c = c - 2 + p_col_index + local_c
             
-            # Lấy board 5x5 xung quanh vị trí player này
-            board_1d = get_board_5_x_5(currBoard, r, c)
-            board_2d = board_1d_to_2d(board_1d)
+            # ✅ Chỉ accumulate ô trống
+            if currBoard[global_r][global_c] != 0:
+                continue
             
-            steps_with_rate = get_steps_with_rate(board_2d, player)
+            rates = steps_with_rate[local_r][local_c]
             
-            # Map local 5x5 coordinates về global
-            p_col_index = get_col_index_5_x_5(c)
-            p_row_index = get_row_index_5_x_5(r)
+            # ✅ Dùng tuple key đúng format
+            if (global_r, global_c) not in board_accumulated:
+                board_accumulated[(global_r, global_c)] = [0, 0, 0, 0]
             
-            for local_r in range(5):
-                for local_c in range(5):
-                    global_r = r - 2 + p_row_index + local_r
-                    global_c = c - 2 + p_col_index + local_c
-                    
-                    # ✅ Chỉ accumulate ô trống
-                    if currBoard[global_r][global_c] != 0:
-                        continue
-                    
-                    rates = steps_with_rate[local_r][local_c]
-                    
-                    # ✅ Dùng tuple key đúng format
-                    if (global_r, global_c) not in board_accumulated:
-                        board_accumulated[(global_r, global_c)] = [0, 0, 0, 0]
-                    
-                    board_accumulated[(global_r, global_c)][0] += rates[0]
-                    board_accumulated[(global_r, global_c)][1] += rates[1]
-                    board_accumulated[(global_r, global_c)][2] += rates[2]
-                    board_accumulated[(global_r, global_c)][3] += rates[3]
-    
+            board_accumulated[(global_r, global_c)][0] += rates[0]
+            board_accumulated[(global_r, global_c)][1] += rates[1]
+            board_accumulated[(global_r, global_c)][2] += rates[2]
+            board_accumulated[(global_r, global_c)][3] += rates[3]
+
+
+def select_best_move(board_accumulated: dict) -> tuple[int, int]:
+    """Chọn ô có win rate cao nhất (hòa thì lose rate thấp nhất)"""
     # ✅ Check empty
     if not board_accumulated:
         return (-1, -1)
@@ -456,6 +638,144 @@ def best_steps_unlimited(currBoard: list[list[int]], player: int, last_move_col:
 
     return (best_row, best_column)
 
+
+def best_steps_unlimited(currBoard: list[list[int]], player: int, last_move_col: int, last_move_row: int) -> tuple[int, int]:
+    """Tìm nước đi tốt nhất cho AI trong unlimited space"""
+    # Accumulate counts cho mỗi ô trống
+    board_accumulated = {}  # ✅ Dùng dictionary với tuple key
+    
+    for r, c in get_player_windows(currBoard, player, last_move_col, last_move_row):
+        # Lấy board 5x5 xung quanh vị trí player này
+        board_1d = get_board_5_x_5(currBoard, r, c)
+        board_2d = board_1d_to_2d(board_1d)
+        
+        if QUERY_PATH == "native":
+            steps_with_rate = get_steps_with_rate_native(board_2d, player)
+        else:
+            steps_with_rate = get_steps_with_rate(board_2d, player)
+        accumulate_window_rates(currBoard, board_accumulated, r, c, steps_with_rate)
+    
+    return select_best_move(board_accumulated)
+
+#=========================================Async Evaluation==========================================
+# Cùng pipeline như trên nhưng mọi COUNT query của một nước đi chạy đồng thời trên một event loop,
+# không cần một thread cho mỗi query đang chờ
+MOVE_DEADLINE = 20  # giây; query chưa xong sau deadline bị hủy, nước đi dùng data đã có
+
+async_client = AsyncReplicaClient(
+    CLICKHOUSE_HTTP,
+    router=read_router,
+    user=CLICKHOUSE_USER,
+    password=CLICKHOUSE_PASS,
+    database=DATABASE,
+    pool_size=64,
+    timeout=10
+)
+async_runner = AsyncQueryRunner()
+async_outcome_flight = AsyncSingleFlight(retry_on=(QueryCancelled,))
+
+
+def build_outcome_queries(board: list) -> dict:
+    """
+    Tạo danh sách COUNT query cho từng outcome (giống query_odd/even/draw_table)
+    
+    Args:
+        board: Canonical board (list of int, size 25)
+        
+    Returns:
+        {'X': [sql, ...], 'O': [sql, ...], 'D': [sql]}
+    """
+    return build_level_count_queries(board)
+
+
+async def _query_outcome_counts_async(canonical: list) -> tuple[int, int, int]:
+    # consolidated_table_available có thể query system.tables (blocking): chạy ngoài event loop
+    if await asyncio.to_thread(consolidated_table_available):
+        return tuple(await async_client.query_ints(build_outcome_counts_query(canonical), columns=3))
+    
+    queries = build_outcome_queries(canonical)
+    counts = {}
+    for actor, sqls in queries.items():
+        counts[actor] = asyncio.gather(*(async_client.query_int(sql) for sql in sqls))
+    x_counts, o_counts, d_counts = await asyncio.gather(counts['X'], counts['O'], counts['D'])
+    return (sum(x_counts), sum(o_counts), sum(d_counts))
+
+
+async def query_outcome_counts_async(canonical: list) -> tuple[int, int, int]:
+    """
+    Bản async của query_outcome_counts: 18 query của board chạy đồng thời
+    Nước đi đã bị hủy/hết deadline thì board chưa có kết quả coi như không có data
+    """
+    try:
+        return await async_outcome_flight.do(tuple(canonical), _query_outcome_counts_async, canonical)
+    except QueryCancelled:
+        return (0, 0, 0)
+
+
+async def get_steps_with_rate_async(currBoard: list[list[int]], player: int) -> list[list[list[int]]]:
+    """
+    Bản async của get_steps_with_rate: query tất cả ô trống cùng lúc
+    
+    Returns:
+        3D array [5][5][4] với [win_count, lose_count, draw_count, total_count]
+    """
+    # Lookup là query sync (clickhouse-connect) -> chạy ở thread riêng, không chặn event loop
+    next_moves = await asyncio.to_thread(lookup_next_moves, board_2d_to_1d(currBoard), player)
+    if next_moves is not None:
+        return steps_from_next_moves(currBoard, player, next_moves)
+
+    steps_with_rate = [[[] for _ in range(5)] for _ in range(5)]
+    cells = []
+    pending = []
+
+    for r in range(5):
+        for c in range(5):
+            if currBoard[r][c] != 0:
+                continue
+
+            newBoard = copy.deepcopy(currBoard)
+            newBoard[r][c] = player
+            canonical = canonical_board(board_2d_to_1d(newBoard))
+            
+            if not position_may_have_data(canonical):
+                steps_with_rate[r][c] = [0.0, 0.0, 0.0, 0.0]
+                continue
+            
+            cells.append((r, c))
+            pending.append(query_outcome_counts_async(canonical))
+    
+    for (r, c), (x_win_count, o_win_count, draw_count) in zip(cells, await asyncio.gather(*pending)):
+        total_count = x_win_count + o_win_count + draw_count
+        
+        if total_count <= 0:
+            steps_with_rate[r][c] = [0.0, 0.0, 0.0, 0.0]
+            continue
+        
+        win_count = x_win_count if player == 1 else o_win_count
+        lose_count = o_win_count if player == 1 else x_win_count
+        steps_with_rate[r][c] = [win_count, lose_count, draw_count, total_count]
+    
+    return steps_with_rate
+
+
+async def best_steps_unlimited_async(currBoard: list[list[int]], player: int, last_move_col: int, last_move_row: int) -> tuple[int, int]:
+    """Bản async của best_steps_unlimited: đánh giá tất cả board 5x5 đồng thời"""
+    start_time = time.time()
+    windows = get_player_windows(currBoard, player, last_move_col, last_move_row)
+    
+    all_steps = await asyncio.gather(*(
+        get_steps_with_rate_async(board_1d_to_2d(get_board_5_x_5(currBoard, r, c)), player)
+        for r, c in windows
+    ))
+    
+    board_accumulated = {}
+    for (r, c), steps_with_rate in zip(windows, all_steps):
+        accumulate_window_rates(currBoard, board_accumulated, r, c, steps_with_rate)
+    
+    print(f"⏱️  Async evaluation: {len(windows)} boards in {time.time() - start_time:.3f}s "
+          f"({async_outcome_flight.stats()['coalesced']} coalesced)")
+    return select_best_move(board_accumulated)
+
 #=========================================Conversion Functions==========================================
 def board_2d_to_1d(board_2d: list[list[int]]) -> list[int]:
     """
@@ -609,6 +929,7 @@ def make_move():
     if game_state['board'][row][col] != 0:
         return jsonify({'error': 'Position occupied'}), 400
     
+    previous_last_move = game_state['last_move']
     game_state['board'][row][col] = 1
     game_state['last_move'] = [row, col]
     game_state['move_count'] += 1
@@ -622,12 +943,33 @@ def make_move():
     game_state['current_player'] = 2
     
     # AI move
-    ai_row, ai_col = best_steps_unlimited(
-        game_state['board'], 
-        2, 
-        game_state['last_move'][1], 
-        game_state['last_move'][0]
-    )
+    # Mọi query của nước đi này được gắn query_id; hết deadline / browser đóng request /
+    # nước đi đã chọn xong thì query còn chạy trên server bị hủy
+    with MoveQueryScope(deadline=MOVE_DEADLINE) as scope:
+        watch_client_disconnect(request.environ, scope)
+        
+        if QUERY_PATH == "async":
+            ai_row, ai_col = async_runner.run(run_in_scope(scope, best_steps_unlimited_async(
+                game_state['board'], 
+                2, 
+                game_state['last_move'][1], 
+                game_state['last_move'][0]
+            )))
+        else:
+            ai_row, ai_col = best_steps_unlimited(
+                game_state['board'], 
+                2, 
+                game_state['last_move'][1], 
+                game_state['last_move'][0]
+            )
+    
+    if scope.cancel_reason == "client disconnected":
+        # Hoàn tác nước đi của human để lần /api/move sau vẫn là lượt của human (không kẹt game)
+        game_state['board'][row][col] = 0
+        game_state['last_move'] = previous_last_move
+        game_state['move_count'] -= 1
+        game_state['current_player'] = 1
+        return jsonify({'error': 'Client disconnected'}), 499
     
     if ai_row == -1 or ai_col == -1:
         import random
@@ -674,6 +1016,7 @@ if __name__ == "__main__":
     print("Win Condition: 5 in a row")
     print("Player 1 (X): Human - YOU GO FIRST!")
     print("Player 2 (O): AI")
+    print(f"Query path: {QUERY_PATH}")
     print("=" * 60)
     print("\n🌐 Open browser: http://localhost:5000")
     print("=" * 60)
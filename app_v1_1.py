@@ -1,6 +1,8 @@
 from flask import Flask, render_template, request, jsonify
 import sys
 
+from query_cancellation import MoveQueryScope, watch_client_disconnect
+
 # Import AI logic
 try:
     from statistic_ai_100_x_100 import best_steps_unlimited
@@ -10,6 +12,7 @@ except ImportError as e:
     sys.exit(1)
 
 app = Flask(__name__)
+MOVE_DEADLINE = 20  # giây
 
 @app.route('/')
 def index():
@@ -27,12 +30,15 @@ def ai_move():
         last_move_col = data.get('last_move_col', 7)
         
         # Chỉ gọi AI và trả về
-        best_row, best_col = best_steps_unlimited(
-            board, 
-            player, 
-            last_move_col,
-            last_move_row
-        )
+        # Query còn chạy bị hủy khi nước đi đã chọn xong, hết deadline hoặc browser đóng request
+        with MoveQueryScope(deadline=MOVE_DEADLINE) as scope:
+            watch_client_disconnect(request.environ, scope)
+            best_row, best_col = best_steps_unlimited(
+                board, 
+                player, 
+                last_move_col,
+                last_move_row
+            )
         
         return jsonify({'row': best_row, 'col': best_col})
         
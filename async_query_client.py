@@ -0,0 +1,255 @@
+import asyncio
+import base64
+import threading
+import time
+import urllib.parse
+
+from query_cancellation import current_move_scope, as_cancelled
+from query_builder import http_params
+from replica_router import ReplicaRouter, EndpointUnavailable
+
+#==========================================Async ClickHouse Client==========================================
+# Minimal HTTP/1.1 client on asyncio streams (standard library only).
+# Connections are kept alive and reused through a bounded pool, so hundreds of COUNT queries
+# can be in flight from one thread. A query that times out or is cancelled closes its
+# connection instead of returning it to the pool, which also makes ClickHouse cancel it
+# (cancel_http_readonly_queries_on_client_close).
+
+
+class ClickHouseQueryError(Exception):
+    pass
+
+
+class _CountQueries:
+    """
+    query_int/query_ints dùng chung cho client một endpoint và client nhiều replica
+    """
+
+    async def query_int(self, sql: str, timeout: float = None, params: dict = None) -> int:
+        """
+        Thực thi SQL query và trả về COUNT, lỗi trả về 0 (giống execute_query)
+        """
+        return (await self.query_ints(sql, columns=1, timeout=timeout, params=params))[0]
+
+    async def query_ints(self, sql: str, columns: int, timeout: float = None, params: dict = None) -> list[int]:
+        """
+        Query trả về 1 dòng nhiều cột số (TabSeparated), lỗi trả về toàn 0
+        Query được gắn query_id của nước đi hiện tại (current_move_scope) nếu có;
+        nước đi đã bị hủy hoặc query timeout thì raise QueryCancelled
+        """
+        params = {**http_params(), **(params or {})}
+        timeout = self.timeout if timeout is None else timeout
+        scope = current_move_scope.get()
+        query_id = None
+        if scope is not None:
+            scope.ensure_active()
+            query_id = scope.begin_query()
+            params["query_id"] = query_id
+            timeout = scope.remaining(timeout)
+
+        try:
+            result = (await self.execute(sql, timeout=timeout, params=params)).strip()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            cancelled = as_cancelled(e, scope)
+            if cancelled is not None:
+                raise cancelled from e
+            print(f"❌ Database error: {e!r}")
+            return [0] * columns
+        finally:
+            if query_id is not None:
+                scope.end_query(query_id)
+        return [int(value) for value in result.split(b"\t")] if result else [0] * columns
+
+
+class AsyncClickHouseClient(_CountQueries):
+    """
+    Async query client với keepalive connection pool, timeout và cancellation cho từng query
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 8123, user: str = "default",
+                 password: str = "", database: str = "default", pool_size: int = 64,
+                 timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._auth = base64.b64encode(f"{user}:{password}".encode()).decode()
+        self._idle = []
+        self._slots = None
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        parsed = urllib.parse.urlparse(url)
+        return cls(host=parsed.hostname or "localhost", port=parsed.port or 8123, **kwargs)
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        # Semaphore phải tạo trong event loop đang chạy
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        return self._slots
+
+    async def _acquire(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return await asyncio.open_connection(self.host, self.port)
+
+    def _release(self, conn, reusable: bool):
+        reader, writer = conn
+        if reusable and not writer.is_closing():
+            self._idle.append(conn)
+        else:
+            writer.close()
+
+    async def _read_body(self, reader, headers: dict) -> bytes:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    # Trailer kết thúc bằng dòng trống
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"]))
+        return await reader.read()
+
+    async def _roundtrip(self, conn, sql: str, params: dict):
+        reader, writer = conn
+        query_string = urllib.parse.urlencode({"database": self.database, **params})
+        body = sql.encode()
+        request = (
+            f"POST /?{query_string} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            f"Authorization: Basic {self._auth}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: keep-alive\r\n"
+            f"\r\n"
+        ).encode() + body
+        writer.write(request)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server")
+        status = int(status_line.split(b" ", 2)[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        payload = await self._read_body(reader, headers)
+        # Body không có Content-Length/chunked thì kết thúc bằng việc server đóng connection: không dùng lại
+        delimited = "content-length" in headers or headers.get("transfer-encoding", "").lower() == "chunked"
+        keep_alive = delimited and headers.get("connection", "keep-alive").lower() != "close"
+        return status, headers, payload, keep_alive
+
+    async def execute(self, sql: str, timeout: float = None, params: dict = None) -> bytes:
+        """
+        Chạy query và trả về raw body
+
+        Args:
+            sql: SQL query string
+            timeout: Timeout (giây) cho query này, mặc định self.timeout
+            params: ClickHouse settings/params thêm vào URL
+
+        Returns:
+            Response body (bytes)
+        """
+        params = {"cancel_http_readonly_queries_on_client_close": 1, **(params or {})}
+        timeout = self.timeout if timeout is None else timeout
+
+        async with self._get_slots():
+            for attempt in range(2):
+                conn = await self._acquire()
+                reusable = False
+                try:
+                    status, headers, payload, reusable = await asyncio.wait_for(
+                        self._roundtrip(conn, sql, params), timeout
+                    )
+                except (ConnectionResetError, asyncio.IncompleteReadError, BrokenPipeError):
+                    # Keepalive connection bị server đóng -> thử lại với connection mới
+                    if attempt == 0:
+                        continue
+                    raise
+                finally:
+                    # Timeout/cancel: đóng connection để server hủy query đang chạy
+                    self._release(conn, reusable)
+
+                if status >= 500:
+                    raise EndpointUnavailable(f"HTTP {status}: {payload.decode(errors='replace').strip()}")
+                if status != 200:
+                    raise ClickHouseQueryError(f"HTTP {status}: {payload.decode(errors='replace').strip()}")
+                return payload
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+class AsyncReplicaClient(_CountQueries):
+    """
+    Client trên nhiều endpoint tương đương: mỗi query đi qua ReplicaRouter (health, latency, hedging)
+    """
+
+    def __init__(self, endpoints: list[str], router: ReplicaRouter = None, timeout: float = 10.0, **kwargs):
+        """
+        Args:
+            endpoints: Danh sách URL (http://host:port)
+            router: ReplicaRouter dùng chung (mặc định tạo mới)
+            kwargs: user, password, database, pool_size cho từng AsyncClickHouseClient
+        """
+        self.timeout = timeout
+        self.router = router or ReplicaRouter(endpoints)
+        self.clients = {url: AsyncClickHouseClient.from_url(url, timeout=timeout, **kwargs) for url in endpoints}
+
+    async def execute(self, sql: str, timeout: float = None, params: dict = None) -> bytes:
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+
+        def attempt(url):
+            # Bản hedge không được chạy quá deadline chung của query
+            return self.clients[url].execute(sql, timeout=max(0.0, timeout - (time.monotonic() - started)), params=params)
+
+        return await self.router.call_async(attempt, timeout)
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
+
+
+class AsyncQueryRunner:
+    """
+    Event loop chạy nền trong một thread riêng, để code sync (Flask route) gọi được coroutine
+    Client và connection pool sống cùng loop này giữa các request
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="clickhouse-async", daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout: float = None):
+        """
+        Chạy coroutine trên loop nền và chờ kết quả (block thread gọi)
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
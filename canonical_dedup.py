@@ -0,0 +1,236 @@
+import hashlib
+import itertools
+import math
+import threading
+
+import numpy as np
+
+from query_builder import N, TRANSFORM_TARGETS
+
+#==========================================Canonical Dedup==========================================
+# Mỗi trạng thái chỉ nên có một row: cùng canonical form = cùng trạng thái, dù row đến từ lần chạy lại,
+# hai CSV chồng nhau hay data sinh lại. Khi ingest, CanonicalDedup nhớ các key đã gửi và bỏ row trùng
+# trước khi chúng tới server, với bộ nhớ giới hạn:
+#   exact  các run uint64 đã sort (8 byte/key) khi còn vừa memory budget, không bao giờ bỏ nhầm. Mỗi batch key
+#          mới là một run; run cuối được gộp vào run trước khi không còn nhỏ hơn một nửa (kích thước giảm
+#          theo cấp số nhân, như LSM), nên chỉ có O(log n) run và mỗi key bị gộp O(log n) lần thay vì
+#          sort lại toàn bộ tập key ở mỗi batch
+#   bloom  vượt budget thì chuyển sang Bloom filter cùng kích thước: bộ nhớ cố định, đổi lại một tỉ lệ nhỏ
+#          row mới bị coi là trùng (false positive, ước lượng trong describe())
+# Key là canonical key (x_mask | o_mask << 25 của canonical board, tính lại từ các ô nên không phụ thuộc
+# orientation lưu trong file), hoặc hash 64-bit của canonical_form khi chỉ đọc CSV theo dòng.
+# Một instance cho mỗi table đích trong một lần ingest (các file cùng đổ vào một table dùng chung), và
+# table luôn trống khi load bắt đầu (ingest_old.plan_load), nên tập key phủ mọi row của table.
+
+CELLS = N * N
+DEFAULT_DEDUP_MB = 512
+MAX_HASHES = 12
+# Ô idx sang vị trí targets[idx] của mỗi phép biến đổi: trọng số base-3 (ô đầu là chữ số cao nhất,
+# so sánh số = so sánh lexicographic của board) và bit của vị trí mới
+TRANSFORM_BASE3 = np.array([[3 ** (CELLS - 1 - t[idx]) for t in TRANSFORM_TARGETS] for idx in range(CELLS)], dtype=np.uint64)
+TRANSFORM_BITS = np.array([[1 << t[idx] for t in TRANSFORM_TARGETS] for idx in range(CELLS)], dtype=np.uint64)
+SHIFT_O = np.uint64(CELLS)
+BLOOM_SEEDS = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xD1B54A32D192ED03))
+
+
+def canonical_keys(x_mask: np.ndarray, o_mask: np.ndarray) -> np.ndarray:
+    """
+    Canonical key của từng board: orientation nhỏ nhất theo lexicographic trong 8 phép biến đổi
+    (giống canonical_board), đóng gói như bitboard_mask
+
+    Args:
+        x_mask, o_mask: Bitmask uint64 quân X/O
+
+    Returns:
+        Mảng uint64 x_mask | o_mask << 25 của canonical board
+    """
+    n = len(x_mask)
+    order = np.zeros((n, len(TRANSFORM_TARGETS)), dtype=np.uint64)
+    x_t = np.zeros_like(order)
+    o_t = np.zeros_like(order)
+    one = np.uint64(1)
+    for idx in range(CELLS):
+        x_bit = (x_mask >> np.uint64(idx)) & one
+        o_bit = (o_mask >> np.uint64(idx)) & one
+        order += (x_bit + (o_bit << one))[:, None] * TRANSFORM_BASE3[idx]
+        x_t |= x_bit[:, None] * TRANSFORM_BITS[idx]
+        o_t |= o_bit[:, None] * TRANSFORM_BITS[idx]
+    best = order.argmin(axis=1)
+    rows = np.arange(n)
+    return x_t[rows, best] | (o_t[rows, best] << SHIFT_O)
+
+
+def form_key(canonical_form: bytes) -> int:
+    """
+    Hash 64-bit của canonical_form (field đầu của một dòng CSV)
+    """
+    return int.from_bytes(hashlib.blake2b(canonical_form, digest_size=8).digest(), "little")
+
+
+def _mix(keys: np.ndarray, seed: np.uint64) -> np.ndarray:
+    # splitmix64: key gần nhau (bitboard) vẫn rải đều trên bit array
+    z = keys + seed
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+class CanonicalDedup:
+    """
+    Tập key đã gặp của một table đích, bộ nhớ tối đa khoảng memory_mb
+    """
+
+    def __init__(self, memory_mb: int = DEFAULT_DEDUP_MB, expected: int = 0):
+        self.budget = max(1, memory_mb) * 1024 * 1024
+        self.expected = expected
+        self._lock = threading.Lock()
+        self.runs = []
+        self.bits = None
+        self.num_bits = 0
+        self.num_hashes = 0
+        self.stored = 0
+        self.rows = 0
+        self.dropped = 0
+
+    @property
+    def mode(self) -> str:
+        return "exact" if self.bits is None else "bloom"
+
+    def _exact_contains(self, keys: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(keys), dtype=bool)
+        for run in self.runs:
+            pos = np.minimum(np.searchsorted(run, keys), len(run) - 1)
+            found |= run[pos] == keys
+        return found
+
+    def _exact_add(self, keys: np.ndarray):
+        # keys đã sort (np.unique) và chưa có trong run nào
+        if len(keys) == 0:
+            return
+        self.runs.append(keys)
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            # Hai run đã sort: stable sort (timsort) nhận ra hai đoạn và chỉ còn là một lần merge
+            self.runs[-1] = np.sort(np.concatenate((self.runs[-1], last)), kind="stable")
+
+    def _to_bloom(self):
+        self.num_bits = self.budget * 8
+        capacity = max(self.expected, 2 * self.stored)
+        self.num_hashes = max(1, min(MAX_HASHES, round(self.num_bits / capacity * math.log(2))))
+        self.bits = np.zeros(self.budget, dtype=np.uint8)
+        runs, self.runs = self.runs, []
+        for run in runs:
+            self._bloom_add(run)
+
+    def _positions(self, keys: np.ndarray):
+        h1 = _mix(keys, BLOOM_SEEDS[0])
+        h2 = _mix(keys, BLOOM_SEEDS[1]) | np.uint64(1)
+        for i in range(self.num_hashes):
+            yield (h1 + np.uint64(i) * h2) % np.uint64(self.num_bits)
+
+    def _bloom_contains(self, keys: np.ndarray) -> np.ndarray:
+        found = np.ones(len(keys), dtype=bool)
+        for pos in self._positions(keys):
+            found &= (self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1 == 1
+        return found
+
+    def _bloom_add(self, keys: np.ndarray):
+        for pos in self._positions(keys):
+            np.bitwise_or.at(self.bits, pos >> np.uint64(3), np.left_shift(1, (pos & np.uint64(7)).astype(np.uint8)).astype(np.uint8))
+
+    def filter(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Đánh dấu row cần giữ và ghi nhớ key của chúng
+
+        Args:
+            keys: Key uint64 của một batch row theo thứ tự trong file
+
+        Returns:
+            Mask bool: True ở lần xuất hiện đầu tiên của key chưa gặp
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        unique, first = np.unique(keys, return_index=True)
+        # Các file cùng table đích có thể được load song song trên nhiều thread
+        with self._lock:
+            if self.bits is None:
+                new = ~self._exact_contains(unique)
+                self._exact_add(unique[new])
+                self.stored += int(new.sum())
+                if self.stored * 8 > self.budget:
+                    self._to_bloom()
+            else:
+                new = ~self._bloom_contains(unique)
+                self._bloom_add(unique[new])
+                self.stored += int(new.sum())
+            self.rows += len(keys)
+            self.dropped += len(keys) - int(new.sum())
+        keep = np.zeros(len(keys), dtype=bool)
+        keep[first[new]] = True
+        return keep
+
+    def false_positive_rate(self) -> float:
+        if self.bits is None:
+            return 0.0
+        return (1 - math.exp(-self.num_hashes * self.stored / self.num_bits)) ** self.num_hashes
+
+    def describe(self) -> str:
+        text = f"dedup {self.dropped:,}/{self.rows:,} rows dropped ({self.mode}"
+        if self.bits is not None:
+            text += f", ~{self.false_positive_rate():.2e} false-positive rate"
+        return text + ")"
+
+
+class DedupLineReader:
+    """
+    File-like (chỉ read) trên một CSV stream: bỏ các dòng có canonical_form (field đầu tiên) đã gặp
+    """
+
+    def __init__(self, f, dedup: CanonicalDedup, block_bytes: int = 4 * 1024 * 1024):
+        self._f = f
+        self.dedup = dedup
+        self.block_bytes = block_bytes
+        self._carry = b""
+        self._out = bytearray()
+        self._eof = False
+
+    def _fill(self):
+        block = self._f.read(self.block_bytes)
+        if not block:
+            self._eof = True
+            block, self._carry = self._carry, b""
+        else:
+            block = self._carry + block
+            cut = block.rfind(b"\n")
+            if cut < 0:
+                self._carry = block
+                return
+            block, self._carry = block[:cut], block[cut + 1:]
+        lines = [line for line in block.split(b"\n") if line.strip()]
+        if not lines:
+            return
+        keys = np.fromiter(
+            (form_key(line.split(b",", 1)[0].strip().strip(b'"')) for line in lines),
+            dtype=np.uint64, count=len(lines),
+        )
+        kept = list(itertools.compress(lines, self.dedup.filter(keys)))
+        if kept:
+            self._out += b"\n".join(kept) + b"\n"
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._out) < size):
+            self._fill()
+        if size < 0 or size > len(self._out):
+            size = len(self._out)
+        data = bytes(self._out[:size])
+        del self._out[:size]
+        return data
+
+
+def duplicate_ratio_query(table: str, key_column: str) -> str:
+    """
+    rows, số key khác nhau và tỉ lệ row thừa của một table (đọc cả table, dùng sau khi load)
+    """
+    return (
+        f"SELECT count() AS rows, uniqExact({key_column}) AS unique_keys, "
+        f"if(rows = 0, 0, 1 - unique_keys / rows) AS duplicate_ratio FROM {table}"
+    )
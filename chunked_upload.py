@@ -0,0 +1,279 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from ingest_telemetry import PROGRESS_PARAMS, parse_summary, merge_summaries
+
+#==========================================Chunked, Resumable CSV Upload==========================================
+# Một file CSV lớn được chia thành các khoảng byte cắt đúng đầu dòng, mỗi khoảng là một INSERT độc lập
+# chạy song song. Mỗi INSERT mang insert_deduplication_token suy ra từ (table, file, size, mtime, khoảng byte),
+# nên gửi lại một khoảng đã commit (retry sau khi mất kết nối, hoặc chạy lại) không tạo row trùng.
+# Khoảng đã xong được ghi vào checkpoint <csv>.checkpoint.json; chạy lại chỉ gửi các khoảng còn thiếu.
+# Token còn kèm load_id của checkpoint: load lại từ đầu (restart, sau TRUNCATE) có token mới nên không bị
+# server bỏ qua như block trùng của lần load trước.
+# Checkpoint có khoảng đã commit nhưng file (size/mtime) hoặc chunk size đã đổi thì không tiếp tục được:
+# khoảng byte và token khác đi nên gửi lại sẽ nhân đôi rows -> StaleCheckpoint, phải --restart (TRUNCATE).
+
+DEFAULT_CHUNK_BYTES = 256 * 1024 * 1024
+PIECE_BYTES = 1024 * 1024           # đọc/gửi mỗi khoảng theo từng miếng 1MB
+MAX_INSERT_BLOCK_SIZE = 1_000_000   # cố định để block của một khoảng giống hệt nhau giữa các lần gửi
+DEDUP_WINDOW = 10_000               # non_replicated_deduplication_window cho MergeTree thường
+RETRIES = 3
+REQUEST_TIMEOUT = 600
+
+
+def split_line_ranges(csv_path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> list[tuple[int, int]]:
+    """
+    Chia file thành các khoảng [start, end) khoảng chunk_bytes, mỗi khoảng kết thúc ở cuối một dòng
+
+    Returns:
+        Danh sách (start, end) phủ kín file
+    """
+    size = os.path.getsize(csv_path)
+    ranges = []
+    start = 0
+    with open(csv_path, "rb") as f:
+        while start < size:
+            end = start + chunk_bytes
+            if end >= size:
+                end = size
+            else:
+                f.seek(end)
+                f.readline()  # đi tiếp tới hết dòng đang dở
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+class StaleCheckpoint(Exception):
+    pass
+
+
+def checkpoint_path(csv_path: str) -> str:
+    return f"{csv_path}.checkpoint.json"
+
+
+def file_identity(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_checkpoint(csv_path: str, table: str) -> dict:
+    """
+    Checkpoint của file cho table này nếu đã có ít nhất một khoảng commit, ngược lại None
+    """
+    path = checkpoint_path(csv_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("table") != table or not data.get("done"):
+        return None
+    return data
+
+
+def checkpoint_state(csv_path: str, table: str, chunk_bytes: int) -> str:
+    """
+    "missing" (chưa có khoảng nào commit), "usable" (tiếp tục được) hoặc "stale" (file/chunk size đã đổi)
+    """
+    data = read_checkpoint(csv_path, table)
+    if data is None:
+        return "missing"
+    if data.get("file") != file_identity(csv_path) or data.get("chunk_bytes") != chunk_bytes:
+        return "stale"
+    return "usable"
+
+
+def load_checkpoint(csv_path: str, table: str, chunk_bytes: int) -> tuple[str, dict]:
+    """
+    load_id và các khoảng đã commit ở lần chạy trước {(start, end): rows}
+    Chưa có checkpoint thì trả về load_id mới và chưa có khoảng nào
+
+    Raises:
+        StaleCheckpoint: Đã có khoảng commit vào table nhưng file hoặc chunk size đã đổi
+    """
+    data = read_checkpoint(csv_path, table)
+    if data is None:
+        return uuid.uuid4().hex[:12], {}
+    if data.get("file") != file_identity(csv_path):
+        changed = "the file changed (size/mtime)"
+    elif data.get("chunk_bytes") != chunk_bytes:
+        changed = f"it was uploaded with --chunk-mb {data.get('chunk_bytes', 0) // (1024 * 1024)}"
+    else:
+        return data.get("load_id", ""), {(start, end): rows for start, end, rows in data["done"]}
+    raise StaleCheckpoint(
+        f"{os.path.basename(csv_path)}: {len(data['done'])} chunk(s) already committed to {table} but {changed}; "
+        f"resending would duplicate them. Rerun with --restart to truncate and reload"
+    )
+
+
+def save_checkpoint(csv_path: str, table: str, chunk_bytes: int, load_id: str, done: dict, total: int):
+    path = checkpoint_path(csv_path)
+    data = {
+        "file": file_identity(csv_path),
+        "table": table,
+        "chunk_bytes": chunk_bytes,
+        "load_id": load_id,
+        "total_ranges": total,
+        "done": sorted([start, end, rows] for (start, end), rows in done.items()),
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)  # không bao giờ để lại checkpoint ghi dở
+
+
+def dedup_token(csv_path: str, table: str, start: int, end: int, load_id: str) -> str:
+    identity = file_identity(csv_path)
+    return f"{table}:{os.path.basename(csv_path)}:{identity['size']}:{identity['mtime_ns']}:{load_id}:{start}-{end}"
+
+
+def enable_deduplication(url: str, table: str, auth=None, params: dict = None, log=print):
+    """
+    MergeTree không replicated chỉ dedup khi bật non_replicated_deduplication_window
+    """
+    response = requests.post(
+        url,
+        params=params,
+        data=f"ALTER TABLE {table} MODIFY SETTING non_replicated_deduplication_window = {DEDUP_WINDOW}".encode(),
+        auth=auth,
+        timeout=60,
+    )
+    if response.status_code != 200:
+        log(f"⚠️  Could not enable deduplication on {table} (retries may duplicate rows): {response.text.strip()}")
+
+
+def _range_body(f, start: int, end: int, budget, on_progress):
+    # Mỗi thread mở file riêng; budget (ByteBudget của ingest_old) giới hạn bytes đang bay
+    f.seek(start)
+    remaining = end - start
+    held = 0
+    try:
+        while remaining > 0:
+            if budget is not None:
+                budget.release(held)
+                held = 0
+                budget.acquire(PIECE_BYTES)
+                held = PIECE_BYTES
+            piece = f.read(min(PIECE_BYTES, remaining))
+            if not piece:
+                return
+            remaining -= len(piece)
+            yield piece
+            if on_progress is not None:
+                on_progress(len(piece))
+    finally:
+        if budget is not None:
+            budget.release(held)
+
+
+def upload_range(csv_path: str, url: str, table: str, start: int, end: int, load_id: str, auth=None,
+                 params: dict = None, budget=None, on_progress=None) -> dict:
+    """
+    Gửi một khoảng byte thành một INSERT, retry khi lỗi kết nối/5xx (token giữ nguyên nên không trùng)
+
+    Returns:
+        Summary server trả về (ingest_telemetry.parse_summary), {} nếu server không gửi
+    """
+    query_params = {
+        **(params or {}),
+        **PROGRESS_PARAMS,
+        "query": f"INSERT INTO {table} FORMAT CSV",
+        "insert_deduplicate": 1,
+        "insert_deduplication_token": dedup_token(csv_path, table, start, end, load_id),
+        "max_insert_block_size": MAX_INSERT_BLOCK_SIZE,
+    }
+    for attempt in range(RETRIES):
+        try:
+            with open(csv_path, "rb") as f:
+                response = requests.post(
+                    url,
+                    params=query_params,
+                    data=_range_body(f, start, end, budget, on_progress),
+                    auth=auth,
+                    timeout=REQUEST_TIMEOUT,
+                )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = str(e)
+        else:
+            if response.status_code == 200:
+                return parse_summary(response.headers)
+            error = f"HTTP {response.status_code} - {response.text.strip()}"
+            if response.status_code < 500:
+                raise Exception(error)
+        if attempt < RETRIES - 1:
+            time.sleep(2 ** attempt)
+    raise Exception(f"bytes {start}-{end}: {error}")
+
+
+def upload_csv_chunked(csv_path: str, url: str, table: str, auth=None, params: dict = None,
+                       chunk_bytes: int = DEFAULT_CHUNK_BYTES, workers: int = 4, budget=None,
+                       restart: bool = False, on_progress=None, log=print) -> tuple[int, float, int, dict]:
+    """
+    Upload một CSV bằng các INSERT song song theo khoảng byte, tiếp tục từ checkpoint nếu có
+
+    Args:
+        csv_path: File CSV
+        url: ClickHouse HTTP endpoint
+        table: Table đích
+        auth, params: Thông tin đăng nhập (auth tuple hoặc user/password trong params)
+        chunk_bytes: Kích thước mỗi khoảng
+        workers: Số INSERT chạy song song cho file này
+        budget: Giới hạn bytes đang bay dùng chung (acquire/release), None = không giới hạn
+        restart: Bỏ checkpoint cũ, gửi lại toàn bộ (table phải đã được TRUNCATE)
+        on_progress: Callback(bytes) sau mỗi miếng đã gửi (và cho các khoảng đã xong từ trước)
+
+    Returns:
+        (bytes gửi trong lần chạy này, số giây, tổng rows của các khoảng đã commit hoặc None nếu không biết,
+         summary gộp của các INSERT trong lần chạy này)
+    """
+    started = time.monotonic()
+    ranges = split_line_ranges(csv_path, chunk_bytes)
+    # restart: caller đã TRUNCATE table, checkpoint cũ (kể cả stale) không còn ý nghĩa
+    load_id, done = (uuid.uuid4().hex[:12], {}) if restart else load_checkpoint(csv_path, table, chunk_bytes)
+    valid = set(ranges)
+    done = {r: rows for r, rows in done.items() if r in valid}
+    pending = [r for r in ranges if r not in done]
+    if done:
+        log(f"↻ {os.path.basename(csv_path)}: resuming, {len(done)}/{len(ranges)} chunk(s) already committed")
+        if on_progress is not None:
+            on_progress(sum(end - start for start, end in done))
+    if not pending:
+        return 0, time.monotonic() - started, total_rows(done), {}
+
+    enable_deduplication(url, table, auth, {k: v for k, v in (params or {}).items() if k != "query"}, log)
+
+    failures = []
+    summaries = []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="chunk") as executor:
+        futures = {
+            executor.submit(upload_range, csv_path, url, table, start, end, load_id, auth, params, budget, on_progress): (start, end)
+            for start, end in pending
+        }
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                failures.append(str(e))
+                continue
+            summaries.append(summary)
+            done[futures[future]] = summary.get("written_rows")
+            save_checkpoint(csv_path, table, chunk_bytes, load_id, done, len(ranges))
+
+    if failures:
+        raise Exception(f"{len(failures)}/{len(ranges)} chunk(s) failed, rerun to resume: {failures[0]}")
+    return sum(end - start for start, end in pending), time.monotonic() - started, total_rows(done), merge_summaries(summaries)
+
+
+def total_rows(done: dict) -> int:
+    if any(rows is None for rows in done.values()):
+        return None
+    return sum(done.values())
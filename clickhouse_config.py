@@ -0,0 +1,9 @@
+#==========================================ClickHouse Connection==========================================
+# Cấu hình kết nối dùng chung cho web server và các query path (app, native_query, query_builder,
+# query_cancellation): sửa endpoint/mật khẩu ở đây thay vì trong từng module.
+
+# Các endpoint đọc tương đương (replica, hoặc mọi node của docker-compose.cluster.yml: thêm "http://localhost:8124")
+CLICKHOUSE_HTTP = ["http://localhost:8123"]
+CLICKHOUSE_USER = "default"
+CLICKHOUSE_PASS = "admin"
+DATABASE = "tictactoe"
@@ -1,13 +1,24 @@
 import os
+import json
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from tqdm import tqdm
 
+from query_builder import CENTER_FIRST_COLUMNS, CENTER_FIRST_KEY, SELECTIVITY_STATS_PATH, CONSOLIDATED_READY_COMMENT
+from schema_generator import COMPACT_DATABASE, render_create_table, with_engine, packed_key_expr, cell_value_expr
+from canonical_dedup import duplicate_ratio_query
+from position_filter import PositionFilterBuilder, DEFAULT_FILTER_PATH, DEFAULT_MAX_STONES, DEFAULT_FP_RATE, FILTER_TABLES
+
 # --- Thông tin kết nối ClickHouse ---
 CLICKHOUSE_HTTP = "http://localhost:8123"
 CLICKHOUSE_USER = "default"
 CLICKHOUSE_PASS = "admin"
 DATABASE = "tictactoe"
 SCHEMA_FOLDER = "schema"
+CELL_COLUMNS = [f"i{r}{c}" for r in range(1, 6) for c in range(1, 6)]
+CONSOLIDATED_TABLE = "ttt_5_outcomes"
+DRAW_LEVEL = 25  # Hòa = bàn cờ đầy 25 quân
 
 def create_database():
     """
@@ -30,12 +41,13 @@ def create_database():
     return True
 
 
-def create_table_from_sql_file(sql_file: str):
+def create_table_from_sql_file(sql_file: str, engine: str = "mergetree"):
     """
     Tạo table từ file SQL
     
     Args:
         sql_file: Đường dẫn đến file SQL
+        engine: mergetree (như trong file) | replacing (ReplacingMergeTree, gộp row trùng khi merge)
     
     Returns:
         True nếu thành công, False nếu thất bại
@@ -49,7 +61,7 @@ def create_table_from_sql_file(sql_file: str):
         sql_schema = f.read()
     
     # Convert \n literals thành newlines thật
-    create_table_query = sql_schema.replace('\\n', '\n')
+    create_table_query = with_engine(sql_schema.replace('\\n', '\n'), engine)
     
     response = requests.post(
         CLICKHOUSE_HTTP,
@@ -133,12 +145,13 @@ def drop_table(table_name: str):
         print(f"❌ Failed to drop table: {response.text}")
 
 
-def create_all_tables(recreate: bool = False):
+def create_all_tables(recreate: bool = False, engine: str = "mergetree"):
     """
     Tạo tất cả tables từ schema files
     
     Args:
         recreate: Nếu True, xóa và tạo lại tables đã tồn tại
+        engine: mergetree | replacing
     
     Returns:
         Tuple (success_count, fail_count)
@@ -188,7 +201,7 @@ def create_all_tables(recreate: bool = False):
                 continue
         
         # Tạo table
-        if create_table_from_sql_file(sql_file):
+        if create_table_from_sql_file(sql_file, engine):
             success_count += 1
             print(f"✅ Created: {table_name}")
         else:
@@ -264,6 +277,502 @@ def show_all_tables():
         print(f"❌ Failed to show tables: {response.text}")
 
 
+def stream_board_rows(table_name: str, batch_rows: int = 256):
+    """
+    Stream tất cả board của table dưới dạng numpy array (0 = trống, 1 = X, 2 = O)
+    
+    Args:
+        table_name: Tên table
+        batch_rows: Số rows mỗi batch
+    
+    Yields:
+        uint8 array shape (batch_rows, 25)
+    """
+    cells = ", ".join(f"multiIf({col} = 'X', 1, {col} = 'O', 2, 0)::UInt8" for col in CELL_COLUMNS)
+    query = f"SELECT {cells} FROM {DATABASE}.{table_name} FORMAT RowBinary"
+    
+    with requests.post(
+        CLICKHOUSE_HTTP,
+        auth=(CLICKHOUSE_USER, CLICKHOUSE_PASS),
+        data=query,
+        stream=True
+    ) as response:
+        if response.status_code != 200:
+            print(f"❌ Failed to read {table_name}: {response.text}")
+            return
+        
+        # RowBinary: mỗi row đúng 25 byte UInt8
+        batch_bytes = batch_rows * len(CELL_COLUMNS)
+        buffer = b""
+        for chunk in response.iter_content(chunk_size=batch_bytes):
+            buffer += chunk
+            while len(buffer) >= batch_bytes:
+                yield np.frombuffer(buffer[:batch_bytes], dtype=np.uint8).reshape(-1, len(CELL_COLUMNS))
+                buffer = buffer[batch_bytes:]
+        if buffer:
+            yield np.frombuffer(buffer, dtype=np.uint8).reshape(-1, len(CELL_COLUMNS))
+
+
+def build_position_filter(path: str = DEFAULT_FILTER_PATH, max_stones: int = DEFAULT_MAX_STONES,
+                          fp_rate: float = DEFAULT_FP_RATE):
+    """
+    Build Bloom filter các partial position có ít nhất 1 terminal game khớp
+    
+    Args:
+        path: File output (AI load file này lúc khởi động)
+        max_stones: Số quân tối đa của mỗi sub-pattern lưu trong filter
+        fp_rate: False-positive rate mong muốn
+    """
+    print("\n" + "=" * 70)
+    print(f"🧮 Building position filter (max_stones={max_stones}, fp_rate={fp_rate})")
+    print("=" * 70)
+    
+    builder = PositionFilterBuilder(max_stones=max_stones)
+    row_counts = {}
+    
+    for table_name in FILTER_TABLES:
+        if not check_table_exists(table_name):
+            print(f"⏭️  Table '{table_name}' missing, skipping...")
+            continue
+        
+        total = get_table_count(table_name)
+        row_counts[table_name] = total
+        with tqdm(total=total, desc=table_name, unit="rows") as pbar:
+            for rows in stream_board_rows(table_name):
+                builder.add_rows(rows)
+                pbar.update(len(rows))
+    
+    # AI chỉ dùng filter khi total_rows của các table vẫn bằng số rows lúc build
+    position_filter = builder.build(fp_rate, row_counts)
+    position_filter.save(path)
+    
+    print(f"✅ Scanned {builder.rows_seen:,} rows, {len(builder.keys):,} distinct sub-patterns")
+    print(f"✅ Filter saved to {path} ({len(position_filter.bits) / 1024 / 1024:.1f} MB, "
+          f"{position_filter.num_hashes} hashes)")
+
+
+def run_query(query: str) -> tuple[bool, str]:
+    """
+    Chạy một câu lệnh, trả về (thành công, response text)
+    """
+    response = requests.post(
+        CLICKHOUSE_HTTP,
+        auth=(CLICKHOUSE_USER, CLICKHOUSE_PASS),
+        data=query
+    )
+    return response.status_code == 200, response.text.strip()
+
+
+def get_migration_sources() -> list[tuple[str, int, str]]:
+    """
+    Danh sách (table cũ, level, win_actor) cần chuyển vào bảng gộp
+    """
+    sources = [(f"ttt_5_l{layer}", layer, 'X' if layer % 2 == 1 else 'O') for layer in range(9, 26)]
+    sources.append(("ttt_5_draw", DRAW_LEVEL, 'D'))
+    return sources
+
+
+def migrate_source(table_name: str, level: int, win_actor: str) -> tuple[str, str, int]:
+    """
+    INSERT ... SELECT một table cũ vào partition level tương ứng của bảng gộp
+    
+    Returns:
+        (table_name, status, rows)
+    """
+    if not check_table_exists(table_name):
+        return (table_name, "missing", 0)
+    
+    # Chỉ rows có win_actor đúng của level mới được chuyển, nên đếm nguồn với cùng filter
+    ok, source = run_query(f"SELECT count() FROM {DATABASE}.{table_name} WHERE win_actor = '{win_actor}'")
+    if not ok:
+        return (table_name, f"failed: {source[:200]}", 0)
+    source_count = int(source)
+    ok, migrated = run_query(
+        f"SELECT count() FROM {DATABASE}.{CONSOLIDATED_TABLE} "
+        f"WHERE level = {level} AND win_actor = '{win_actor}'"
+    )
+    if not ok:
+        return (table_name, f"failed: {migrated[:200]}", 0)
+    migrated_count = int(migrated)
+    
+    if migrated_count == source_count:
+        return (table_name, "skipped", migrated_count)
+    if migrated_count > 0:
+        # Partition đã có một phần data -> không chèn thêm để tránh trùng
+        return (table_name, "partial (use --recreate)", migrated_count)
+    
+    columns = ", ".join(["canonical_form", "win_actor"] + CELL_COLUMNS)
+    ok, text = run_query(
+        f"INSERT INTO {DATABASE}.{CONSOLIDATED_TABLE} (level, {columns}) "
+        f"SELECT {level} AS level, {columns} FROM {DATABASE}.{table_name} "
+        f"WHERE win_actor = '{win_actor}'"
+    )
+    if not ok:
+        return (table_name, f"failed: {text[:200]}", 0)
+    return (table_name, "migrated", source_count)
+
+
+def migrate_to_consolidated(recreate: bool = False, workers: int = 4):
+    """
+    Chuyển 18 table ttt_5_* vào một bảng gộp có cột level, PARTITION BY level
+    Mỗi table cũ là một INSERT ... SELECT, chạy song song.
+    Bảng gộp chỉ được đánh dấu hoàn tất (CONSOLIDATED_READY_COMMENT) khi không còn table nào lỗi/dở dang
+    
+    Args:
+        recreate: Xóa và tạo lại bảng gộp trước khi migrate
+        workers: Số INSERT chạy song song
+    """
+    print("=" * 70)
+    print(f"🚚 Migrating ttt_5_* tables into {DATABASE}.{CONSOLIDATED_TABLE}")
+    print("=" * 70)
+    
+    if not create_database():
+        return
+    
+    if recreate and check_table_exists(CONSOLIDATED_TABLE):
+        drop_table(CONSOLIDATED_TABLE)
+    
+    if not check_table_exists(CONSOLIDATED_TABLE):
+        if not create_table_from_sql_file(os.path.join(SCHEMA_FOLDER, f"{CONSOLIDATED_TABLE}.sql")):
+            return
+        print(f"✅ Created: {CONSOLIDATED_TABLE}")
+    
+    # Bỏ dấu hoàn tất trong lúc migrate: app quay về đọc các table cũ cho tới khi xong
+    ok, text = run_query(f"ALTER TABLE {DATABASE}.{CONSOLIDATED_TABLE} MODIFY COMMENT ''")
+    if not ok:
+        print(f"❌ Failed to clear migration marker: {text[:200]}")
+        return
+    
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(migrate_source, *source) for source in get_migration_sources()]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Migrating"):
+            results.append(future.result())
+    
+    print(f"\n{'Table Name':<20} {'Status':<28} {'Rows':<15}")
+    print("-" * 65)
+    for table_name, status, rows in sorted(results):
+        print(f"{table_name:<20} {status:<28} {rows:,}")
+    print("-" * 65)
+    total = get_table_count(CONSOLIDATED_TABLE)
+    print(f"{'Total':<20} {'':<28} {total:,}")
+    print("=" * 70)
+    
+    incomplete = [table_name for table_name, status, _ in results if status not in ("migrated", "skipped", "missing")]
+    if incomplete:
+        print(f"⚠️  Not marked complete ({', '.join(sorted(incomplete))}); app keeps reading the ttt_5_* tables")
+        return
+    ok, text = run_query(
+        f"ALTER TABLE {DATABASE}.{CONSOLIDATED_TABLE} MODIFY COMMENT '{CONSOLIDATED_READY_COMMENT}{total}'"
+    )
+    if ok:
+        print(f"✅ Marked {CONSOLIDATED_TABLE} complete; app reads it from now on")
+    else:
+        print(f"❌ Failed to mark migration complete: {text[:200]}")
+
+
+def optimize_table_layout(table_name: str) -> bool:
+    """
+    Thêm projection center_first (ORDER BY tâm + vòng trong) và set index cho các ô vòng ngoài,
+    để query partial board đọc ít granule thay vì full scan theo canonical_form
+    
+    Args:
+        table_name: Tên table
+    
+    Returns:
+        True nếu tất cả ALTER thành công
+    """
+    key = ", ".join(CENTER_FIRST_KEY)
+    statements = [
+        f"ALTER TABLE {DATABASE}.{table_name} ADD PROJECTION IF NOT EXISTS center_first "
+        f"(SELECT * ORDER BY ({key}))",
+        f"ALTER TABLE {DATABASE}.{table_name} MATERIALIZE PROJECTION center_first",
+    ]
+    for col in CENTER_FIRST_COLUMNS[len(CENTER_FIRST_KEY):]:
+        statements.append(
+            f"ALTER TABLE {DATABASE}.{table_name} ADD INDEX IF NOT EXISTS idx_{col} {col} TYPE set(3) GRANULARITY 1"
+        )
+        statements.append(f"ALTER TABLE {DATABASE}.{table_name} MATERIALIZE INDEX idx_{col}")
+    
+    for statement in statements:
+        ok, text = run_query(statement)
+        if not ok:
+            print(f"❌ {table_name}: {text[:200]}")
+            return False
+    return True
+
+
+def optimize_all_layouts():
+    """
+    Áp dụng projection center_first + set index cho tất cả ttt_5_* tables
+    (bảng gộp ttt_5_outcomes đã có sẵn ORDER BY center-first trong schema)
+    """
+    print("=" * 70)
+    print("🧭 Adding center-first projections and set indexes")
+    print("=" * 70)
+    
+    tables = ["ttt_5_draw"] + [f"ttt_5_l{layer}" for layer in range(9, 26)]
+    done = 0
+    for table_name in tqdm(tables, desc="Optimizing"):
+        if not check_table_exists(table_name):
+            print(f"⏭️  Table '{table_name}' missing, skipping...")
+            continue
+        if optimize_table_layout(table_name):
+            done += 1
+    
+    print(f"✅ Optimized {done}/{len(tables)} tables (projections materialize in background mutations)")
+
+
+def build_compact_tables(cell_type: str = "enum8", recreate: bool = False, workers: int = 4,
+                         engine: str = "mergetree"):
+    """
+    Tạo bản compact của tất cả ttt_5_* tables trong database tictactoe_compact
+    (canonical_key UInt64 thay cho String, cell Enum8/UInt8, codec cho từng cột)
+    và copy data từ layout cũ bằng INSERT ... SELECT
+    
+    Args:
+        cell_type: enum8 | uint8
+        recreate: Xóa và tạo lại compact tables
+        workers: Số INSERT chạy song song
+        engine: mergetree | replacing
+    """
+    print("=" * 70)
+    print(f"🗜️  Building compact layout in '{COMPACT_DATABASE}' (cells: {cell_type})")
+    print("=" * 70)
+    
+    ok, text = run_query(f"CREATE DATABASE IF NOT EXISTS {COMPACT_DATABASE}")
+    if not ok:
+        print(f"❌ Failed to create database: {text}")
+        return
+    
+    cells = ", ".join(cell_value_expr(col, cell_type) for col in CELL_COLUMNS)
+    key = packed_key_expr()
+    
+    def copy_table(table_name: str) -> tuple[str, str]:
+        if not check_table_exists(table_name):
+            return (table_name, "missing")
+        if recreate:
+            run_query(f"DROP TABLE IF EXISTS {COMPACT_DATABASE}.{table_name}")
+        ok, exists = run_query(f"EXISTS TABLE {COMPACT_DATABASE}.{table_name}")
+        if ok and exists == "1":
+            return (table_name, "exists (use --recreate)")
+        
+        ok, text = run_query(render_create_table(table_name, "compact", COMPACT_DATABASE, cell_type, engine))
+        if not ok:
+            return (table_name, f"create failed: {text[:200]}")
+        ok, text = run_query(
+            f"INSERT INTO {COMPACT_DATABASE}.{table_name} "
+            f"SELECT {key} AS canonical_key, toString(win_actor) AS win_actor, {cells} "
+            f"FROM {DATABASE}.{table_name}"
+        )
+        return (table_name, "built" if ok else f"insert failed: {text[:200]}")
+    
+    tables = ["ttt_5_draw"] + [f"ttt_5_l{layer}" for layer in range(9, 26)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for table_name, status in tqdm(executor.map(copy_table, tables), total=len(tables), desc="Compacting"):
+            if status != "built":
+                print(f"   {table_name}: {status}")
+    
+    storage_report()
+
+
+def storage_report():
+    """
+    So sánh dung lượng layout cũ (tictactoe) và compact (tictactoe_compact) theo từng table
+    """
+    query = (
+        "SELECT database, table, sum(rows), sum(data_compressed_bytes), "
+        "sum(data_uncompressed_bytes), sum(bytes_on_disk) "
+        "FROM system.parts "
+        f"WHERE active AND database IN ('{DATABASE}', '{COMPACT_DATABASE}') AND startsWith(table, 'ttt_5_') "
+        "GROUP BY database, table FORMAT TabSeparated"
+    )
+    ok, text = run_query(query)
+    if not ok:
+        print(f"❌ Failed to read system.parts: {text}")
+        return
+    
+    stats = {}
+    for line in text.splitlines():
+        database, table, rows, compressed, uncompressed, on_disk = line.split("\t")
+        stats[(database, table)] = (int(rows), int(compressed), int(uncompressed), int(on_disk))
+    
+    def mb(num_bytes: int) -> str:
+        return f"{num_bytes / 1024 / 1024:,.1f} MB"
+    
+    print("\n" + "=" * 90)
+    print("📦 Storage report (bytes on disk / uncompressed scan bytes)")
+    print("=" * 90)
+    print(f"{'Table':<16} {'Rows':>14} {'Legacy disk':>14} {'Compact disk':>14} {'Saved':>8} "
+          f"{'Legacy raw':>12} {'Compact raw':>12}")
+    print("-" * 90)
+    
+    totals = [0, 0, 0, 0]
+    tables = sorted({table for _, table in stats}, key=lambda t: (len(t), t))
+    for table in tables:
+        legacy = stats.get((DATABASE, table), (0, 0, 0, 0))
+        compact = stats.get((COMPACT_DATABASE, table), (0, 0, 0, 0))
+        saved = f"{1 - compact[3] / legacy[3]:.0%}" if legacy[3] and compact[3] else "-"
+        print(f"{table:<16} {legacy[0]:>14,} {mb(legacy[3]):>14} {mb(compact[3]):>14} {saved:>8} "
+              f"{mb(legacy[2]):>12} {mb(compact[2]):>12}")
+        totals[0] += legacy[3]
+        totals[1] += compact[3]
+        totals[2] += legacy[2]
+        totals[3] += compact[2]
+    
+    print("-" * 90)
+    saved = f"{1 - totals[1] / totals[0]:.0%}" if totals[0] and totals[1] else "-"
+    print(f"{'Total':<16} {'':>14} {mb(totals[0]):>14} {mb(totals[1]):>14} {saved:>8} "
+          f"{mb(totals[2]):>12} {mb(totals[3]):>12}")
+    print("=" * 90)
+
+
+def collect_table_selectivity(table_name: str) -> tuple[str, dict]:
+    """
+    Đếm tỷ lệ row có X/O ở từng ô và min/max số quân mỗi bên của một table (một lần full scan)
+    
+    Returns:
+        (table_name, {"rows": n, "cells": {col: {"X": fraction, "O": fraction}},
+                      "x_stones": [min, max], "o_stones": [min, max]}) hoặc (table_name, None)
+    """
+    if not check_table_exists(table_name):
+        return (table_name, None)
+    
+    counts = ", ".join(f"countIf({col} = 'X'), countIf({col} = 'O')" for col in CELL_COLUMNS)
+    x_stones = " + ".join(f"({col} = 'X')" for col in CELL_COLUMNS)
+    o_stones = " + ".join(f"({col} = 'O')" for col in CELL_COLUMNS)
+    ok, text = run_query(
+        f"SELECT count(), {counts}, "
+        f"min({x_stones}), max({x_stones}), min({o_stones}), max({o_stones}) "
+        f"FROM {DATABASE}.{table_name} FORMAT TabSeparated"
+    )
+    if not ok or not text:
+        print(f"❌ {table_name}: {text[:200]}")
+        return (table_name, None)
+    
+    values = [int(v) for v in text.split("\t")]
+    rows = values[0]
+    cells = {}
+    for idx, col in enumerate(CELL_COLUMNS):
+        x_count, o_count = values[1 + 2 * idx], values[2 + 2 * idx]
+        cells[col] = {
+            "X": x_count / rows if rows else 0.0,
+            "O": o_count / rows if rows else 0.0,
+        }
+    x_min, x_max, o_min, o_max = values[1 + 2 * len(CELL_COLUMNS):]
+    return (table_name, {
+        "rows": rows,
+        "cells": cells,
+        # Summary cho level pruning: table rỗng hoặc không có row đủ quân thì bỏ scan
+        "x_stones": [x_min, x_max],
+        "o_stones": [o_min, o_max],
+    })
+
+
+def collect_selectivity_stats(path: str = SELECTIVITY_STATS_PATH, workers: int = 4):
+    """
+    Thu table stats cho tất cả ttt_5_* tables (kể cả bảng gộp nếu có) và ghi ra JSON
+    query_builder dùng file này để chọn predicate đưa vào PREWHERE và bỏ các table không thể khớp
+    """
+    print("=" * 70)
+    print("📊 Collecting per-(table, cell, mark) selectivity")
+    print("=" * 70)
+    
+    tables = ["ttt_5_draw"] + [f"ttt_5_l{layer}" for layer in range(9, 26)] + [CONSOLIDATED_TABLE]
+    stats = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for table_name, table_stats in tqdm(executor.map(collect_table_selectivity, tables), total=len(tables), desc="Scanning"):
+            if table_stats is not None:
+                stats[table_name] = table_stats
+    
+    if not stats:
+        print("❌ No table scanned, stats not written")
+        return
+    
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=1, sort_keys=True)
+    
+    print(f"✅ Wrote {path} ({len(stats)} tables)")
+    for table_name, table_stats in sorted(stats.items()):
+        rarest = sorted(
+            (fraction, f"{col}={mark}")
+            for col, marks in table_stats["cells"].items()
+            for mark, fraction in marks.items()
+        )[:3]
+        print(f"   {table_name:<16} {table_stats['rows']:>14,} rows   rarest: "
+              + ", ".join(f"{name} ({fraction:.1%})" for fraction, name in rarest))
+
+
+def check_duplicates(fix: bool = False, workers: int = 4):
+    """
+    Tỉ lệ row trùng canonical key/form của từng ttt_5_* table (legacy và compact), sau khi load
+    
+    Args:
+        fix: OPTIMIZE TABLE ... FINAL DEDUPLICATE các table có row trùng rồi kiểm tra lại
+        workers: Số table kiểm tra song song
+    """
+    print("=" * 78)
+    print("🧬 Duplicate check (rows sharing a canonical key)")
+    print("=" * 78)
+    
+    # canonical_key nếu có (compact), nếu không thì canonical_form
+    ok, text = run_query(
+        "SELECT c.database, c.table, any(t.engine), "
+        "if(countIf(c.name = 'canonical_key') > 0, 'canonical_key', 'canonical_form') "
+        "FROM system.columns AS c INNER JOIN system.tables AS t ON c.database = t.database AND c.table = t.name "
+        f"WHERE c.database IN ('{DATABASE}', '{COMPACT_DATABASE}') AND startsWith(c.table, 'ttt_5_') "
+        "AND c.name IN ('canonical_key', 'canonical_form') "
+        "GROUP BY c.database, c.table ORDER BY c.database, length(c.table), c.table FORMAT TabSeparated"
+    )
+    if not ok:
+        print(f"❌ Failed to read system.columns: {text}")
+        return
+    tables = [line.split("\t") for line in text.splitlines() if line]
+    
+    def measure(item):
+        database, table, engine, key = item
+        ok, text = run_query(duplicate_ratio_query(f"{database}.{table}", key) + " FORMAT TabSeparated")
+        if not ok:
+            return item, None, text[:200]
+        rows, unique_keys, ratio = text.split("\t")
+        return item, (int(rows), int(unique_keys), float(ratio)), None
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(measure, tables))
+    
+    print(f"{'Table':<34} {'Engine':<20} {'Rows':>14} {'Duplicates':>12} {'Ratio':>8}")
+    print("-" * 92)
+    dirty = []
+    for (database, table, engine, key), counts, error in results:
+        name = f"{database}.{table}"
+        if counts is None:
+            print(f"{name:<34} {engine:<20} ❌ {error}")
+            continue
+        rows, unique_keys, ratio = counts
+        print(f"{name:<34} {engine:<20} {rows:>14,} {rows - unique_keys:>12,} {ratio:>8.3%}")
+        if rows > unique_keys:
+            dirty.append((database, table, engine, key))
+    print("-" * 92)
+    
+    if not dirty:
+        print("✅ No duplicate canonical keys")
+        return
+    if not fix:
+        print(f"⚠️  {len(dirty)} table(s) with duplicates (rerun with --fix to deduplicate)")
+        return
+    
+    for database, table, engine, key in dirty:
+        # FINAL DEDUPLICATE bỏ row trùng toàn bộ cột; ReplacingMergeTree còn gộp theo sorting key
+        ok, text = run_query(f"OPTIMIZE TABLE {database}.{table} FINAL DEDUPLICATE")
+        if not ok:
+            print(f"❌ {database}.{table}: {text[:200]}")
+            continue
+        _, counts, _ = measure((database, table, engine, key))
+        if counts:
+            print(f"🧹 {database}.{table}: {counts[0] - counts[1]:,} duplicate row(s) left")
+
+
 #============================================Main============================================
 if __name__ == "__main__":
     import sys
@@ -271,13 +780,62 @@ if __name__ == "__main__":
     # Parse command line arguments
     recreate = "--recreate" in sys.argv
     verify_only = "--verify" in sys.argv
-    
-    if verify_only:
+    build_filter = "--build-filter" in sys.argv
+    migrate = "--migrate" in sys.argv
+    optimize_layout = "--optimize-layout" in sys.argv
+    build_compact = "--build-compact" in sys.argv
+    report = "--storage-report" in sys.argv
+    collect_stats = "--collect-stats" in sys.argv
+    build_next_moves = "--build-next-moves" in sys.argv
+    generate = "--generate" in sys.argv
+    check_dupes = "--check-duplicates" in sys.argv
+    engine = "replacing" if "--replacing" in sys.argv else "mergetree"
+    
+    def arg_value(flag: str, default):
+        return type(default)(sys.argv[sys.argv.index(flag) + 1]) if flag in sys.argv else default
+    
+    if generate:
+        from terminal_generator import generate_terminal_states, DEFAULT_PARTITIONS, OUTPUT_DIR
+        to_clickhouse = "--to-clickhouse" in sys.argv
+        if to_clickhouse:
+            # Rows được INSERT thẳng vào ttt_5_*, table phải có sẵn
+            create_all_tables(engine=engine)
+        generate_terminal_states(
+            max_level=arg_value("--max-level", 25),
+            workers=arg_value("--workers", os.cpu_count() or 1),
+            partitions=arg_value("--partitions", DEFAULT_PARTITIONS),
+            output_dir=None if to_clickhouse else arg_value("--output", OUTPUT_DIR),
+            recreate=recreate,
+        )
+    elif build_next_moves:
+        # Import ở đây: cần clickhouse-connect, các lệnh khác không cần
+        from next_move_stats import build_next_move_table, DEFAULT_MAX_STONES
+        max_stones = DEFAULT_MAX_STONES
+        if "--max-stones" in sys.argv:
+            max_stones = int(sys.argv[sys.argv.index("--max-stones") + 1])
+        build_next_move_table(max_stones=max_stones, recreate=recreate)
+    elif check_dupes:
+        check_duplicates(fix="--fix" in sys.argv)
+    elif collect_stats:
+        collect_selectivity_stats()
+    elif build_compact:
+        build_compact_tables(cell_type="uint8" if "--uint8" in sys.argv else "enum8", recreate=recreate, engine=engine)
+    elif report:
+        storage_report()
+    elif optimize_layout:
+        optimize_all_layouts()
+    elif migrate:
+        # Gộp 18 table vào ttt_5_outcomes (PARTITION BY level)
+        migrate_to_consolidated(recreate=recreate)
+    elif build_filter:
+        # Build negative-result filter từ data đã ingest
+        build_position_filter()
+    elif verify_only:
         # Chỉ verify, không tạo table mới
         verify_all_tables()
     else:
         # Tạo tất cả tables
-        success, fail = create_all_tables(recreate=recreate)
+        success, fail = create_all_tables(recreate=recreate, engine=engine)
         
         # Verify sau khi tạo
         if success > 0 or fail > 0:
@@ -289,4 +847,14 @@ if __name__ == "__main__":
     print("\n💡 Usage:")
     print("   python create_all_tables.py              # Tạo tables mới (skip nếu đã tồn tại)")
     print("   python create_all_tables.py --recreate   # Xóa và tạo lại tất cả tables")
-    print("   python create_all_tables.py --verify     # Chỉ kiểm tra tables đã tồn tại")
\ No newline at end of file
+    print("   python create_all_tables.py --verify     # Chỉ kiểm tra tables đã tồn tại")
+    print("   python create_all_tables.py --build-filter  # Build position filter cho AI (sau khi ingest data)")
+    print("   python create_all_tables.py --migrate    # Gộp các table ttt_5_* vào ttt_5_outcomes (thêm --recreate để làm lại)")
+    print("   python create_all_tables.py --optimize-layout  # Thêm projection center-first + set index")
+    print("   python create_all_tables.py --replacing  # Tạo tables với ReplacingMergeTree (gộp row trùng khi merge)")
+    print("   python create_all_tables.py --build-compact [--uint8] [--replacing]  # Tạo layout compact trong tictactoe_compact")
+    print("   python create_all_tables.py --storage-report  # So sánh dung lượng legacy vs compact")
+    print("   python create_all_tables.py --collect-stats  # Selectivity từng ô cho PREWHERE (data/selectivity_stats.json)")
+    print("   python create_all_tables.py --build-next-moves [--max-stones 3]  # Bảng ttt_5_next_moves (stats mọi nước đi tiếp theo)")
+    print("   python create_all_tables.py --generate [--max-level 25] [--workers N] [--partitions 256] [--output data/generated | --to-clickhouse]  # Sinh lại dataset trạng thái kết thúc")
+    print("   python create_all_tables.py --check-duplicates [--fix]  # Tỉ lệ row trùng canonical key từng table")
\ No newline at end of file
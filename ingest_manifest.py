@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+#==========================================Ingest Manifest==========================================
+# Mỗi table đích (endpoint + table) ghi lại từng file đã load vào nó (một table có thể nhận nhiều file):
+# path, size, mtime, fingerprint nội dung, số rows, trạng thái. Chạy lại ingest thì:
+#   skip    file không đổi và đã load xong (so size + mtime, không đọc file); caller còn so số rows của table
+#           với recorded_rows(), table đã bị xóa/tạo lại thì load lại
+#   resume  lần trước load dở bằng chunked/sharded upload -> gửi tiếp/gửi lại, dedup token bỏ các block đã commit
+#   reload  lần trước load dở kiểu một stream, hoặc file đã đổi -> TRUNCATE table rồi load lại
+#   load    table chưa có trong manifest
+# Caller còn kiểm tra thêm: resume cần checkpoint còn khớp (không thì reload), load cần table không có rows
+# nào ngoài các rows manifest đã ghi.
+
+MANIFEST_PATH = os.path.join("data", "ingest_manifest.json")
+FINGERPRINT_SAMPLES = 16
+FINGERPRINT_SAMPLE_BYTES = 1024 * 1024
+# Các kiểu upload gửi lại được mà không nhân đôi rows (mỗi block mang insert_deduplication_token cố định)
+RESUMABLE_MODES = ("chunked", "sharded")
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Hash nội dung theo mẫu: size + FINGERPRINT_SAMPLES đoạn 1MB trải đều file (gồm đầu và cuối)
+    Đọc tối đa ~16MB dù file lớn cỡ nào; chỉ dùng khi mtime đổi mà size giữ nguyên
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= FINGERPRINT_SAMPLES * FINGERPRINT_SAMPLE_BYTES:
+            while chunk := f.read(FINGERPRINT_SAMPLE_BYTES):
+                digest.update(chunk)
+        else:
+            step = (size - FINGERPRINT_SAMPLE_BYTES) // (FINGERPRINT_SAMPLES - 1)
+            for index in range(FINGERPRINT_SAMPLES):
+                f.seek(index * step)
+                digest.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """
+    Manifest JSON các file đã load, dùng chung cho nhiều worker thread
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = self.normalize(json.load(f))
+            except (OSError, ValueError):
+                self.entries = {}
+
+    @staticmethod
+    def normalize(entries: dict) -> dict:
+        """
+        {target: {path: entry}}; manifest cũ chỉ có một entry cho mỗi target ({target: entry})
+        """
+        nested = {}
+        for target, value in entries.items():
+            if isinstance(value.get("path"), str):
+                value = {value["path"]: value}
+            nested[target] = value
+        return nested
+
+    def _entry(self, target: str, csv_path: str) -> dict:
+        return self.entries.get(target, {}).get(os.path.abspath(csv_path))
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def _same_file(self, entry: dict, csv_path: str) -> bool:
+        stat = os.stat(csv_path)
+        if entry.get("path") != os.path.abspath(csv_path) or entry.get("size") != stat.st_size:
+            return False
+        if entry.get("mtime_ns") == stat.st_mtime_ns:
+            return True
+        # File bị touch/copy lại: mtime đổi nhưng nội dung có thể vẫn như cũ
+        if entry.get("fingerprint") == file_fingerprint(csv_path):
+            with self._lock:
+                entry["mtime_ns"] = stat.st_mtime_ns
+                self._save()
+            return True
+        return False
+
+    def plan(self, csv_path: str, target: str, mode: str, restart: bool = False) -> str:
+        """
+        Quyết định làm gì với file
+
+        Args:
+            csv_path: File nguồn
+            target: Định danh table đích (endpoint + table)
+            mode: "chunked" | "sharded" | "stream", cách upload lần này
+            restart: Bỏ qua manifest, load lại từ đầu
+
+        Returns:
+            "load" | "skip" | "resume" | "reload"
+        """
+        if restart:
+            return "reload"
+        entry = self._entry(target, csv_path)
+        if entry is None:
+            return "load"
+        if not self._same_file(entry, csv_path):
+            return "reload"
+        if entry.get("status") == "done":
+            return "skip"
+        if mode in RESUMABLE_MODES and entry.get("mode") == mode:
+            return "resume"
+        return "reload"
+
+    def mark_started(self, csv_path: str, target: str, mode: str):
+        stat = os.stat(csv_path)
+        entry = {
+            "path": os.path.abspath(csv_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "fingerprint": file_fingerprint(csv_path),
+            "mode": mode,
+            "status": "loading",
+            "rows": None,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with self._lock:
+            self.entries.setdefault(target, {})[entry["path"]] = entry
+            self._save()
+
+    def recorded_rows(self, target: str) -> int:
+        """
+        Tổng rows các file đã load xong vào target, None nếu có file không biết số rows
+        """
+        with self._lock:
+            entries = [e for e in self.entries.get(target, {}).values() if e.get("status") == "done"]
+        if any(e.get("rows") is None for e in entries):
+            return None
+        return sum(e["rows"] for e in entries)
+
+    def mark_done(self, csv_path: str, target: str, rows: int = None):
+        with self._lock:
+            entry = self._entry(target, csv_path)
+            entry["status"] = "done"
+            entry["rows"] = rows
+            entry["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            self._save()
+
+    def mark_failed(self, csv_path: str, target: str, error: str):
+        with self._lock:
+            entry = self._entry(target, csv_path)
+            entry["status"] = "failed"
+            entry["error"] = error[:500]
+            self._save()
+
+    def import_entries(self, entries: dict):
+        """
+        Ghi đè các entry (ví dụ từ snapshot đã restore, đã đổi key sang endpoint mới)
+        """
+        with self._lock:
+            for target, files in self.normalize(entries).items():
+                self.entries.setdefault(target, {}).update(files)
+            self._save()
@@ -1,32 +1,87 @@
+import io
 import os
 import sys
 import glob
+import gzip
+import lzma
+import zlib
+import queue
+import shutil
+import contextlib
+import itertools
+import json
 import pathlib
+import threading
 import subprocess
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from typing import Optional, List, Tuple
 
 import typer
 from rich.console import Console
 from rich.table import Table
-from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn
+from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, TextColumn, BarColumn, DownloadColumn, TransferSpeedColumn
 from dotenv import load_dotenv
 import requests
 
 import clickhouse_connect
 
+from schema_generator import CLUSTER, COMPACT_SCHEMA_FOLDER, render_distributed_table, with_engine
+from chunked_upload import MAX_INSERT_BLOCK_SIZE, upload_csv_chunked, checkpoint_state, enable_deduplication, file_identity
+from ingest_telemetry import RESULTS_PATH, PROGRESS_PARAMS, IngestTelemetry, parse_summary, describe
+from ingest_manifest import MANIFEST_PATH, IngestManifest
+from native_ingest import DEFAULT_CHUNK_BYTES as NATIVE_CHUNK_BYTES, load_csv_native, table_columns, check_columns, parse_range
+from canonical_dedup import DEFAULT_DEDUP_MB, CanonicalDedup, DedupLineReader
+from snapshot import (SNAPSHOT_DIR, DEFAULT_CODEC, CODEC_SUFFIXES, INGEST_MANIFEST_FILE, list_tables, export_table,
+					  write_manifest, load_manifest, retarget_create, restore_table, run_sql)
+
 app = typer.Typer(add_completion=False)
+snapshot_app = typer.Typer(add_completion=False, help="Export/restore the loaded ttt_5_* tables as compressed Native files")
+app.add_typer(snapshot_app, name="snapshot")
 console = Console()
 
 
-def find_pairs(base_dir: pathlib.Path) -> List[Tuple[pathlib.Path, pathlib.Path]]:
+# Compressed inputs: ClickHouse decodes these Content-Encodings on INSERT, so they can be forwarded as-is
+CONTENT_ENCODINGS = {".gz": "gzip", ".zst": "zstd", ".xz": "xz"}
+ARCHIVE_SUFFIXES = (".rar",)
+DATA_PATTERNS = ("*.csv", "*.csv.gz", "*.csv.zst", "*.csv.xz", "*.rar")
+# Archives whose name doesn't match their table's schema file
+ARCHIVE_ALIASES = {"tic_tac_toe_draw_layer_25_quoted": "ttt_5_draw"}
+# First installed tool wins; each prints the archive's (single) member to stdout
+RAR_EXTRACTORS = (["unrar", "p", "-inul"], ["7z", "e", "-so", "-bd"], ["bsdtar", "-xOf"])
+# Schema set each CSV is paired with: legacy tables, or the compact layout (schema_generator.py --compact)
+LAYOUT_SCHEMA_DIRS = {"legacy": "schema", "compact": COMPACT_SCHEMA_FOLDER}
+
+
+def is_compressed(path: pathlib.Path) -> bool:
+	return path.suffix in CONTENT_ENCODINGS or path.suffix in ARCHIVE_SUFFIXES
+
+
+def data_stem(path: pathlib.Path) -> str:
+	"""
+	Table stem of a data file: ttt_5_l9.csv.zst -> ttt_5_l9, aliases applied for archives.
+	"""
+	name = path.name
+	for suffix in (*CONTENT_ENCODINGS, *ARCHIVE_SUFFIXES, ".csv"):
+		if name.endswith(suffix):
+			name = name[: -len(suffix)]
+	return ARCHIVE_ALIASES.get(name, name)
+
+
+def find_pairs(base_dir: pathlib.Path, layout: str = "legacy") -> List[Tuple[pathlib.Path, pathlib.Path]]:
 	"""
-	Pair CSV files in data/ with matching SQL files in schema/ by stem.
+	Pair CSV files (plain or compressed) in data/ with matching SQL files of the layout's schema
+	directory (schema/ or schema/compact/) by stem.
+	When both a plain and a compressed file exist for a table, the plain CSV is used.
 	Returns list of (csv_path, sql_path)
 	"""
 	data_dir = base_dir / "data"
-	schema_dir = base_dir / "schema"
-	csv_files = {pathlib.Path(p).stem: pathlib.Path(p) for p in glob.glob(str(data_dir / "*.csv"))}
+	schema_dir = base_dir / LAYOUT_SCHEMA_DIRS[layout]
+	csv_files = {}
+	for pattern in DATA_PATTERNS:
+		for p in sorted(glob.glob(str(data_dir / pattern))):
+			csv_files.setdefault(data_stem(pathlib.Path(p)), pathlib.Path(p))
 	sql_files = {pathlib.Path(p).stem: pathlib.Path(p) for p in glob.glob(str(schema_dir / "*.sql"))}
 
 	pairs: List[Tuple[pathlib.Path, pathlib.Path]] = []
@@ -39,6 +94,75 @@ def find_pairs(base_dir: pathlib.Path) -> List[Tuple[pathlib.Path, pathlib.Path]
 	return sorted(pairs, key=lambda t: t[0].name)
 
 
+def _rar_extractor(path: pathlib.Path) -> List[str]:
+	for command in RAR_EXTRACTORS:
+		if shutil.which(command[0]):
+			return command + [str(path)]
+	raise RuntimeError(f"Cannot read {path.name}: install unrar, 7z or bsdtar")
+
+
+def _open_zstd(path: pathlib.Path):
+	try:
+		import zstandard
+	except ImportError:
+		return None
+	reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+	# The raw reader only supports read()/readinto(); buffering adds readline() and line iteration
+	return io.BufferedReader(reader, buffer_size=1024 * 1024)
+
+
+@contextlib.contextmanager
+def open_csv_source(path: pathlib.Path, passthrough: bool = True):
+	"""
+	Open a data file for streaming without writing a decompressed copy to disk.
+	Yields (binary file object, Content-Encoding or None):
+	- plain CSV: the file itself
+	- .gz/.zst/.xz with passthrough: the raw compressed bytes plus their Content-Encoding
+	- otherwise: a streaming decompressor (gzip/lzma/zstandard, or the zstd/rar CLI through a pipe)
+	"""
+	suffix = path.suffix
+	if not is_compressed(path):
+		with open(path, "rb") as f:
+			yield f, None
+		return
+	if passthrough and suffix in CONTENT_ENCODINGS:
+		with open(path, "rb") as f:
+			yield f, CONTENT_ENCODINGS[suffix]
+		return
+	if suffix == ".gz":
+		with gzip.open(path, "rb") as f:
+			yield f, None
+		return
+	if suffix == ".xz":
+		with lzma.open(path, "rb") as f:
+			yield f, None
+		return
+	if suffix == ".zst":
+		reader = _open_zstd(path)
+		if reader is not None:
+			with reader:
+				yield reader, None
+			return
+		command = ["zstd", "-dcq", str(path)]
+	else:
+		command = _rar_extractor(path)
+
+	process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	try:
+		yield process.stdout, None
+	except BaseException:
+		process.kill()
+		raise
+	finally:
+		process.stdout.close()
+		stderr = process.stderr.read().decode(errors="replace").strip()
+		process.stderr.close()
+		returncode = process.wait()
+	# A truncated archive still looks like a clean end of stream to the server
+	if returncode != 0:
+		raise RuntimeError(f"{command[0]} failed on {path.name}: {stderr}")
+
+
 def table_name_from_sql(sql_text: str, default_name: str) -> str:
 	"""
 	Extract table name from a CREATE TABLE statement (simple heuristic).
@@ -115,6 +239,245 @@ def human_size(num_bytes: int) -> str:
 	return f"{size:.1f} PB"
 
 
+def print_failures(failures: List[Tuple[str, str]]) -> None:
+	summary = Table(title="Failed Files")
+	summary.add_column("CSV", style="cyan")
+	summary.add_column("Error", style="red")
+	for name, error in failures:
+		summary.add_row(name, error)
+	console.print(summary)
+
+
+class ByteBudget:
+	"""
+	Shared cap on bytes read from disk but not yet handed to the socket, across all uploads.
+	A single chunk larger than the whole budget is still let through when nothing else is in flight.
+	"""
+
+	def __init__(self, limit: int):
+		self.limit = limit
+		self.in_flight = 0
+		self._cond = threading.Condition()
+
+	def acquire(self, size: int) -> None:
+		with self._cond:
+			while self.in_flight and self.in_flight + size > self.limit:
+				self._cond.wait()
+			self.in_flight += size
+
+	def release(self, size: int) -> None:
+		with self._cond:
+			self.in_flight -= size
+			self._cond.notify_all()
+
+
+def _budgeted_chunks(f, budget: ByteBudget, chunk_bytes: int, sent: List[int], on_progress=None):
+	# requests pulls the next chunk only after the previous one was written to the socket,
+	# so a chunk's budget is released when the following one is requested
+	held = 0
+	try:
+		while True:
+			budget.release(held)
+			held = 0
+			budget.acquire(chunk_bytes)
+			held = chunk_bytes
+			chunk = f.read(chunk_bytes)
+			if not chunk:
+				return
+			sent[0] += len(chunk)
+			yield chunk
+			if on_progress is not None:
+				on_progress(len(chunk))
+	finally:
+		budget.release(held)
+
+
+def ensure_table(client, csv_path: pathlib.Path, sql_path: pathlib.Path, engine: str = "mergetree") -> str:
+	"""
+	Create the database/table described by sql_path if needed and return the target table name.
+	engine="replacing" creates missing tables as ReplacingMergeTree; existing tables are left as they are.
+	"""
+	sql_text = with_engine(normalize_sql(sql_path.read_text(encoding="utf-8")), engine)
+	target_table = table_name_from_sql(sql_text, default_name=data_stem(csv_path)).strip()
+	# Create database if statement references db.table
+	if "." in target_table:
+		db_name = target_table.split(".", 1)[0].strip("`\" ")
+		if db_name:
+			client.command(f"CREATE DATABASE IF NOT EXISTS {db_name}")
+
+	# Try to create table, ignore if it already exists
+	try:
+		client.command(sql_text)
+	except Exception as e:
+		if "TABLE_ALREADY_EXISTS" not in str(e):
+			raise
+	return target_table
+
+
+def table_state(client, target_table: str) -> Tuple[str, int]:
+	"""
+	(engine, total_rows) of a table from system.tables metadata, without reading any part.
+	"""
+	db_name, _, short_name = target_table.rpartition(".")
+	engine, rows = client.query(
+		"SELECT engine, ifNull(total_rows, 0) FROM system.tables "
+		"WHERE database = if({db:String} = '', currentDatabase(), {db:String}) AND name = {table:String}",
+		parameters={"db": db_name.strip("`\""), "table": short_name.strip("`\"")},
+	).result_rows[0]
+	return engine, int(rows)
+
+
+def rows_match(engine: str, rows: int, recorded: Optional[int]) -> bool:
+	"""
+	Whether a table still holds what the manifest recorded. ReplacingMergeTree may have collapsed
+	duplicates, so it only has to be non-empty and not above the recorded total.
+	"""
+	if recorded is None:
+		return rows > 0
+	if engine.startswith("Replacing"):
+		return 0 < rows <= recorded if recorded else rows == 0
+	return rows == recorded
+
+
+def plan_load(
+	client,
+	ledger: Optional[IngestManifest],
+	csv_path: pathlib.Path,
+	target: str,
+	target_table: str,
+	mode: str,
+	restart: bool,
+	chunk_bytes: int = 0,
+) -> str:
+	"""
+	Decide what to do with one file: "skip", "resume", "reload" (truncate first) or "load" (append).
+	- --restart always reloads, with or without the manifest.
+	- An unchanged, finished file is skipped only while the table still holds the rows the manifest
+	  recorded for it (a dropped/recreated or truncated table is reloaded).
+	- A chunked resume needs a checkpoint that still matches the file and chunk size; otherwise reload.
+	- Without a manifest entry, a usable chunk checkpoint is resumed, and a table holding rows no
+	  manifest entry accounts for is refused: appending would duplicate whatever loaded them.
+	"""
+	if restart:
+		return "reload"
+	action = ledger.plan(str(csv_path), target, mode) if ledger else "load"
+	checkpoint = checkpoint_state(str(csv_path), target_table, chunk_bytes) if mode == "chunked" else "missing"
+	if action == "resume" and checkpoint != "usable":
+		return "reload"
+	if action == "skip":
+		engine, rows = table_state(client, target_table)
+		return "skip" if rows_match(engine, rows, ledger.recorded_rows(target)) else "reload"
+	if action != "load":
+		return action
+	if checkpoint == "usable":
+		return "resume"
+	_, rows = table_state(client, target_table)
+	recorded = ledger.recorded_rows(target) if ledger else 0
+	if rows and recorded is not None and rows != recorded:
+		raise RuntimeError(
+			f"{target_table} holds {rows:,} rows but the manifest accounts for {recorded:,}; "
+			f"rerun with --restart to truncate and reload it"
+		)
+	return "load"
+
+
+def plan_loads(
+	client,
+	ledger: Optional[IngestManifest],
+	jobs: List[Tuple[pathlib.Path, str, str]],
+	url: str,
+	restart: bool,
+	chunk_bytes: int = 0,
+) -> Tuple[list, list]:
+	"""
+	plan_load every (csv_path, target_table, mode) job, then make the plan consistent per table:
+	a table is truncated once when any of its files must be reloaded, and then every file loading
+	into it is reloaded too. Prints what happens to each file.
+	Returns (planned [(csv_path, target_table, mode, action)], failures [(file name, error)]).
+	"""
+	actions = []
+	for csv_path, target_table, mode in jobs:
+		try:
+			actions.append(plan_load(client, ledger, csv_path, url + target_table, target_table, mode, restart, chunk_bytes))
+		except Exception as e:
+			actions.append(e)
+	reload_tables = {target_table for (_, target_table, _), action in zip(jobs, actions) if action == "reload"}
+
+	planned, failures = [], []
+	for (csv_path, target_table, mode), action in zip(jobs, actions):
+		if target_table in reload_tables:
+			action = "reload"
+		if isinstance(action, Exception):
+			failures.append((csv_path.name, str(action)))
+			console.print(f"[red]✗ {csv_path.name} → {target_table}: {action}[/red]")
+			continue
+		if action == "skip":
+			console.print(f"[dim]⏭ {csv_path.name} → {target_table} unchanged since last load, skipping[/dim]")
+			continue
+		if action == "reload":
+			console.print(f"[yellow]↻ {csv_path.name}: reloading {target_table}[/yellow]")
+		planned.append((csv_path, target_table, mode, action))
+	for target_table in sorted(reload_tables):
+		# Rows from an interrupted load (or an older file) can't be told apart: start over
+		client.command(f"TRUNCATE TABLE {target_table}")
+	if ledger:
+		for csv_path, target_table, mode, _ in planned:
+			ledger.mark_started(str(csv_path), url + target_table, mode)
+	return planned, failures
+
+
+def shared_dedup(jobs: List[Tuple[pathlib.Path, str]], dedup_mb: int) -> dict:
+	"""
+	One CanonicalDedup per target table, shared by every file loading into it.
+	~64 bytes per quoted 27-column row sizes each Bloom filter if the exact set outgrows dedup_mb.
+	"""
+	expected = {}
+	for csv_path, target_table in jobs:
+		expected[target_table] = expected.get(target_table, 0) + csv_path.stat().st_size // 64
+	return {target_table: CanonicalDedup(dedup_mb, expected=rows) for target_table, rows in expected.items()}
+
+
+def upload_csv(
+	csv_path: pathlib.Path,
+	url: str,
+	insert_query: str,
+	auth,
+	budget: ByteBudget,
+	chunk_bytes: int = 4 * 1024 * 1024,
+	passthrough: bool = True,
+	on_progress=None,
+	dedup: Optional[CanonicalDedup] = None,
+	settings: Optional[dict] = None,
+) -> Tuple[int, float, Optional[int], dict]:
+	"""
+	Stream one CSV (plain or compressed) into ClickHouse over HTTP without loading it into memory.
+	With dedup, lines whose canonical_form was already seen are dropped on the client (compressed
+	files are then decompressed locally, since the filter has to read every line).
+	settings are extra query settings for the INSERT (e.g. input_format_allow_errors_num).
+	Returns (bytes sent, seconds elapsed, rows written, X-ClickHouse-Summary); raises on any non-200 response.
+	"""
+	started = time.monotonic()
+	sent = [0]
+	with open_csv_source(csv_path, passthrough and dedup is None) as (f, encoding):
+		if dedup is not None:
+			f = DedupLineReader(f, dedup)
+		headers = {"X-ClickHouse-Query": insert_query}
+		if encoding:
+			headers["Content-Encoding"] = encoding
+		response = requests.post(
+			url,
+			params={**PROGRESS_PARAMS, **(settings or {})},
+			data=_budgeted_chunks(f, budget, chunk_bytes, sent, on_progress),
+			headers=headers,
+			auth=auth,
+			timeout=3600,  # 1 hour timeout for large files
+		)
+	if response.status_code != 200:
+		raise Exception(f"HTTP {response.status_code} - {response.text.strip()}")
+	summary = parse_summary(response.headers)
+	return sent[0], time.monotonic() - started, summary.get("written_rows"), summary
+
+
 @app.command()
 def ingest(
 	host: str = typer.Option(..., help="ClickHouse host"),
@@ -124,6 +487,18 @@ def ingest(
 	database: str = typer.Option("default", help="Target database"),
 	cwd: str = typer.Option(".", help="Project base directory containing data/ and schema/"),
 	concurrency: int = typer.Option(1, help="Number of files to load in parallel (1-4 recommended)"),
+	max_inflight_mb: int = typer.Option(256, help="Upper bound on CSV bytes buffered/in flight across all parallel uploads"),
+	chunk_mb: int = typer.Option(0, help="Split each CSV into line-aligned chunks of this size, uploaded as parallel, resumable inserts (0 = one stream per file)"),
+	chunk_workers: int = typer.Option(4, help="Parallel chunk inserts per file when --chunk-mb is set"),
+	restart: bool = typer.Option(False, help="Ignore the manifest and chunk checkpoints; truncate and reload every table (also with --no-manifest)"),
+	passthrough: bool = typer.Option(True, help="Send .gz/.zst/.xz files as-is with Content-Encoding and let the server decompress"),
+	manifest: bool = typer.Option(True, help=f"Skip files already loaded unchanged and finish partial loads (tracked in {MANIFEST_PATH})"),
+	results: str = typer.Option(RESULTS_PATH, help="JSON file (relative to --cwd) receiving per-file and aggregate throughput"),
+	live: bool = typer.Option(True, help="Show live per-file progress bars"),
+	dedup: bool = typer.Option(False, help="Drop rows whose canonical_form was already sent to the same table (one stream per file)"),
+	dedup_mb: int = typer.Option(DEFAULT_DEDUP_MB, help="Memory per target table for --dedup: exact key set while it fits, then a Bloom filter of this size"),
+	replacing: bool = typer.Option(False, help="Create missing tables as ReplacingMergeTree so duplicate keys collapse on merge"),
+	allow_errors: int = typer.Option(0, help="Skip up to this many malformed rows per insert (input_format_allow_errors_num) instead of failing; skipped rows are reported per file"),
 	dry_run: bool = typer.Option(False, help="Only show plan; do not execute"),
 ) -> None:
 	"""
@@ -164,53 +539,838 @@ def ingest(
 		database=database,
 	)
 
-	# Create tables and insert data (avoid fancy progress to prevent Windows console unicode issues)
-	console.print(f"[cyan]Ingesting {len(pairs)} file(s)...[/cyan]")
-	for csv_path, sql_path in pairs:
-		console.print(f"- [magenta]{csv_path.name}[/magenta] → [magenta]{sql_path.name}[/magenta]")
-		# 1) Ensure table exists
-		raw_sql = sql_path.read_text(encoding="utf-8")
-		sql_text = normalize_sql(raw_sql)
-		target_table = table_name_from_sql(sql_text, default_name=csv_path.stem).strip()
-		# Create database if statement references db.table
-		if "." in target_table:
-			db_name = target_table.split(".", 1)[0].strip("`\" ")
-			if db_name:
-				client.command(f"CREATE DATABASE IF NOT EXISTS {db_name}")
+	# 1) Ensure every table exists first (cheap DDL, kept sequential on one client)
+	engine = "replacing" if replacing else "mergetree"
+	targets = [ensure_table(client, csv_path, sql_path, engine) for csv_path, sql_path in pairs]
+
+	# 2) Stream the CSVs concurrently; in-flight bytes are bounded across all workers
+	url = f"http://{host}:{port}/"
+	auth = (username, password) if password else None
+	budget = ByteBudget(max_inflight_mb * 1024 * 1024)
+	workers = max(1, min(concurrency, len(pairs)))
+	# Largest files first so the long uploads don't end up running alone at the tail
+	jobs = sorted(zip((csv_path for csv_path, _ in pairs), targets), key=lambda job: job[0].stat().st_size, reverse=True)
+
+	# 3) Consult the manifest: unchanged files are skipped without reading them
+	ledger = IngestManifest(str(base_dir / MANIFEST_PATH)) if manifest else None
+	if dedup and chunk_mb > 0:
+		console.print("[yellow]Warning:[/yellow] --dedup filters each file as one ordered stream; --chunk-mb is ignored")
+	# Compressed streams can't be split at byte offsets, so they always go up as one insert
+	jobs = [
+		(csv_path, target_table, "chunked" if chunk_mb > 0 and not is_compressed(csv_path) and not dedup else "stream")
+		for csv_path, target_table in jobs
+	]
+	planned, failures = plan_loads(client, ledger, jobs, url, restart, chunk_mb * 1024 * 1024)
+	total_bytes = sum(csv_path.stat().st_size for csv_path, _, _, _ in planned)
+
+	telemetry = IngestTelemetry(str(base_dir / results), settings={
+		"concurrency": concurrency, "max_inflight_mb": max_inflight_mb, "chunk_mb": chunk_mb,
+		"chunk_workers": chunk_workers, "passthrough": passthrough, "dedup": dedup, "dedup_mb": dedup_mb,
+		"allow_errors": allow_errors,
+	})
+	insert_settings = {"input_format_allow_errors_num": allow_errors} if allow_errors else {}
+	# One key set per target table, so files loading into the same table also drop each other's rows
+	dedup_sets = shared_dedup([(csv_path, target_table) for csv_path, target_table, _, _ in planned], dedup_mb) if dedup else {}
+	progress = Progress(
+		SpinnerColumn(), TextColumn("{task.description}"), BarColumn(), DownloadColumn(), TransferSpeedColumn(), TimeElapsedColumn(),
+		console=console, disable=not live,
+	)
+
+	def load(csv_path: pathlib.Path, target_table: str, mode: str, action: str) -> Tuple[int, float, Optional[int], dict]:
+		target = url + target_table
+		# Client-side decompression sends more bytes than the file holds, and --dedup fewer, so the bar has no total then
+		size = csv_path.stat().st_size
+		known_total = not dedup and (not is_compressed(csv_path) or (passthrough and csv_path.suffix in CONTENT_ENCODINGS))
+		task = progress.add_task(csv_path.name, total=size if known_total else None)
+		advance = lambda n: progress.update(task, advance=n)
+		try:
+			if mode == "chunked":
+				result = upload_csv_chunked(
+					str(csv_path), url, target_table, auth, params=insert_settings,
+					chunk_bytes=chunk_mb * 1024 * 1024, workers=chunk_workers, budget=budget,
+					restart=action == "reload", on_progress=advance, log=progress.console.print,
+				)
+			else:
+				seen = dedup_sets.get(target_table)
+				result = upload_csv(
+					csv_path, url, f"INSERT INTO {target_table} FORMAT CSV", auth, budget,
+					passthrough=passthrough, on_progress=advance, dedup=seen, settings=insert_settings,
+				)
+				if seen is not None:
+					progress.console.print(f"[dim]{csv_path.name}: {seen.describe()}[/dim]")
+		except Exception as e:
+			if ledger:
+				ledger.mark_failed(str(csv_path), target, str(e))
+			raise
+		if ledger:
+			ledger.mark_done(str(csv_path), target, result[2])
+		return result
+
+	console.print(f"[cyan]Ingesting {len(planned)} file(s) ({human_size(total_bytes)}) with {workers} worker(s), up to {max_inflight_mb} MB in flight...[/cyan]")
+	with progress, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as executor:
+		futures = {executor.submit(load, *job): job[:2] for job in planned}
+		for future in as_completed(futures):
+			csv_path, target_table = futures[future]
+			try:
+				sent, elapsed, rows, summary = future.result()
+			except Exception as e:
+				failures.append((csv_path.name, str(e)))
+				progress.console.print(f"[red]✗ {csv_path.name} → {target_table}: {e}[/red]")
+				continue
+			metrics = telemetry.record(csv_path.name, target_table, csv_path.stat().st_size, sent, elapsed, summary)
+			progress.console.print(f"[green]✓[/green] {csv_path.name} → {target_table} ({describe(metrics)})")
 
-		# Try to create table, ignore if it already exists
+	# 4) On-disk compression of what was loaded, then the results file
+	for target_table in sorted({m["table"] for m in telemetry.files}):
+		db_name, _, short_name = target_table.rpartition(".")
 		try:
-			client.command(sql_text)
+			compressed, uncompressed = client.query(
+				"SELECT sum(data_compressed_bytes), sum(data_uncompressed_bytes) FROM system.parts "
+				"WHERE active AND database = {db:String} AND table = {table:String}",
+				parameters={"db": db_name or database, "table": short_name},
+			).result_rows[0]
+			telemetry.set_storage(target_table, compressed, uncompressed)
 		except Exception as e:
-			if "TABLE_ALREADY_EXISTS" not in str(e):
-				raise
+			console.print(f"[yellow]Warning:[/yellow] no storage stats for {target_table}: {e}")
+	aggregate = telemetry.write(failures)
+	console.print(f"[cyan]{len(telemetry.files)}/{len(planned)} file(s): {describe(aggregate)}[/cyan]")
+	console.print(f"[dim]Results written to {telemetry.path}[/dim]")
 
-		# 2) Stream insert CSV using Python requests for proper file streaming
-		# This avoids memory issues with large files by streaming data in chunks
-		insert_query = f"INSERT INTO {target_table} FORMAT CSV"
+	if failures:
+		print_failures(failures)
+		raise typer.Exit(code=1)
+
+	console.print("[bold green]Ingestion complete.[/bold green]")
+
+
+def shard_for_line(line: bytes, shard_count: int) -> int:
+	"""
+	Pick the shard for one CSV row the same way the Distributed table does:
+	CRC32(canonical_form) % shard_count, canonical_form being the first (quoted) field.
+	"""
+	canonical_form = line.split(b",", 1)[0].strip().strip(b'"')
+	return zlib.crc32(canonical_form) % shard_count
+
+
+# Queue items: bytes to send, None to finish the INSERT, _ABORT to break it off mid-body so it fails
+_ABORT = object()
 
-		url = f"http://{host}:{port}/"
-		auth = (username, password) if password else None
 
-		# Stream file in chunks to avoid loading entire file into memory
+class UploadAborted(Exception):
+	pass
+
+
+def _queue_body(chunks: queue.Queue):
+	while True:
+		chunk = chunks.get()
+		if chunk is None:
+			return
+		if chunk is _ABORT:
+			raise UploadAborted("aborted because another shard or the input failed")
+		yield chunk
+
+
+def _put_chunk(chunks: queue.Queue, chunk: Optional[bytes], sender: threading.Thread) -> None:
+	# Never block forever on a shard whose upload thread already died
+	while True:
 		try:
-			with open(csv_path, 'rb') as f:
-				response = requests.post(
-					url,
-					data=f,
-					headers={'X-ClickHouse-Query': insert_query},
-					auth=auth,
-					timeout=3600  # 1 hour timeout for large files
-				)
+			chunks.put(chunk, timeout=1)
+			return
+		except queue.Full:
+			if not sender.is_alive():
+				raise RuntimeError(f"Upload to {sender.name} stopped early")
+
+
+def stream_csv_to_shards(
+	csv_path: pathlib.Path,
+	shard_urls: List[str],
+	insert_query: str,
+	auth,
+	chunk_bytes: int = 4 * 1024 * 1024,
+	dedup_token: Optional[str] = None,
+) -> List[int]:
+	"""
+	Split one CSV by shard key and stream every part into its shard concurrently.
+	One HTTP INSERT per shard stays open for the whole file; rows are routed client-side
+	so no node has to re-forward data like an INSERT into the Distributed table would.
+	ClickHouse commits every block of an INSERT as it arrives, so a failed or aborted shard may
+	already hold part of the file. With dedup_token each shard's INSERT carries a deterministic
+	insert_deduplication_token (the server suffixes it per block), so resending the same file
+	skips the blocks that were committed and a rerun is idempotent.
+	If any shard or the input fails, the other INSERTs are aborted mid-body and the error lists
+	every shard that may hold rows of this file.
+	Returns rows sent per shard.
+	"""
+	shard_count = len(shard_urls)
+	queues = [queue.Queue(maxsize=8) for _ in shard_urls]
+	errors: List[Optional[str]] = [None] * shard_count
+	started = [False] * shard_count
+	params = [{} for _ in shard_urls]
+	if dedup_token:
+		params = [
+			{"insert_deduplicate": 1, "insert_deduplication_token": f"{dedup_token}:{index}/{shard_count}",
+			 "max_insert_block_size": MAX_INSERT_BLOCK_SIZE}
+			for index in range(shard_count)
+		]
 
-				if response.status_code != 200:
-					console.print(f"[red]Error inserting {csv_path.name}: HTTP {response.status_code} - {response.text}[/red]")
-					raise Exception(f"Failed to insert {csv_path.name}")
+	def send(index: int) -> None:
+		started[index] = True
+		try:
+			response = requests.post(
+				shard_urls[index],
+				params=params[index],
+				data=_queue_body(queues[index]),
+				headers={"X-ClickHouse-Query": insert_query},
+				auth=auth,
+				timeout=3600,
+			)
+			if response.status_code != 200:
+				errors[index] = f"HTTP {response.status_code} - {response.text.strip()}"
 		except Exception as e:
+			errors[index] = str(e)
+
+	senders = [threading.Thread(target=send, args=(i,), name=shard_urls[i], daemon=True) for i in range(shard_count)]
+	for sender in senders:
+		sender.start()
+
+	buffers = [bytearray() for _ in shard_urls]
+	rows = [0] * shard_count
+	failure: Optional[BaseException] = None
+	try:
+		# Rows are routed one by one, so compressed inputs are decompressed on the client here
+		with open_csv_source(csv_path, passthrough=False) as (f, _):
+			for line in f:
+				if not line.strip():
+					continue
+				index = shard_for_line(line, shard_count)
+				buffers[index] += line
+				rows[index] += 1
+				if len(buffers[index]) >= chunk_bytes:
+					_put_chunk(queues[index], bytes(buffers[index]), senders[index])
+					buffers[index].clear()
+		for index in range(shard_count):
+			if buffers[index]:
+				_put_chunk(queues[index], bytes(buffers[index]), senders[index])
+	except BaseException as e:
+		failure = e
+
+	# Ending a healthy shard's body cleanly would commit a partial file that a rerun duplicates
+	end = _ABORT if failure is not None or any(errors) else None
+	for index in range(shard_count):
+		if senders[index].is_alive():
+			with contextlib.suppress(RuntimeError):
+				_put_chunk(queues[index], end, senders[index])
+	for sender in senders:
+		sender.join()
+
+	failed = [f"{shard_urls[i]}: {error}" for i, error in enumerate(errors) if error]
+	if failure is None and not failed:
+		return rows
+	problems = ([f"input: {failure!r}"] if failure is not None else []) + failed
+	dirty = [shard_urls[i] for i in range(shard_count) if started[i]]
+	if dirty:
+		# Blocks are committed as they arrive: an aborted or failed INSERT can still have left rows
+		advice = "rerunning the unchanged file skips them (deduplication tokens)" if dedup_token \
+			else "truncate the shard tables before rerunning"
+		problems.append(f"rows of this file may already be committed on {', '.join(dirty)}; {advice}")
+	if failure is not None and not isinstance(failure, Exception):
+		console.print(f"[red]{'; '.join(problems)}[/red]")
+		raise failure
+	raise Exception("; ".join(problems)) from failure
+
+
+@app.command()
+def ingest_sharded(
+	shard_hosts: str = typer.Option(..., help="Comma-separated host:port HTTP endpoints, one per shard, in cluster order"),
+	username: str = typer.Option("default", help="ClickHouse username"),
+	password: str = typer.Option("", help="ClickHouse password", prompt=False, hide_input=True),
+	cluster: str = typer.Option(CLUSTER, help="Cluster name from remote_servers.xml"),
+	cwd: str = typer.Option(".", help="Project base directory containing data/ and schema/"),
+	manifest: bool = typer.Option(True, help=f"Skip files already loaded unchanged and finish partial loads (tracked in {MANIFEST_PATH})"),
+	restart: bool = typer.Option(False, help="Ignore the manifest; truncate the shard tables and reload every file"),
+	dry_run: bool = typer.Option(False, help="Only show plan; do not execute"),
+) -> None:
+	"""
+	Load data/ into a sharded cluster (docker-compose.cluster.yml).
+	Each schema/*.sql becomes <table>_local on every shard plus a Distributed <table> with the
+	original name, so queries keep using the same table names and fan out to all shards.
+	Every shard block carries a deduplication token, so an interrupted file is resumed by sending
+	it again; the manifest skips finished files and refuses tables holding rows it can't account for.
+	"""
+	base_dir = pathlib.Path(cwd).resolve()
+	shards = [h.strip() for h in shard_hosts.split(",") if h.strip()]
+	shard_urls = [f"http://{h}/" for h in shards]
+	auth = (username, password) if password else None
+
+	pairs = find_pairs(base_dir)
+	if not pairs:
+		console.print("[red]No CSV/SQL pairs found.[/red]")
+		raise typer.Exit(code=1)
+
+	table = Table(title=f"Planned Sharded Ingestion ({len(shards)} shards, cluster {cluster})")
+	table.add_column("CSV", style="cyan")
+	table.add_column("Local table", style="magenta")
+	table.add_column("Size", style="green")
+	for csv_path, sql_path in pairs:
+		target_table = table_name_from_sql(normalize_sql(sql_path.read_text(encoding="utf-8")), data_stem(csv_path))
+		table.add_row(csv_path.name, f"{target_table}_local", human_size(csv_path.stat().st_size))
+	console.print(table)
+
+	if dry_run:
+		console.print("[yellow]Dry run complete. No changes made.[/yellow]")
+		return
+
+	def command(url: str, sql: str) -> None:
+		response = requests.post(url, data=sql.encode("utf-8"), auth=auth, timeout=60)
+		if response.status_code != 200 and "TABLE_ALREADY_EXISTS" not in response.text:
+			raise Exception(f"{url}: HTTP {response.status_code} - {response.text.strip()}")
+
+	def shard_rows(local_table: str) -> int:
+		return sum(int(run_sql(url, f"SELECT count() FROM {local_table}", auth).strip()) for url in shard_urls)
+
+	ledger = IngestManifest(str(base_dir / MANIFEST_PATH)) if manifest else None
+	console.print(f"[cyan]Ingesting {len(pairs)} file(s) into {len(shards)} shard(s)...[/cyan]")
+	for csv_path, sql_path in pairs:
+		sql_text = normalize_sql(sql_path.read_text(encoding="utf-8"))
+		target_table = table_name_from_sql(sql_text, default_name=data_stem(csv_path)).strip()
+		db_name, _, short_name = target_table.rpartition(".")
+		local_sql = sql_text.replace(target_table, f"{target_table}_local", 1)
+
+		# 1) <table>_local on every shard, Distributed <table> on every node (any node can serve queries)
+		for url in shard_urls:
+			if db_name:
+				command(url, f"CREATE DATABASE IF NOT EXISTS {db_name}")
+			command(url, local_sql)
+			command(url, render_distributed_table(short_name, db_name or "default", cluster))
+
+		# 2) Same rules as plan_load: skip only while the shards still hold the recorded rows, never append
+		#    onto rows the manifest doesn't know about
+		local_table = f"{target_table}_local"
+		target = ",".join(shard_urls) + local_table
+		action = "reload" if restart else ledger.plan(str(csv_path), target, "sharded") if ledger else "load"
+		if action in ("skip", "load"):
+			rows = shard_rows(local_table)
+			recorded = ledger.recorded_rows(target) if ledger else 0
+			if action == "skip" and not rows_match("", rows, recorded):
+				action = "reload"
+			elif action == "load" and rows and recorded is not None and rows != recorded:
+				console.print(f"[red]{local_table} holds {rows:,} rows across the shards but the manifest accounts for "
+							  f"{recorded:,}; rerun with --restart to truncate and reload it[/red]")
+				raise typer.Exit(code=1)
+		if action == "skip":
+			console.print(f"[dim]⏭ {csv_path.name} → {local_table} unchanged since last load, skipping[/dim]")
+			continue
+		if action == "reload":
+			console.print(f"[yellow]↻ {csv_path.name}: reloading, truncating {local_table} on every shard[/yellow]")
+			for url in shard_urls:
+				run_sql(url, f"TRUNCATE TABLE {local_table}", auth)
+		for url in shard_urls:
+			enable_deduplication(url, local_table, auth, log=console.print)
+		if ledger:
+			ledger.mark_started(str(csv_path), target, "sharded")
+
+		# 3) Route rows by CRC32(canonical_form) and stream all shards at once
+		console.print(f"- [magenta]{csv_path.name}[/magenta] → [magenta]{local_table}[/magenta] x{len(shards)}")
+		identity = file_identity(str(csv_path))
+		# Same file, same shard count -> same token and same blocks, so a resend only fills what is missing
+		token = f"{local_table}:{csv_path.name}:{identity['size']}:{identity['mtime_ns']}"
+		try:
+			rows = stream_csv_to_shards(csv_path, shard_urls, f"INSERT INTO {local_table} FORMAT CSV", auth, dedup_token=token)
+		except Exception as e:
+			if ledger:
+				ledger.mark_failed(str(csv_path), target, str(e))
 			console.print(f"[red]Error inserting {csv_path.name}: {str(e)}[/red]")
 			raise
+		if ledger:
+			ledger.mark_done(str(csv_path), target, sum(rows))
+		console.print("  " + ", ".join(f"{host}: {count:,} rows" for host, count in zip(shards, rows)))
 
-	console.print("[bold green]Ingestion complete.[/bold green]")
+	console.print("[bold green]Sharded ingestion complete.[/bold green]")
+
+
+@app.command()
+def ingest_native(
+	host: str = typer.Option(..., help="ClickHouse host"),
+	port: int = typer.Option(8123, help="ClickHouse HTTP port"),
+	username: str = typer.Option("default", help="ClickHouse username"),
+	password: str = typer.Option("", help="ClickHouse password", prompt=False, hide_input=True),
+	database: str = typer.Option("default", help="Target database"),
+	cwd: str = typer.Option(".", help="Project base directory containing data/ and schema/"),
+	workers: int = typer.Option(os.cpu_count() or 1, help="CSV parser processes"),
+	chunk_mb: int = typer.Option(NATIVE_CHUNK_BYTES // (1024 * 1024), help="Bytes of CSV parsed per block/insert (MB)"),
+	manifest: bool = typer.Option(True, help=f"Skip files already loaded unchanged (tracked in {MANIFEST_PATH})"),
+	restart: bool = typer.Option(False, help="Ignore the manifest; truncate and reload every table"),
+	dedup: bool = typer.Option(False, help="Drop rows whose canonical key (recomputed from the cells) was already inserted into the same table"),
+	dedup_mb: int = typer.Option(DEFAULT_DEDUP_MB, help="Memory per target table for --dedup: exact key set while it fits, then a Bloom filter of this size"),
+	replacing: bool = typer.Option(False, help="Create missing tables as ReplacingMergeTree so duplicate keys collapse on merge"),
+	layout: str = typer.Option("legacy", help="Tables to create and fill: legacy (schema/*.sql) or compact (schema/compact/*.sql)"),
+	dry_run: bool = typer.Option(False, help="Only show plan; do not execute"),
+) -> None:
+	"""
+	Parse CSVs on the client (parallel processes over mmap'd chunks) and insert Native blocks.
+	The derived canonical_key column is computed at load time, so --layout compact fills the
+	compact tables (schema_generator.py --compact) straight from the CSVs.
+	"""
+	if layout not in LAYOUT_SCHEMA_DIRS:
+		console.print(f"[red]Unknown layout '{layout}' (expected: {', '.join(LAYOUT_SCHEMA_DIRS)})[/red]")
+		raise typer.Exit(code=2)
+	base_dir = pathlib.Path(cwd).resolve()
+	pairs = find_pairs(base_dir, layout)
+	if not pairs:
+		console.print("[red]No CSV/SQL pairs found.[/red]")
+		raise typer.Exit(code=1)
+
+	skipped = [csv_path for csv_path, _ in pairs if is_compressed(csv_path)]
+	for csv_path in skipped:
+		console.print(f"[yellow]Warning:[/yellow] '{csv_path.name}' is compressed and can't be memory-mapped; use 'ingest' for it")
+	pairs = [(csv_path, sql_path) for csv_path, sql_path in pairs if not is_compressed(csv_path)]
+
+	table = Table(title=f"Planned Native Ingestion ({workers} parser processes)")
+	table.add_column("CSV", style="cyan")
+	table.add_column("Schema", style="magenta")
+	table.add_column("Size", style="green")
+	for csv_path, sql_path in pairs:
+		table.add_row(csv_path.name, sql_path.name, human_size(csv_path.stat().st_size))
+	console.print(table)
+
+	if dry_run:
+		console.print("[yellow]Dry run complete. No changes made.[/yellow]")
+		return
+
+	client = get_client(
+		host=host,
+		port=port,
+		username=username,
+		password=password,
+		database=database,
+	)
+
+	ledger = IngestManifest(str(base_dir / MANIFEST_PATH)) if manifest else None
+	url = f"http://{host}:{port}/"
+	engine = "replacing" if replacing else "mergetree"
+	targets = [(csv_path, ensure_table(client, csv_path, sql_path, engine), "stream") for csv_path, sql_path in pairs]
+	planned, failures = plan_loads(client, ledger, targets, url, restart)
+	dedup_sets = shared_dedup([(csv_path, target_table) for csv_path, target_table, _, _ in planned], dedup_mb) if dedup else {}
+	for csv_path, target_table, _, _ in planned:
+		target = url + target_table
+		started = time.monotonic()
+		seen = dedup_sets.get(target_table)
+		try:
+			rows = load_csv_native(client, str(csv_path), target_table, workers=workers, chunk_bytes=chunk_mb * 1024 * 1024, dedup=seen)
+		except Exception as e:
+			if ledger:
+				ledger.mark_failed(str(csv_path), target, str(e))
+			failures.append((csv_path.name, str(e)))
+			console.print(f"[red]✗ {csv_path.name} → {target_table}: {e}[/red]")
+			continue
+		if ledger:
+			ledger.mark_done(str(csv_path), target, rows)
+		elapsed = max(time.monotonic() - started, 1e-9)
+		console.print(f"[green]✓[/green] {csv_path.name} → {target_table} ({rows:,} rows in {elapsed:.1f}s, {rows / elapsed:,.0f} rows/s)")
+		if seen is not None:
+			console.print(f"[dim]{csv_path.name}: {seen.describe()}[/dim]")
+
+	if failures:
+		print_failures(failures)
+		raise typer.Exit(code=1)
+
+	console.print("[bold green]Native ingestion complete.[/bold green]")
+
+
+BENCH_RESULTS_PATH = os.path.join("data", "ingest_bench.json")
+
+
+def _csv_list(value: str, cast=str) -> list:
+	return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def bench_codecs() -> dict:
+	"""
+	Wire compression usable for the bench: name -> encoder(bytes) -> bytes (None = send as-is).
+	zstd/lz4 come with clickhouse-connect's own dependencies but are still optional here.
+	"""
+	codecs = {"none": None, "gzip": lambda body: gzip.compress(body, compresslevel=1)}
+	try:
+		import zstandard
+		codecs["zstd"] = lambda body: zstandard.ZstdCompressor(level=1).compress(body)
+	except ImportError:
+		pass
+	try:
+		import lz4.frame
+		codecs["lz4"] = lz4.frame.compress
+	except ImportError:
+		pass
+	return codecs
+
+
+def read_sample(csv_path: pathlib.Path, sample_bytes: int) -> bytes:
+	"""
+	First sample_bytes of the CSV, extended to the end of the last line.
+	"""
+	with open(csv_path, "rb") as f:
+		sample = f.read(sample_bytes)
+		if sample and not sample.endswith(b"\n"):
+			sample += f.readline()
+	return sample
+
+
+def split_lines(sample: bytes, parts: int) -> List[bytes]:
+	"""
+	Split a buffer into at most `parts` line-aligned pieces of similar size.
+	"""
+	pieces = []
+	start = 0
+	step = max(1, len(sample) // parts)
+	while start < len(sample):
+		end = sample.find(b"\n", min(start + step, len(sample)) - 1)
+		end = len(sample) if end < 0 or len(pieces) == parts - 1 else end + 1
+		pieces.append(sample[start:end])
+		start = end
+	return pieces
+
+
+@app.command()
+def bench(
+	host: str = typer.Option("localhost", help="ClickHouse host"),
+	port: int = typer.Option(8123, help="ClickHouse HTTP port"),
+	username: str = typer.Option("default", help="ClickHouse username"),
+	password: str = typer.Option("", help="ClickHouse password", prompt=False, hide_input=True),
+	database: str = typer.Option("default", help="Target database"),
+	cwd: str = typer.Option(".", help="Project base directory containing data/ and schema/"),
+	csv: str = typer.Option("", help="CSV to sample (default: the largest uncompressed ttt_5_* CSV in data/)"),
+	sample_mb: int = typer.Option(64, help="Size of the representative slice loaded by every run"),
+	block_sizes: str = typer.Option("100000,1000000", help="max_insert_block_size values"),
+	concurrency: str = typer.Option("1,4", help="Parallel inserts per run"),
+	async_modes: str = typer.Option("0,1", help="async_insert values (always with wait_for_async_insert=1)"),
+	codecs: str = typer.Option("none,gzip,zstd,lz4", help="Wire compression: HTTP Content-Encoding for CSV, clickhouse-connect compress for Native"),
+	formats: str = typer.Option("csv,native", help="csv = server parses the text, native = parsed on the client (ingest-native)"),
+	repeats: int = typer.Option(1, help="Runs per configuration; the fastest is kept"),
+	results: str = typer.Option(BENCH_RESULTS_PATH, help="JSON file (relative to --cwd) receiving every run"),
+) -> None:
+	"""
+	Load a slice of a ttt_5_* CSV into a scratch copy of its table under a grid of insert
+	settings and report throughput and parts created, to pick ingest settings for this machine.
+	Merges are stopped on the scratch table so part counts reflect the insert pattern alone.
+	"""
+	base_dir = pathlib.Path(cwd).resolve()
+	pairs = [(c, q) for c, q in find_pairs(base_dir) if not is_compressed(c)]
+	if csv:
+		pairs = [(c, q) for c, q in pairs if c.name == pathlib.Path(csv).name]
+	if not pairs:
+		console.print("[red]No uncompressed CSV/SQL pair to sample.[/red]")
+		raise typer.Exit(code=1)
+	csv_path, sql_path = max(pairs, key=lambda pair: pair[0].stat().st_size)
+
+	available = bench_codecs()
+	codec_names = [c for c in _csv_list(codecs) if c in available]
+	for missing in sorted(set(_csv_list(codecs)) - set(codec_names)):
+		console.print(f"[yellow]Warning:[/yellow] codec '{missing}' not available, skipped")
+	grid = list(itertools.product(
+		_csv_list(formats), codec_names, _csv_list(block_sizes, int), _csv_list(concurrency, int), _csv_list(async_modes, int),
+	))
+
+	client = get_client(host=host, port=port, username=username, password=password, database=database)
+	target_table = ensure_table(client, csv_path, sql_path)
+	bench_table = f"{target_table}_bench"
+	db_name, _, short_name = bench_table.rpartition(".")
+	client.command(f"DROP TABLE IF EXISTS {bench_table}")
+	client.command(f"CREATE TABLE {bench_table} AS {target_table}")
+	client.command(f"SYSTEM STOP MERGES {bench_table}")
+
+	sample = read_sample(csv_path, sample_mb * 1024 * 1024)
+	sample_rows = sample.count(b"\n")
+	columns = table_columns(client, bench_table)
+	names = [name for name, _ in columns]
+	parser_pool = None
+	if "native" in _csv_list(formats):
+		check_columns(columns)
+		# Same parser processes as ingest-native; the parse runs inside every timed native run
+		parser_pool = ProcessPoolExecutor(max_workers=max(_csv_list(concurrency, int)))
+	console.print(f"[cyan]Benchmarking {len(grid)} configuration(s) x{repeats} on {human_size(len(sample))} "
+				  f"({sample_rows:,} rows) of {csv_path.name} → {bench_table}[/cyan]")
+
+	url = f"http://{host}:{port}/"
+	auth = (username, password) if password else None
+	native_clients = {}
+
+	def run_csv(codec: str, block_size: int, workers: int, async_insert: int) -> None:
+		encode = available[codec]
+		params = {
+			"query": f"INSERT INTO {bench_table} FORMAT CSV",
+			"max_insert_block_size": block_size,
+			"async_insert": async_insert,
+			"wait_for_async_insert": 1,
+		}
+
+		def send(part: bytes) -> None:
+			headers = {"Content-Encoding": codec} if encode else {}
+			response = requests.post(url, params=params, data=encode(part) if encode else part, headers=headers, auth=auth, timeout=600)
+			if response.status_code != 200:
+				raise Exception(f"HTTP {response.status_code} - {response.text.strip()[:200]}")
+
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			list(executor.map(send, split_lines(sample, workers)))
+
+	def run_native(codec: str, block_size: int, workers: int, async_insert: int) -> None:
+		# One client per worker: a clickhouse-connect client runs one query at a time
+		key = (codec, workers)
+		if key not in native_clients:
+			native_clients[key] = [
+				get_client(host=host, port=port, username=username, password=password, database=database,
+						   compress=False if codec == "none" else codec)
+				for _ in range(workers)
+			]
+		ends = list(itertools.accumulate(len(piece) for piece in split_lines(sample, workers)))
+		ranges = list(zip([0] + ends[:-1], ends))
+		settings = {"max_insert_block_size": block_size, "async_insert": async_insert, "wait_for_async_insert": 1}
+
+		def send(index: int) -> None:
+			rows, part, _ = parser_pool.submit(parse_range, str(csv_path), *ranges[index], columns).result()
+			if rows:
+				native_clients[key][index].insert(short_name, part, column_names=names, database=db_name or None,
+												 column_oriented=True, settings=settings)
+
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			list(executor.map(send, range(len(ranges))))
+
+	runs = []
+	try:
+		with Progress(SpinnerColumn(), TextColumn("{task.description}"), BarColumn(), TimeElapsedColumn(), console=console) as progress:
+			task = progress.add_task("bench", total=len(grid) * repeats)
+			for fmt, codec, block_size, workers, async_insert in grid:
+				config = {"format": fmt, "codec": codec, "block_size": block_size, "concurrency": workers, "async_insert": async_insert}
+				progress.update(task, description=" ".join(f"{k}={v}" for k, v in config.items()))
+				best = None
+				for _ in range(repeats):
+					client.command(f"TRUNCATE TABLE {bench_table}")
+					started = time.monotonic()
+					try:
+						(run_native if fmt == "native" else run_csv)(codec, block_size, workers, async_insert)
+					except Exception as e:
+						best = {**config, "error": str(e)}
+						progress.advance(task)
+						break
+					elapsed = max(time.monotonic() - started, 1e-9)
+					rows, parts = client.query(
+						"SELECT sum(rows), count() FROM system.parts WHERE active AND database = {db:String} AND table = {table:String}",
+						parameters={"db": db_name or database, "table": short_name},
+					).result_rows[0]
+					run = {
+						**config,
+						"seconds": round(elapsed, 3),
+						"mb_per_s": len(sample) / elapsed / 1024 / 1024,
+						"rows_per_s": sample_rows / elapsed,
+						"rows": int(rows),
+						"parts": int(parts),
+					}
+					if best is None or run["rows_per_s"] > best["rows_per_s"]:
+						best = run
+					progress.advance(task)
+				runs.append(best)
+	finally:
+		if parser_pool is not None:
+			parser_pool.shutdown()
+		client.command(f"DROP TABLE IF EXISTS {bench_table}")
+
+	ok = sorted((r for r in runs if "error" not in r), key=lambda r: r["rows_per_s"], reverse=True)
+	table = Table(title=f"Ingest Bench ({csv_path.name}, {human_size(len(sample))})")
+	for column in ("format", "codec", "block_size", "concurrency", "async", "MB/s", "rows/s", "parts"):
+		table.add_column(column, justify="right" if column not in ("format", "codec") else "left")
+	for r in ok:
+		table.add_row(r["format"], r["codec"], f"{r['block_size']:,}", str(r["concurrency"]), str(r["async_insert"]),
+					  f"{r['mb_per_s']:.1f}", f"{r['rows_per_s']:,.0f}", str(r["parts"]))
+	console.print(table)
+	for r in runs:
+		if "error" in r:
+			console.print(f"[red]✗ {r['format']}/{r['codec']}/{r['block_size']}/{r['concurrency']}/async={r['async_insert']}: {r['error']}[/red]")
+	for r in ok:
+		if r["rows"] != sample_rows:
+			console.print(f"[yellow]Warning:[/yellow] {r['format']}/{r['codec']} run stored {r['rows']:,} of {sample_rows:,} rows")
+
+	results_path = base_dir / results
+	results_path.parent.mkdir(parents=True, exist_ok=True)
+	results_path.write_text(json.dumps({
+		"csv": csv_path.name, "sample_bytes": len(sample), "sample_rows": sample_rows, "runs": runs,
+	}, indent=2), encoding="utf-8")
+
+	if ok:
+		best = ok[0]
+		console.print(
+			f"[bold green]Best:[/bold green] format={best['format']} codec={best['codec']} "
+			f"max_insert_block_size={best['block_size']:,} concurrency={best['concurrency']} async_insert={best['async_insert']} "
+			f"→ {best['rows_per_s']:,.0f} rows/s, {best['mb_per_s']:.1f} MB/s, {best['parts']} part(s)"
+		)
+	console.print(f"[dim]Results written to {results_path}[/dim]")
+
+
+@snapshot_app.command("export")
+def snapshot_export(
+	host: str = typer.Option("localhost", help="ClickHouse host"),
+	port: int = typer.Option(8123, help="ClickHouse HTTP port"),
+	username: str = typer.Option("default", help="ClickHouse username"),
+	password: str = typer.Option("", help="ClickHouse password", prompt=False, hide_input=True),
+	database: str = typer.Option("default", help="Database holding the ttt_5_* tables"),
+	cwd: str = typer.Option(".", help="Project base directory containing data/"),
+	output: str = typer.Option("", help=f"Snapshot directory (default: {SNAPSHOT_DIR}/<database>-<timestamp> under --cwd)"),
+	tables: str = typer.Option("", help="Comma-separated tables to export (default: every ttt_5_* MergeTree table)"),
+	workers: int = typer.Option(4, help="Tables exported in parallel"),
+	codec: str = typer.Option(DEFAULT_CODEC, help=f"HTTP compression applied by the server: {', '.join(CODEC_SUFFIXES)}"),
+) -> None:
+	"""
+	Dump every ttt_5_* table as a server-compressed Native file, with its CREATE statement, row
+	count and checksum in manifest.json, plus a copy of the ingest manifest.
+	"""
+	if codec not in CODEC_SUFFIXES:
+		console.print(f"[red]Unknown codec '{codec}'[/red]")
+		raise typer.Exit(code=2)
+	base_dir = pathlib.Path(cwd).resolve()
+	url = f"http://{host}:{port}/"
+	auth = (username, password) if password else None
+
+	found = list_tables(url, database, auth)
+	if tables:
+		wanted = set(_csv_list(tables))
+		for missing in sorted(wanted - {t["table"] for t in found}):
+			console.print(f"[yellow]Warning:[/yellow] no MergeTree table {database}.{missing}, skipped")
+		found = [t for t in found if t["table"] in wanted]
+	if not found:
+		console.print(f"[red]No ttt_5_* tables in {database}.[/red]")
+		raise typer.Exit(code=1)
+
+	snapshot_dir = pathlib.Path(output) if output else base_dir / SNAPSHOT_DIR / f"{database}-{time.strftime('%Y%m%d-%H%M%S')}"
+	snapshot_dir.mkdir(parents=True, exist_ok=True)
+	console.print(f"[cyan]Exporting {len(found)} table(s) ({human_size(sum(t['bytes'] for t in found))} on disk) "
+				  f"from {database} to {snapshot_dir} with {workers} worker(s)...[/cyan]")
+
+	progress = Progress(SpinnerColumn(), TextColumn("{task.description}"), DownloadColumn(), TransferSpeedColumn(), TimeElapsedColumn(), console=console)
+
+	def dump(info: dict) -> dict:
+		task = progress.add_task(info["table"], total=None)
+		entry = export_table(url, database, info["table"], str(snapshot_dir), auth, codec,
+							 on_progress=lambda n: progress.update(task, advance=n))
+		entry["engine"] = info["engine"]
+		return entry
+
+	entries = []
+	failures: List[Tuple[str, str]] = []
+	with progress, ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="snapshot") as executor:
+		futures = {executor.submit(dump, info): info["table"] for info in found}
+		for future in as_completed(futures):
+			try:
+				entry = future.result()
+			except Exception as e:
+				failures.append((futures[future], str(e)))
+				progress.console.print(f"[red]✗ {futures[future]}: {e}[/red]")
+				continue
+			entries.append(entry)
+			progress.console.print(f"[green]✓[/green] {entry['table']}: {entry['rows']:,} rows → "
+								   f"{human_size(entry['file_bytes'])} in {entry['seconds']:.1f}s")
+
+	ingest_manifest = base_dir / MANIFEST_PATH
+	if ingest_manifest.exists():
+		shutil.copyfile(ingest_manifest, snapshot_dir / INGEST_MANIFEST_FILE)
+	if failures:
+		# Without manifest.json the directory can't be restored by mistake
+		print_failures(failures)
+		raise typer.Exit(code=1)
+	write_manifest(str(snapshot_dir), {
+		"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"source": {"url": url, "database": database, "version": run_sql(url, "SELECT version()", auth).strip()},
+		"tables": sorted(entries, key=lambda e: e["table"]),
+	})
+	console.print(f"[bold green]Snapshot written to {snapshot_dir} "
+				  f"({human_size(sum(e['file_bytes'] for e in entries))}, {sum(e['rows'] for e in entries):,} rows).[/bold green]")
+
+
+@snapshot_app.command("restore")
+def snapshot_restore(
+	path: str = typer.Argument(..., help="Snapshot directory written by 'snapshot export'"),
+	host: str = typer.Option("localhost", help="ClickHouse host"),
+	port: int = typer.Option(8123, help="ClickHouse HTTP port"),
+	username: str = typer.Option("default", help="ClickHouse username"),
+	password: str = typer.Option("", help="ClickHouse password", prompt=False, hide_input=True),
+	database: str = typer.Option("", help="Target database (default: the snapshot's source database)"),
+	cwd: str = typer.Option(".", help="Project base directory containing data/"),
+	workers: int = typer.Option(4, help="Tables restored in parallel"),
+	recreate: bool = typer.Option(False, help="Drop and recreate tables that already exist"),
+	manifest: bool = typer.Option(True, help=f"Record the restored tables' source CSVs in {MANIFEST_PATH} so 'ingest' skips them"),
+) -> None:
+	"""
+	Recreate the snapshot's tables from their saved CREATE statements and load the Native files
+	in parallel; each table's checksum and row count are verified.
+	"""
+	base_dir = pathlib.Path(cwd).resolve()
+	snapshot_dir = pathlib.Path(path)
+	snapshot = load_manifest(str(snapshot_dir))
+	source_db = snapshot["source"]["database"]
+	database = database or source_db
+	url = f"http://{host}:{port}/"
+	auth = (username, password) if password else None
+
+	# DDL first, sequentially: existing non-empty tables are only replaced with --recreate
+	run_sql(url, f"CREATE DATABASE IF NOT EXISTS {database}", auth)
+	planned = []
+	for entry in snapshot["tables"]:
+		full_name = f"{database}.{entry['table']}"
+		exists = run_sql(url, f"EXISTS TABLE {full_name}", auth).strip() == "1"
+		if exists and recreate:
+			run_sql(url, f"DROP TABLE {full_name} SYNC", auth)
+			exists = False
+		if exists:
+			rows = int(run_sql(url, f"SELECT count() FROM {full_name}", auth).strip())
+			if rows:
+				console.print(f"[dim]⏭ {full_name} already has {rows:,} rows, skipping (use --recreate)[/dim]")
+				continue
+		else:
+			create_sql = (snapshot_dir / entry["schema"]).read_text(encoding="utf-8")
+			run_sql(url, retarget_create(create_sql, source_db, database, entry["table"]), auth)
+		planned.append(entry)
+
+	console.print(f"[cyan]Restoring {len(planned)} table(s) ({human_size(sum(e['file_bytes'] for e in planned))}) "
+				  f"into {database} with {workers} worker(s)...[/cyan]")
+	progress = Progress(SpinnerColumn(), TextColumn("{task.description}"), BarColumn(), DownloadColumn(), TransferSpeedColumn(), TimeElapsedColumn(), console=console)
+
+	def load(entry: dict) -> Tuple[int, float]:
+		task = progress.add_task(entry["table"], total=entry["file_bytes"])
+		started = time.monotonic()
+		rows = restore_table(url, database, str(snapshot_dir), entry, auth, on_progress=lambda n: progress.update(task, advance=n))
+		return rows, time.monotonic() - started
+
+	restored = []
+	failures: List[Tuple[str, str]] = []
+	with progress, ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="restore") as executor:
+		# Largest files first so the long loads don't end up running alone at the tail
+		futures = {executor.submit(load, entry): entry["table"] for entry in sorted(planned, key=lambda e: e["file_bytes"], reverse=True)}
+		for future in as_completed(futures):
+			table_name = futures[future]
+			try:
+				rows, elapsed = future.result()
+			except Exception as e:
+				failures.append((table_name, str(e)))
+				progress.console.print(f"[red]✗ {table_name}: {e}[/red]")
+				continue
+			restored.append(table_name)
+			progress.console.print(f"[green]✓[/green] {database}.{table_name}: {rows:,} rows in {elapsed:.1f}s "
+								   f"({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+	snapshot_ingest = snapshot_dir / INGEST_MANIFEST_FILE
+	if manifest and restored and snapshot_ingest.exists():
+		# Keys are <endpoint><db.table>: move the restored tables' entries onto this endpoint/database
+		source_entries = IngestManifest.normalize(json.loads(snapshot_ingest.read_text(encoding="utf-8")))
+		moved = {}
+		for key, files in source_entries.items():
+			table_name = key.rsplit("/", 1)[-1]
+			db_name, _, short_name = table_name.rpartition(".")
+			done = {path: entry for path, entry in files.items() if entry.get("status") == "done"}
+			if short_name in restored and db_name in ("", source_db) and done:
+				moved[f"{url}{database}.{short_name}" if db_name else f"{url}{short_name}"] = done
+		IngestManifest(str(base_dir / MANIFEST_PATH)).import_entries(moved)
+		console.print(f"[dim]Recorded {sum(len(files) for files in moved.values())} loaded CSV(s) in {MANIFEST_PATH}[/dim]")
+
+	if failures:
+		print_failures(failures)
+		raise typer.Exit(code=1)
+	console.print(f"[bold green]Restored {len(restored)} table(s) into {database}.[/bold green]")
 
 
 @app.command()
@@ -226,6 +1386,8 @@ def env_example() -> None:
 				"CLICKHOUSE_USER=default",
 				"CLICKHOUSE_PASSWORD=",
 				"CLICKHOUSE_DATABASE=default",
+				"CLICKHOUSE_INGEST_CONCURRENCY=4",
+				"CLICKHOUSE_INGEST_CHUNK_MB=256",
 			]
 		)
 	)
@@ -260,6 +1422,20 @@ def run(
 		password=password,
 		database=database,
 		cwd=str(base_dir),
+		concurrency=int(os.getenv("CLICKHOUSE_INGEST_CONCURRENCY", "1")),
+		max_inflight_mb=256,
+		chunk_mb=int(os.getenv("CLICKHOUSE_INGEST_CHUNK_MB", "0")),
+		chunk_workers=4,
+		restart=False,
+		passthrough=True,
+		manifest=True,
+		results=RESULTS_PATH,
+		live=True,
+		dedup=False,
+		dedup_mb=DEFAULT_DEDUP_MB,
+		replacing=False,
+		allow_errors=0,
+		dry_run=False,
 	)
 
 
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+
+#==========================================Ingest Telemetry==========================================
+# Mỗi INSERT xin server gửi progress trong HTTP header (send_progress_in_http_headers) và đọc
+# X-ClickHouse-Summary cuối response: rows/bytes server đã ghi và thời gian server xử lý.
+# Ghép với số liệu phía client (bytes gửi, thời gian chờ) để thấy thời gian ingest nằm ở đâu:
+#   server_share < 1  client/network chậm hơn server (đọc disk, giải nén, upload)
+#   wire_ratio        bytes server materialize / bytes gửi qua mạng (Content-Encoding, format)
+#   storage_ratio     data_uncompressed_bytes / data_compressed_bytes của parts sau khi load
+#   unwritten_rows    read_rows - written_rows: rows server đã parse nhưng không ghi, tức là rows lỗi bị bỏ qua
+#                     khi bật input_format_allow_errors_num/ratio, hoặc block bị insert_deduplication_token bỏ
+
+RESULTS_PATH = os.path.join("data", "ingest_results.json")
+# Interval dài: requests chỉ thấy header khi response về, và http.client giới hạn 100 header mỗi response
+PROGRESS_PARAMS = {"send_progress_in_http_headers": 1, "http_headers_progress_interval_ms": 120_000}
+SUMMARY_FIELDS = ("read_rows", "read_bytes", "written_rows", "written_bytes", "elapsed_ns")
+
+
+def parse_summary(headers) -> dict:
+    """
+    Số liệu của X-ClickHouse-Summary (hoặc X-ClickHouse-Progress cuối cùng nếu server cũ không gửi Summary)
+
+    Returns:
+        {field: int} chỉ gồm các field server có gửi, {} nếu không có header nào
+    """
+    raw = headers.get("X-ClickHouse-Summary")
+    if raw is None:
+        progress = headers.get("X-ClickHouse-Progress")
+        if progress is None:
+            return {}
+        # Nhiều header cùng tên được requests nối bằng ", "
+        raw = progress[progress.rfind("{"):]
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return {}
+    return {field: int(data[field]) for field in SUMMARY_FIELDS if field in data}
+
+
+def merge_summaries(summaries: list[dict]) -> dict:
+    """
+    Cộng dồn summary của nhiều INSERT (các chunk của một file)
+    elapsed_ns là tổng thời gian server của các INSERT, có thể lớn hơn wall time khi chạy song song
+    """
+    merged = {}
+    for summary in summaries:
+        for field, value in summary.items():
+            merged[field] = merged.get(field, 0) + value
+    return merged
+
+
+def _ratio(numerator, denominator):
+    if not numerator or not denominator:
+        return None
+    return numerator / denominator
+
+
+def file_metrics(file_bytes: int, sent_bytes: int, client_elapsed: float, summary: dict) -> dict:
+    """
+    Throughput và tỉ lệ của một file (hoặc tổng nhiều file)
+    """
+    elapsed = max(client_elapsed, 1e-9)
+    server_elapsed = summary["elapsed_ns"] / 1e9 if "elapsed_ns" in summary else None
+    written_rows = summary.get("written_rows")
+    read_rows = summary.get("read_rows")
+    # Server cũ báo read_rows = 0 cho INSERT, khi đó không so được
+    unwritten_rows = max(read_rows - written_rows, 0) if read_rows and written_rows is not None else None
+    return {
+        "file_bytes": file_bytes,
+        "sent_bytes": sent_bytes,
+        "read_rows": read_rows,
+        "written_rows": written_rows,
+        "unwritten_rows": unwritten_rows,
+        "written_bytes": summary.get("written_bytes"),
+        "client_elapsed_s": round(client_elapsed, 3),
+        "server_elapsed_s": round(server_elapsed, 3) if server_elapsed is not None else None,
+        "server_share": _ratio(server_elapsed, elapsed),
+        "mb_per_s": sent_bytes / elapsed / 1024 / 1024,
+        "rows_per_s": written_rows / elapsed if written_rows is not None else None,
+        "wire_ratio": _ratio(summary.get("written_bytes"), sent_bytes),
+    }
+
+
+def describe(metrics: dict) -> str:
+    """
+    Một dòng tóm tắt cho console
+    """
+    parts = []
+    if metrics.get("written_rows") is not None:
+        parts.append(f"{metrics['written_rows']:,} rows")
+    if metrics.get("unwritten_rows"):
+        parts.append(f"⚠ {metrics['unwritten_rows']:,} of {metrics['read_rows']:,} parsed rows not written")
+    parts.append(f"{metrics['mb_per_s']:.1f} MB/s")
+    if metrics.get("rows_per_s") is not None:
+        parts.append(f"{metrics['rows_per_s']:,.0f} rows/s")
+    if metrics.get("server_elapsed_s") is not None:
+        parts.append(f"server {metrics['server_elapsed_s']:.1f}s / client {metrics['client_elapsed_s']:.1f}s")
+    else:
+        parts.append(f"{metrics['client_elapsed_s']:.1f}s")
+    if metrics.get("wire_ratio") is not None:
+        parts.append(f"wire x{metrics['wire_ratio']:.2f}")
+    if metrics.get("storage_ratio") is not None:
+        parts.append(f"disk x{metrics['storage_ratio']:.2f}")
+    return ", ".join(parts)
+
+
+class IngestTelemetry:
+    """
+    Gom số liệu từng file (thread-safe) và ghi file JSON kết quả
+    """
+
+    def __init__(self, path: str = RESULTS_PATH, settings: dict = None):
+        self.path = path
+        self.settings = settings or {}
+        self.started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self.files = []
+        self._summaries = []
+        self._storage = {}
+
+    def record(self, name: str, table: str, file_bytes: int, sent_bytes: int, client_elapsed: float,
+               summary: dict) -> dict:
+        metrics = {"file": name, "table": table, **file_metrics(file_bytes, sent_bytes, client_elapsed, summary)}
+        with self._lock:
+            self.files.append(metrics)
+            self._summaries.append(summary)
+        return metrics
+
+    def set_storage(self, table: str, compressed: int, uncompressed: int):
+        with self._lock:
+            self._storage[table] = (compressed, uncompressed)
+            for metrics in self.files:
+                if metrics["table"] == table:
+                    metrics["storage_ratio"] = _ratio(uncompressed, compressed)
+
+    def aggregate(self) -> dict:
+        with self._lock:
+            files = list(self.files)
+            summary = merge_summaries(self._summaries)
+            storage = list(self._storage.values())
+        metrics = file_metrics(
+            sum(m["file_bytes"] for m in files),
+            sum(m["sent_bytes"] for m in files),
+            time.monotonic() - self._started,
+            summary,
+        )
+        metrics["storage_ratio"] = _ratio(sum(u for _, u in storage), sum(c for c, _ in storage))
+        return metrics
+
+    def write(self, failures: list = None) -> dict:
+        """
+        Ghi {settings, files, aggregate, failures} ra self.path
+
+        Returns:
+            Aggregate metrics
+        """
+        aggregate = self.aggregate()
+        with self._lock:
+            results = {
+                "started_at": self.started_at,
+                "settings": self.settings,
+                "files": self.files,
+                "aggregate": aggregate,
+                "failures": [{"file": name, "error": error} for name, error in (failures or [])],
+            }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        return aggregate
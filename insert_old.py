@@ -1,46 +1,151 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 from tqdm import tqdm
 
+from chunked_upload import upload_csv_chunked, checkpoint_state, PIECE_BYTES
+from ingest_manifest import IngestManifest
+from ingest_telemetry import IngestTelemetry, describe
+
 # --- Thông tin kết nối ClickHouse ---
 CLICKHOUSE_HTTP = "http://localhost:8123"
 CLICKHOUSE_USER = "default"
 CLICKHOUSE_PASS = "admin"
 DATABASE = "tictactoe"
 
+# --- Song song ---
+CONCURRENCY = 4                           # số bảng import cùng lúc
+CHUNK_WORKERS = 4                         # số INSERT song song trong một file
+CHUNK_BYTES = 256 * 1024 * 1024           # mỗi file chia thành các khoảng ~256MB cắt đúng đầu dòng
+MAX_INFLIGHT_BYTES = 256 * 1024 * 1024    # tổng bytes đã đọc từ disk nhưng chưa gửi, cho tất cả upload
+
+
+class PieceBudget:
+    """Giới hạn bytes đang bay (acquire/release theo miếng PIECE_BYTES của chunked_upload)"""
+
+    def __init__(self, limit: int):
+        self._slots = threading.BoundedSemaphore(max(1, limit // PIECE_BYTES))
+
+    def acquire(self, size: int):
+        self._slots.acquire()
+
+    def release(self, size: int):
+        if size:
+            self._slots.release()
+
+
+budget = PieceBudget(MAX_INFLIGHT_BYTES)
+manifest = IngestManifest()
+telemetry = IngestTelemetry(settings={"concurrency": CONCURRENCY, "chunk_workers": CHUNK_WORKERS, "chunk_bytes": CHUNK_BYTES})
+
+
+def import_table(table: str, csv_file: str, restart: bool, position: int) -> str:
+    """
+    Upload một file CSV theo các khoảng song song, có checkpoint để chạy lại thì tiếp tục
+    Trả về thông báo lỗi (None nếu thành công)
+    """
+    target = f"{CLICKHOUSE_HTTP}/{DATABASE}.{table}"
+    file_size = os.path.getsize(csv_file)
+    with tqdm(total=file_size, unit="B", unit_scale=True, desc=table, position=position, leave=True) as pbar:
+        try:
+            sent, elapsed, rows, summary = upload_csv_chunked(
+                csv_file,
+                CLICKHOUSE_HTTP,
+                table,
+                params={"user": CLICKHOUSE_USER, "password": CLICKHOUSE_PASS, "database": DATABASE},
+                chunk_bytes=CHUNK_BYTES,
+                workers=CHUNK_WORKERS,
+                budget=budget,
+                restart=restart,
+                on_progress=pbar.update,
+                log=tqdm.write,
+            )
+        except Exception as e:
+            manifest.mark_failed(csv_file, target, str(e))
+            return str(e)
+    manifest.mark_done(csv_file, target, rows)
+    metrics = telemetry.record(os.path.basename(csv_file), table, file_size, sent, elapsed, summary)
+    tqdm.write(f"   {table}: {describe(metrics)}")
+    return None
+
+
 # --- Import dữ liệu ---
+jobs = []
 for i in range(9, 26):
     table = f"ttt_5_l{i}"
     csv_file = f"data/{table}.csv"
     if not os.path.exists(csv_file):
         print(f"⚠️  Bỏ qua {table}: không có file {csv_file}")
         continue
+    jobs.append((table, csv_file))
 
-    print(f"\n📂 Bắt đầu import {csv_file} → {table}")
+# File lớn chạy trước để không còn một upload dài chạy một mình ở cuối
+jobs.sort(key=lambda job: os.path.getsize(job[1]), reverse=True)
 
-    # Dùng streaming upload + progress bar
-    file_size = os.path.getsize(csv_file)
-    with open(csv_file, "rb") as f, tqdm(
-        total=file_size, unit="B", unit_scale=True, desc=table
-    ) as pbar:
-        def read_in_chunks(file_object, chunk_size=1024 * 1024):
-            while chunk := file_object.read(chunk_size):
-                pbar.update(len(chunk))
-                yield chunk
-
-        r = requests.post(
-            CLICKHOUSE_HTTP,
-            params={
-                "user": CLICKHOUSE_USER,
-                "password": CLICKHOUSE_PASS,
-                "database": DATABASE,
-                "query": f"INSERT INTO {table} FORMAT CSV",
-            },
-            data=read_in_chunks(f),
-        )
-
-    if r.status_code == 200:
-        print(f"✅ Import thành công: {table}")
-    else:
-        print(f"❌ Lỗi import {table}: {r.text}")
+def run_sql(sql: str) -> str:
+    response = requests.post(
+        CLICKHOUSE_HTTP,
+        params={"user": CLICKHOUSE_USER, "password": CLICKHOUSE_PASS, "database": DATABASE},
+        data=sql.encode(),
+    )
+    response.raise_for_status()
+    return response.text
+
+
+# Manifest: file không đổi đã load xong thì bỏ qua, load dở thì gửi tiếp, file đã đổi thì TRUNCATE rồi load lại.
+# Gửi tiếp chỉ khi checkpoint còn khớp file/chunk size; bỏ qua chỉ khi table còn đúng số rows manifest đã ghi
+# (table bị tạo lại/TRUNCATE thì import lại); table chưa có trong manifest mà đã có rows thì không
+# import chồng lên (sẽ nhân đôi rows)
+pending_jobs = []
+for table, csv_file in jobs:
+    target = f"{CLICKHOUSE_HTTP}/{DATABASE}.{table}"
+    action = manifest.plan(csv_file, target, "chunked")
+    checkpoint = checkpoint_state(csv_file, table, CHUNK_BYTES)
+    if action == "resume" and checkpoint != "usable":
+        action = "reload"
+    elif action == "skip":
+        rows = int(run_sql(f"SELECT count() FROM {table}"))
+        recorded = manifest.recorded_rows(target)
+        if rows == 0 or (recorded is not None and rows != recorded):
+            action = "reload"
+    elif action == "load" and checkpoint == "usable":
+        action = "resume"
+    elif action == "load":
+        rows = int(run_sql(f"SELECT count() FROM {table}"))
+        if rows:
+            print(f"⚠️  Bỏ qua {table}: bảng đã có {rows:,} rows không rõ nguồn, TRUNCATE TABLE {table} rồi chạy lại")
+            continue
+    if action == "skip":
+        print(f"⏭️  Bỏ qua {table}: {csv_file} không đổi kể từ lần import trước")
+        continue
+    if action == "reload":
+        print(f"🔄 {table}: file đã đổi hoặc import trước chưa xong, TRUNCATE rồi import lại")
+        run_sql(f"TRUNCATE TABLE {table}")
+    manifest.mark_started(csv_file, target, "chunked")
+    pending_jobs.append((table, csv_file, action == "reload"))
+jobs = pending_jobs
+print(f"\n📂 Bắt đầu import {len(jobs)} bảng ({CONCURRENCY} bảng song song)")
+
+failures = {}
+with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+    futures = {
+        executor.submit(import_table, table, csv_file, restart, position): table
+        for position, (table, csv_file, restart) in enumerate(jobs)
+    }
+    for future in as_completed(futures):
+        table = futures[future]
+        error = future.result()
+        if error is None:
+            tqdm.write(f"✅ Import thành công: {table}")
+        else:
+            failures[table] = error
+            tqdm.write(f"❌ Lỗi import {table}: {error}")
 
+print(f"\n📊 {len(jobs) - len(failures)}/{len(jobs)} bảng import thành công")
+for table, error in sorted(failures.items()):
+    print(f"   ❌ {table}: {error}")
+aggregate = telemetry.write(sorted(failures.items()))
+print(f"   ⚡ {describe(aggregate)}")
+print(f"   📝 Kết quả chi tiết: {telemetry.path}")
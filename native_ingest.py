@@ -0,0 +1,160 @@
+import csv
+import io
+import itertools
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from query_builder import CELL_COLUMNS
+from chunked_upload import split_line_ranges
+from canonical_dedup import canonical_keys
+
+#==========================================Client-side CSV -> Native==========================================
+# Server phải parse 27 cột CSV có quote cho mỗi row, là input format chậm nhất.
+# Ở đây CSV được parse song song trong các worker process (mỗi process một khoảng byte cắt đúng đầu dòng,
+# đọc qua mmap), tính luôn cột dẫn xuất canonical_key của compact layout rồi gửi từng block đã parse
+# bằng clickhouse-connect (Native format), server chỉ còn việc ghi part.
+
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+CSV_COLUMNS = ["canonical_form", "win_actor"] + CELL_COLUMNS
+DERIVED_COLUMNS = ("canonical_key",)
+
+# byte của ô -> 0 trống, 1 X, 2 O
+CELL_LUT = np.zeros(256, dtype=np.uint8)
+CELL_LUT[ord("X")] = 1
+CELL_LUT[ord("O")] = 2
+CELL_MARKS = np.array(["", "X", "O"], dtype=object)
+BIT_WEIGHTS = np.left_shift(np.uint64(1), np.arange(len(CELL_COLUMNS), dtype=np.uint64))
+
+
+def table_columns(client, table: str) -> list[tuple[str, str]]:
+    """
+    (name, type) các cột của table đích theo đúng thứ tự
+    """
+    result = client.query(f"DESCRIBE TABLE {table}")
+    return [(row[0], row[1]) for row in result.result_rows]
+
+
+def check_columns(columns: list[tuple[str, str]]):
+    unknown = [name for name, _ in columns if name not in CSV_COLUMNS and name not in DERIVED_COLUMNS]
+    if unknown:
+        raise ValueError(f"Cannot fill column(s) {', '.join(unknown)} from the CSV")
+
+
+def parse_range(csv_path: str, start: int, end: int, columns: list[tuple[str, str]],
+                with_keys: bool = False) -> tuple[int, list, np.ndarray]:
+    """
+    Parse một khoảng byte của CSV thành các cột của table đích (chạy trong worker process)
+
+    Args:
+        csv_path: File CSV (không nén, để mmap được)
+        start, end: Khoảng byte, đã cắt đúng đầu dòng
+        columns: (name, type) của table đích
+        with_keys: Tính thêm canonical key của từng row (cho CanonicalDedup)
+
+    Returns:
+        (số rows, danh sách giá trị từng cột theo thứ tự columns, canonical keys hoặc None)
+    """
+    with open(csv_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode("utf-8")
+
+    rows = [row for row in csv.reader(io.StringIO(text)) if row]
+    n = len(rows)
+    if n == 0:
+        return 0, [[] for _ in columns], np.empty(0, dtype=np.uint64) if with_keys else None
+
+    # 25 ô mỗi row -> một byte (ô trống thành "-"), tra LUT ra 0/1/2
+    marks = "".join((value or "-")[0] for row in rows for value in row[2:27]).encode("ascii")
+    cells = CELL_LUT[np.frombuffer(marks, dtype=np.uint8)].reshape(n, len(CELL_COLUMNS))
+    x_mask = (cells == 1).astype(np.uint64) @ BIT_WEIGHTS
+    o_mask = (cells == 2).astype(np.uint64) @ BIT_WEIGHTS
+
+    data = build_columns(columns, [row[0] for row in rows], [row[1] for row in rows], cells, x_mask, o_mask)
+    return n, data, canonical_keys(x_mask, o_mask) if with_keys else None
+
+
+def build_columns(columns: list[tuple[str, str]], canonical_forms: list, win_actors: list, cells: np.ndarray,
+                  x_mask: np.ndarray, o_mask: np.ndarray) -> list:
+    """
+    Giá trị từng cột của table đích (column-oriented) từ ma trận ô và bitmask X/O
+
+    Args:
+        columns: (name, type) của table đích
+        canonical_forms, win_actors: Giá trị hai cột đầu của mỗi row
+        cells: Ma trận (rows x 25) giá trị ô 0/1/2
+        x_mask, o_mask: Bitmask uint64 quân X/O của mỗi row
+
+    Returns:
+        Danh sách giá trị từng cột theo thứ tự columns
+    """
+    data = []
+    for name, col_type in columns:
+        if name == "canonical_form":
+            data.append(list(canonical_forms))
+        elif name == "win_actor":
+            data.append(list(win_actors))
+        elif name == "canonical_key":
+            data.append((x_mask | (o_mask << np.uint64(len(CELL_COLUMNS)))).tolist())
+        else:
+            column = cells[:, CELL_COLUMNS.index(name)]
+            # UInt8 layout lưu số, FixedString(1)/Enum8 lưu 'X'/'O'/''
+            data.append(column.tolist() if "Int" in col_type else CELL_MARKS[column].tolist())
+    return data
+
+
+def load_csv_native(client, csv_path: str, table: str, workers: int = None,
+                    chunk_bytes: int = DEFAULT_CHUNK_BYTES, on_progress=None, dedup=None) -> int:
+    """
+    Parse CSV song song ở client và INSERT các block đã parse qua clickhouse-connect
+
+    Args:
+        client: clickhouse-connect client
+        csv_path: File CSV không nén
+        table: Table đích (có thể kèm database: db.table)
+        workers: Số worker process (mặc định số CPU)
+        chunk_bytes: Kích thước khoảng byte mỗi worker parse một lần (= một INSERT)
+        on_progress: Callback(rows, bytes) sau mỗi block đã insert
+        dedup: CanonicalDedup, bỏ row có canonical key đã gặp trước khi insert
+
+    Returns:
+        Tổng số rows đã insert
+    """
+    columns = table_columns(client, table)
+    check_columns(columns)
+    names = [name for name, _ in columns]
+    database, _, short_table = table.rpartition(".")
+    workers = workers or os.cpu_count() or 1
+
+    ranges = iter(split_line_ranges(csv_path, chunk_bytes))
+    total_rows = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def fill():
+            # Tối đa 2 block mỗi worker đang parse/chờ insert, để RAM không phình theo kích thước file
+            while len(pending) < workers * 2:
+                item = next(ranges, None)
+                if item is None:
+                    return
+                pending[executor.submit(parse_range, csv_path, item[0], item[1], columns, dedup is not None)] = item
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, end = pending.pop(future)
+                rows, data, keys = future.result()
+                if dedup is not None and rows:
+                    keep = dedup.filter(keys)
+                    data = [list(itertools.compress(column, keep)) for column in data]
+                    rows = int(keep.sum())
+                if rows:
+                    client.insert(short_table, data, column_names=names, database=database or None,
+                                  column_oriented=True, settings={"async_insert": 0})
+                total_rows += rows
+                if on_progress is not None:
+                    on_progress(rows, end - start)
+            fill()
+    return total_rows
@@ -0,0 +1,152 @@
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+import clickhouse_connect
+from clickhouse_connect.driver.exceptions import OperationalError
+
+from clickhouse_config import CLICKHOUSE_HTTP, CLICKHOUSE_USER, CLICKHOUSE_PASS, DATABASE
+from query_cancellation import current_move_scope, as_cancelled, QueryCancelled, standalone_query_id
+from replica_router import ReplicaRouter, EndpointUnavailable
+from query_builder import (OUTCOMES, CONSOLIDATED_TABLE, CONSOLIDATED_READY_COMMENT, build_candidate_counts_query,
+                           query_settings)
+
+#==========================================Native Query Path==========================================
+# Query path qua clickhouse-connect: response ở dạng Native (binary, columnar), nén LZ4,
+# decode thẳng vào NumPy array thay vì parse text từng COUNT như execute_query.
+
+QUERY_TIMEOUT = 10
+CONSOLIDATED_RECHECK = 60  # giây giữa hai lần kiểm tra trạng thái migrate của bảng gộp
+
+_local = threading.local()
+_consolidated_available = None
+_consolidated_checked_at = 0.0
+native_router = ReplicaRouter(CLICKHOUSE_HTTP)
+
+
+def get_native_client(url: str = None):
+    """
+    clickhouse-connect client (mỗi thread một client cho mỗi endpoint, dùng chung HTTP pool của library)
+    """
+    url = url or native_router.ordered()[0]
+    clients = getattr(_local, "clients", None)
+    if clients is None:
+        clients = _local.clients = {}
+    client = clients.get(url)
+    if client is None:
+        parsed = urllib.parse.urlparse(url)
+        client = clickhouse_connect.get_client(
+            host=parsed.hostname,
+            port=parsed.port or 8123,
+            username=CLICKHOUSE_USER,
+            password=CLICKHOUSE_PASS,
+            database=DATABASE,
+            compress="lz4",
+            query_limit=0,
+        )
+        clients[url] = client
+    return client
+
+
+def execute_query_np(sql: str, parameters: dict = None) -> np.ndarray:
+    """
+    Thực thi SQL và trả về kết quả dạng NumPy array (nhiều cột, nhiều dòng)
+
+    Args:
+        sql: SQL query string
+        parameters: Server-side parameters ({name:Type} trong SQL)
+
+    Returns:
+        2D array shape (rows, columns)
+    """
+    settings = query_settings()
+    scope = current_move_scope.get()
+    timeout = QUERY_TIMEOUT
+    if scope is not None:
+        scope.ensure_active()
+        query_id = scope.begin_query()
+        timeout = scope.remaining(timeout)
+    else:
+        query_id = standalone_query_id()
+    # Luôn có query_id: bản hedge thua bị KILL theo id (sync request không tự hủy khi bị bỏ)
+    settings["query_id"] = query_id
+
+    def run(url: str) -> np.ndarray:
+        try:
+            return get_native_client(url).query_np(sql, parameters=parameters, settings=settings)
+        except OperationalError as e:
+            # Lỗi kết nối/HTTP của endpoint: để router thử replica khác
+            raise EndpointUnavailable(str(e)) from e
+
+    try:
+        return native_router.call(run, timeout, query_id)
+    except Exception as e:
+        cancelled = as_cancelled(e, scope)
+        if cancelled is not None:
+            raise cancelled from e
+        raise
+    finally:
+        if scope is not None:
+            scope.end_query(query_id)
+
+
+def consolidated_table_available() -> bool:
+    """
+    Bảng gộp ttt_5_outcomes đã migrate xong chưa: phải có dấu hoàn tất do --migrate ghi vào COMMENT
+    và total_rows vẫn bằng số rows lúc đánh dấu (đang migrate / migrate dở thì vẫn đọc các table cũ).
+    Kết quả được nhớ CONSOLIDATED_RECHECK giây
+    """
+    global _consolidated_available, _consolidated_checked_at
+    now = time.monotonic()
+    if _consolidated_available is not None and now - _consolidated_checked_at < CONSOLIDATED_RECHECK:
+        return _consolidated_available
+    try:
+        rows = get_native_client().query(
+            "SELECT comment, total_rows FROM system.tables WHERE database = currentDatabase() AND name = {table:String}",
+            parameters={"table": CONSOLIDATED_TABLE},
+        ).result_rows
+    except Exception as e:
+        print(f"❌ Database error: {e}")
+        return False
+    available = bool(rows) and rows[0][0] == f"{CONSOLIDATED_READY_COMMENT}{rows[0][1]}"
+    if available != bool(_consolidated_available):
+        print(f"✅ Using consolidated table {CONSOLIDATED_TABLE}" if available
+              else f"⚠️  {CONSOLIDATED_TABLE} not marked complete, reading ttt_5_* tables")
+    _consolidated_available, _consolidated_checked_at = available, now
+    return available
+
+
+def query_candidate_counts(canonicals: list[list[int]], strict: bool = False) -> np.ndarray:
+    """
+    Đếm số trận X thắng, O thắng, hòa cho từng candidate board bằng một query
+
+    Args:
+        canonicals: Danh sách canonical board (cùng số quân)
+        strict: True = raise khi lỗi DB thay vì trả về toàn 0 (job offline không được ghi số 0 sai);
+            QueryCancelled (nước đi bị hủy, timeout) luôn được raise
+
+    Returns:
+        Array shape (len(canonicals), 3) với cột [x_win_count, o_win_count, draw_count]
+    """
+    counts = np.zeros((len(canonicals), len(OUTCOMES)), dtype=np.int64)
+    if not canonicals:
+        return counts
+
+    try:
+        sql = build_candidate_counts_query(canonicals, consolidated=consolidated_table_available())
+        result = execute_query_np(sql)
+    except QueryCancelled:
+        raise
+    except Exception as e:
+        if strict:
+            raise
+        print(f"❌ Database error: {e}")
+        return counts
+
+    if result.size == 0:
+        return counts
+
+    result = result.astype(np.int64).reshape(-1, len(canonicals) + 1)
+    counts[:, result[:, 0]] = result[:, 1:].T
+    return counts
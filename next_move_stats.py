@@ -0,0 +1,262 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from query_builder import N, TRANSFORM_TARGETS, bitboard_mask, count_stones, live_row_counts
+from schema_generator import NEXT_MOVES_TABLE, DRAW_TABLE, LEVEL_TABLES, render_next_moves_table
+from native_query import get_native_client, execute_query_np, query_candidate_counts
+
+#==========================================Next-Move Statistics==========================================
+# Bảng ttt_5_next_moves: mỗi (canonical parent, player) lưu sẵn mảng (child cell, x, o, d) cho mọi ô trống.
+# AI lấy cả lưới 5x5 bằng một lookup theo primary key rồi map ô về bàn cờ thật qua phép đối xứng ngược,
+# thay vì một lượt query cho mỗi child. Parent không có trong bảng được ghi vào MISS_LOG để lần build sau thêm vào.
+# Build xong ghi total_rows của các table nguồn vào COMMENT của bảng; khi data nguồn đổi (ingest/xóa thêm)
+# bảng coi như cũ và AI quay lại query trực tiếp cho đến khi build lại.
+
+DEFAULT_MAX_STONES = 3
+MISS_LOG = os.path.join("data", "next_move_misses.txt")
+SOURCE_TABLES = [DRAW_TABLE] + LEVEL_TABLES
+BUILT_FROM_COMMENT = "built from rows "
+NEXT_MOVES_RECHECK = 60  # giây giữa hai lần đọc lại COMMENT của bảng
+
+_available = None
+_comment = None
+_comment_checked_at = 0.0
+_miss_lock = threading.Lock()
+_misses_logged = set()
+
+LOOKUP_SQL = (
+    "SELECT tupleElement(c, 1), tupleElement(c, 2), tupleElement(c, 3), tupleElement(c, 4) "
+    f"FROM (SELECT children FROM {NEXT_MOVES_TABLE} FINAL "
+    "WHERE parent_key = {parent_key:UInt64} AND player = {player:UInt8}) "
+    "ARRAY JOIN children AS c"
+)
+
+
+def canonical_with_transform(board: list) -> tuple[list, int]:
+    """
+    Canonical form (nhỏ nhất theo lexicographic, giống canonical_board) và index phép biến đổi tạo ra nó
+
+    Returns:
+        (canonical board, index trong TRANSFORM_TARGETS)
+    """
+    best = None
+    best_index = 0
+    for index, targets in enumerate(TRANSFORM_TARGETS):
+        oriented = [0] * (N * N)
+        for idx, new_idx in enumerate(targets):
+            oriented[new_idx] = board[idx]
+        if best is None or oriented < best:
+            best = oriented
+            best_index = index
+    return best, best_index
+
+
+def child_canonicals(parent: list, player: int) -> tuple[list[int], list[list[int]]]:
+    """
+    Các ô trống của parent và canonical board sau khi player đánh vào từng ô
+    """
+    cells = []
+    children = []
+    for idx, cell in enumerate(parent):
+        if cell != 0:
+            continue
+        child = list(parent)
+        child[idx] = player
+        cells.append(idx)
+        children.append(canonical_with_transform(child)[0])
+    return cells, children
+
+
+#==========================================Lookup==========================================
+def source_rows_comment(rows: dict) -> str:
+    """
+    COMMENT đánh dấu bảng được build từ data có đúng các total_rows này (thứ tự table cố định)
+    """
+    return BUILT_FROM_COMMENT + ",".join(f"{table}={rows.get(table, 0)}" for table in SOURCE_TABLES)
+
+
+def next_moves_table_available() -> bool:
+    """
+    Bảng ttt_5_next_moves đã build xong và vẫn khớp data nguồn: COMMENT phải bằng total_rows hiện tại
+    của các table nguồn (live_row_counts, không I/O). COMMENT được đọc lại mỗi NEXT_MOVES_RECHECK giây
+    """
+    global _available, _comment, _comment_checked_at
+    now = time.monotonic()
+    if _available is None or now - _comment_checked_at >= NEXT_MOVES_RECHECK:
+        try:
+            rows = get_native_client().query(
+                "SELECT comment FROM system.tables WHERE database = currentDatabase() AND name = {table:String}",
+                parameters={"table": NEXT_MOVES_TABLE},
+            ).result_rows
+        except Exception as e:
+            print(f"❌ Database error: {e}")
+            return False
+        _comment, _comment_checked_at = (rows[0][0] if rows else None), now
+    live = live_row_counts()
+    available = _comment is not None and bool(live) and _comment == source_rows_comment(live)
+    if available != bool(_available):
+        print(f"✅ Using next-move table {NEXT_MOVES_TABLE}" if available
+              else f"⚠️  {NEXT_MOVES_TABLE} missing or older than the data (rebuild with --build-next-moves), querying moves directly")
+    _available = available
+    return available
+
+
+def record_miss(parent_key: int, player: int):
+    """
+    Ghi parent chưa có trong bảng vào MISS_LOG (mỗi parent một lần mỗi process)
+    """
+    with _miss_lock:
+        if (parent_key, player) in _misses_logged:
+            return
+        _misses_logged.add((parent_key, player))
+        try:
+            os.makedirs(os.path.dirname(MISS_LOG) or ".", exist_ok=True)
+            with open(MISS_LOG, "a", encoding="utf-8") as f:
+                f.write(f"{parent_key}\t{player}\n")
+        except OSError:
+            pass
+
+
+def lookup_next_moves(board: list, player: int) -> dict:
+    """
+    Stats của tất cả nước đi tiếp theo từ board bằng một primary-key lookup
+
+    Args:
+        board: Board 5x5 dạng 1D (row-major, i11 -> i55)
+        player: Player sắp đánh (1 hoặc 2)
+
+    Returns:
+        {cell_index trên board: (x_win_count, o_win_count, draw_count)}, None nếu parent chưa có trong bảng
+    """
+    if not next_moves_table_available():
+        return None
+
+    canonical, transform = canonical_with_transform(board)
+    parent_key = bitboard_mask(canonical)
+    try:
+        rows = execute_query_np(LOOKUP_SQL, parameters={"parent_key": parent_key, "player": player})
+    except Exception as e:
+        print(f"❌ Database error: {e}")
+        return None
+
+    if rows.size == 0:
+        record_miss(parent_key, player)
+        return None
+
+    # Ô trong canonical -> ô trên board thật: đảo ngược phép biến đổi đã dùng để canonical hóa
+    targets = TRANSFORM_TARGETS[transform]
+    inverse = {new_idx: idx for idx, new_idx in enumerate(targets)}
+    return {
+        inverse[int(cell)]: (int(x), int(o), int(d))
+        for cell, x, o, d in rows.astype("int64").reshape(-1, 4).tolist()
+    }
+
+
+#==========================================Offline Build==========================================
+def board_from_key(key: int) -> list:
+    return [1 if key >> idx & 1 else 2 if key >> (idx + N * N) & 1 else 0 for idx in range(N * N)]
+
+
+def enumerate_parents(max_stones: int) -> list[tuple[list, int]]:
+    """
+    Tất cả canonical parent có tối đa max_stones quân xuất hiện khi chơi bình thường (X đi trước)
+
+    Returns:
+        [(canonical parent, player sắp đánh)]
+    """
+    parents = []
+    level = {tuple([0] * (N * N))}
+    for stones in range(max_stones + 1):
+        player = 1 if stones % 2 == 0 else 2
+        parents.extend((list(board), player) for board in sorted(level))
+        if stones == max_stones:
+            break
+        level = {tuple(child) for board in level for child in child_canonicals(list(board), player)[1]}
+    return parents
+
+
+def load_missed_parents(path: str = MISS_LOG) -> list[tuple[list, int]]:
+    if not os.path.exists(path):
+        return []
+    parents = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                key, player = (int(v) for v in line.split())
+            except ValueError:
+                continue
+            parents.append((board_from_key(key), player))
+    return parents
+
+
+def read_source_rows(client) -> dict:
+    rows = client.query(
+        "SELECT name, total_rows FROM system.tables WHERE database = currentDatabase() AND name IN {tables:Array(String)}",
+        parameters={"tables": SOURCE_TABLES},
+    ).result_rows
+    return {name: int(count or 0) for name, count in rows}
+
+
+def build_next_move_table(max_stones: int = DEFAULT_MAX_STONES, workers: int = 8, recreate: bool = False,
+                          batch_size: int = 500):
+    """
+    Tính (child cell, x, o, d) cho mọi parent rồi ghi vào ttt_5_next_moves
+
+    Args:
+        max_stones: Số quân tối đa của parent được enumerate sẵn
+        workers: Số query đếm chạy song song (mỗi parent một query cho tất cả child)
+        recreate: Xóa và build lại từ đầu
+        batch_size: Số parent mỗi lần INSERT
+    """
+    # Import ở đây: app.py/statistic_ai_100_x_100.py import module này lúc khởi động, web server không cần tqdm
+    from tqdm import tqdm
+
+    print("\n" + "=" * 70)
+    print(f"🧭 Building {NEXT_MOVES_TABLE} (parents up to {max_stones} stones + logged misses)")
+    print("=" * 70)
+
+    client = get_native_client()
+    if recreate:
+        client.command(f"DROP TABLE IF EXISTS {NEXT_MOVES_TABLE}")
+    client.command(render_next_moves_table())
+    # Bỏ dấu cũ trước khi ghi: build dở hoặc lỗi giữa chừng thì bảng không được dùng
+    client.command(f"ALTER TABLE {NEXT_MOVES_TABLE} MODIFY COMMENT ''")
+    source_rows = read_source_rows(client)
+
+    seen = set()
+    parents = []
+    for parent, player in enumerate_parents(max_stones) + load_missed_parents():
+        canonical = canonical_with_transform(parent)[0]
+        key = (bitboard_mask(canonical), player)
+        if key not in seen and count_stones(canonical) < N * N:
+            seen.add(key)
+            parents.append((canonical, player))
+    print(f"📋 {len(parents):,} (parent, player) pairs")
+
+    def compute(item):
+        parent, player = item
+        cells, children = child_canonicals(parent, player)
+        counts = query_candidate_counts(children, strict=True)
+        stats = [(cell, *map(int, row)) for cell, row in zip(cells, counts.tolist())]
+        return [bitboard_mask(parent), player, stats]
+
+    batch = []
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for row in tqdm(executor.map(compute, parents), total=len(parents), desc="Parents"):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                client.insert(NEXT_MOVES_TABLE, batch, column_names=["parent_key", "player", "children"])
+                written += len(batch)
+                batch = []
+    if batch:
+        client.insert(NEXT_MOVES_TABLE, batch, column_names=["parent_key", "player", "children"])
+        written += len(batch)
+
+    print(f"✅ Wrote {written:,} parents into {NEXT_MOVES_TABLE}")
+    if read_source_rows(client) != source_rows:
+        print(f"⚠️  Source tables changed during the build, {NEXT_MOVES_TABLE} left unmarked (rerun --build-next-moves)")
+        return
+    client.command(f"ALTER TABLE {NEXT_MOVES_TABLE} MODIFY COMMENT '{source_rows_comment(source_rows)}'")
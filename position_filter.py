@@ -0,0 +1,224 @@
+import os
+import json
+import struct
+import hashlib
+import itertools
+import math
+
+import numpy as np
+
+#==========================================Position Bloom Filter==========================================
+# Negative-result filter over partial positions.
+#
+# Every terminal row in ttt_5_* is a set of stones (cell, mark). A partial board P matches a
+# row R only if every stone of P is in R, so every sub-pattern of P is also a sub-pattern of R.
+# The filter stores every sub-pattern with at most `max_stones` stones of every stored row.
+# If any max_stones-subset of P (or P itself when it is small enough) is absent from the
+# filter, no row can match P and the 18 COUNT queries can be skipped.
+#
+# The filter only describes the data it was built from, and a stale filter would report "no data"
+# for positions that now have rows. The file therefore stores the row count of every source table
+# at build time; callers use the filter only while the live total_rows still match (is_current).
+
+N_CELLS = 25
+FILTER_MAGIC = b"TTTBLOOM"
+FILTER_VERSION = 2  # v2: row counts of the source tables after the header
+FILTER_TABLES = ["ttt_5_draw"] + [f"ttt_5_l{layer}" for layer in range(9, 26)]
+DEFAULT_FILTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "position_filter.bin")
+DEFAULT_MAX_STONES = 4
+DEFAULT_FP_RATE = 0.001
+
+
+def pattern_key(stones) -> int:
+    """
+    Encode a set of stones into a 50-bit int key
+
+    Args:
+        stones: Iterable of (cell_index, mark) with mark 1 (X) or 2 (O)
+
+    Returns:
+        x_mask | (o_mask << 25)
+    """
+    key = 0
+    for idx, mark in stones:
+        key |= 1 << (idx + N_CELLS * (mark - 1))
+    return key
+
+
+def board_stones(board: list) -> list:
+    """
+    Return the occupied cells of a 1D board as (cell_index, mark) pairs
+    """
+    return [(idx, cell) for idx, cell in enumerate(board) if cell != 0]
+
+
+class PositionBloomFilter:
+    """
+    Plain Bloom filter over int keys, using double hashing on a blake2b digest
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int, max_stones: int = DEFAULT_MAX_STONES):
+        self.num_bits = max(8, int(num_bits))
+        self.num_hashes = max(1, int(num_hashes))
+        self.max_stones = int(max_stones)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.row_counts = None  # {table: rows} lúc build, None = không biết (file v1)
+        self._current = None
+
+    @classmethod
+    def for_capacity(cls, capacity: int, fp_rate: float = DEFAULT_FP_RATE, max_stones: int = DEFAULT_MAX_STONES):
+        """
+        Size the filter for `capacity` keys at the requested false-positive rate
+        """
+        capacity = max(1, capacity)
+        num_bits = math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes, max_stones)
+
+    def _positions(self, key: int):
+        digest = hashlib.blake2b(key.to_bytes(8, "little"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: int):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: int) -> bool:
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def may_have_data(self, board: list) -> bool:
+        """
+        Kiểm tra board (1D, 25 ô) có thể có data trong DB không
+
+        Args:
+            board: Canonical board dùng để query
+
+        Returns:
+            False nếu chắc chắn không có row nào khớp, True nếu có thể có
+        """
+        stones = board_stones(board)
+        if not stones:
+            return True
+
+        if len(stones) <= self.max_stones:
+            return pattern_key(stones) in self
+
+        for subset in itertools.combinations(stones, self.max_stones):
+            if pattern_key(subset) not in self:
+                return False
+        return True
+
+    def is_current(self, live_rows: dict) -> bool:
+        """
+        Filter còn khớp data không: total_rows hiện tại của mọi source table phải bằng lúc build
+
+        Args:
+            live_rows: {table: total_rows} hiện tại ({} nếu không đọc được)
+
+        Returns:
+            False thì không được dùng filter (mọi position đều phải query)
+        """
+        current = self.row_counts is not None and all(
+            live_rows.get(table, 0) == self.row_counts.get(table, 0) for table in FILTER_TABLES
+        )
+        if current != self._current:
+            print("✅ Position filter matches the loaded data" if current
+                  else "⚠️  Position filter is older than the data (rebuild with ingest.py --build-filter), querying every position")
+            self._current = current
+        return current
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        counts = json.dumps(self.row_counts or {}, sort_keys=True).encode()
+        with open(path, "wb") as f:
+            f.write(FILTER_MAGIC)
+            f.write(struct.pack("<IQII", FILTER_VERSION, self.num_bits, self.num_hashes, self.max_stones))
+            f.write(struct.pack("<I", len(counts)))
+            f.write(counts)
+            f.write(self.bits)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "rb") as f:
+            if f.read(len(FILTER_MAGIC)) != FILTER_MAGIC:
+                raise ValueError(f"Not a position filter file: {path}")
+            version, num_bits, num_hashes, max_stones = struct.unpack("<IQII", f.read(struct.calcsize("<IQII")))
+            if version not in (1, FILTER_VERSION):
+                raise ValueError(f"Unsupported position filter version {version}")
+            filt = cls(num_bits, num_hashes, max_stones)
+            if version >= 2:
+                (length,) = struct.unpack("<I", f.read(4))
+                filt.row_counts = json.loads(f.read(length))
+            bits = f.read()
+            if len(bits) != len(filt.bits):
+                raise ValueError(f"Truncated position filter file: {path}")
+            filt.bits = bytearray(bits)
+        return filt
+
+
+def load_position_filter(path: str = DEFAULT_FILTER_PATH):
+    """
+    Load filter lúc khởi động, trả về None nếu chưa build (không skip query nào)
+    """
+    if not os.path.exists(path):
+        print(f"⚠️  Position filter not found at {path}, querying every position")
+        return None
+    try:
+        filt = PositionBloomFilter.load(path)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Failed to load position filter: {e}")
+        return None
+    print(f"✅ Position filter loaded ({len(filt.bits) / 1024 / 1024:.1f} MB, max_stones={filt.max_stones})")
+    return filt
+
+#==========================================Builder==========================================
+class PositionFilterBuilder:
+    """
+    Collect distinct sub-pattern keys from batches of terminal rows, then emit a sized filter.
+
+    The key universe is bounded (sum over k<=max_stones of C(25,k) * 2^k), so the set of
+    distinct keys stays small even when billions of rows are scanned.
+    """
+
+    def __init__(self, max_stones: int = DEFAULT_MAX_STONES):
+        self.max_stones = max_stones
+        self.keys = set()
+        self.rows_seen = 0
+        self._combos = [np.array(list(itertools.combinations(range(N_CELLS), k)), dtype=np.int64)
+                        for k in range(1, max_stones + 1)]
+
+    def add_rows(self, rows: np.ndarray):
+        """
+        Args:
+            rows: uint8 array shape (n, 25), 0 = empty, 1 = X, 2 = O
+        """
+        if len(rows) == 0:
+            return
+        rows = rows.astype(np.int64)
+        self.rows_seen += len(rows)
+
+        for combo in self._combos:
+            marks = rows[:, combo]                                         # (n, M, k)
+            occupied = marks != 0
+            valid = occupied.all(axis=2)                                   # (n, M)
+            bit_index = np.where(occupied, combo[None, :, :] + N_CELLS * (marks - 1), 0)
+            keys = np.left_shift(1, bit_index).sum(axis=2)                 # distinct bits -> OR == sum
+            self.keys.update(np.unique(keys[valid]).tolist())
+
+    def build(self, fp_rate: float = DEFAULT_FP_RATE, row_counts: dict = None) -> PositionBloomFilter:
+        """
+        Args:
+            fp_rate: False-positive rate mong muốn
+            row_counts: {table: rows} của các source table lúc scan (để biết khi nào filter cũ)
+        """
+        filt = PositionBloomFilter.for_capacity(len(self.keys), fp_rate, self.max_stones)
+        filt.row_counts = dict(row_counts or {})
+        for key in self.keys:
+            filt.add(key)
+        return filt
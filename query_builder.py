@@ -0,0 +1,499 @@
+import json
+import os
+import threading
+import time
+
+import requests
+
+from clickhouse_config import CLICKHOUSE_HTTP, CLICKHOUSE_USER, CLICKHOUSE_PASS, DATABASE
+from query_cancellation import current_move_scope
+from replica_router import EndpointUnavailable
+
+#==========================================SQL Builder==========================================
+# SQL dùng chung cho các query path (native, async, sync)
+
+CELL_COLUMNS = [f"i{r}{c}" for r in range(1, 6) for c in range(1, 6)]
+
+# Thứ tự ô hay bị ràng buộc nhất khi chơi: tâm, vòng trong, rồi vòng ngoài.
+# Primary key/projection dùng các ô đầu làm key vì partial board gần như luôn có quân ở đó
+# (index analysis của ClickHouse không phụ thuộc thứ tự predicate trong WHERE).
+# Predicate vẫn phát theo thứ tự cố định này để cùng một board luôn ra cùng một text SQL (query cache),
+# còn thứ tự đọc cột thật sự do PREWHERE quyết định (split_prewhere, theo selectivity).
+CENTER_FIRST_COLUMNS = (
+    ["i33"]
+    + ["i22", "i23", "i24", "i32", "i34", "i42", "i43", "i44"]
+    + ["i11", "i12", "i13", "i14", "i15", "i21", "i25", "i31",
+       "i35", "i41", "i45", "i51", "i52", "i53", "i54", "i55"]
+)
+CENTER_FIRST_KEY = CENTER_FIRST_COLUMNS[:9]
+CELL_PRIORITY = {col: rank for rank, col in enumerate(CENTER_FIRST_COLUMNS)}
+
+# Kiểu cell của database đang query: "enum8"/"legacy" so sánh với 'X'/'O',
+# "uint8" (schema_generator --compact --uint8) so sánh với 1/2
+CELL_ENCODING = "legacy"
+CELL_LITERALS = {
+    "legacy": {1: "'X'", 2: "'O'"},
+    "enum8": {1: "'X'", 2: "'O'"},
+    "uint8": {1: "1", 2: "2"},
+}
+
+# Server-side query cache (use_query_cache): cache key là text SQL, nên mọi module đều sinh SQL
+# qua builder này (predicate center-first, orientation sắp xếp cố định)
+# để cùng một câu hỏi từ bất kỳ process nào cũng ra đúng một text
+USE_QUERY_CACHE = True
+QUERY_CACHE_TTL = 300  # giây
+
+# Symmetry-complete matching: mỗi row lưu theo orientation canonical của chính nó, nên partial
+# board chỉ khớp các row cùng orientation. Bật MATCH_ALL_ORIENTATIONS để một query khớp cả 8
+# orientation của board (OR trong cùng một lần scan, mỗi row vẫn chỉ đếm một lần).
+MATCH_ALL_ORIENTATIONS = False
+# Cột bitboard (x_mask | o_mask << 25) nếu có, ví dụ canonical_key của compact layout:
+# mỗi orientation chỉ còn một phép bitAnd thay vì một nhóm so sánh từng ô
+BITBOARD_KEY_COLUMN = None
+
+N = 5
+# Cùng 8 phép biến đổi với get_symmetries: identity, rot90, rot180, rot270,
+# reflect_h, reflect_v, reflect_main, reflect_anti; (r, c) -> (r', c')
+TRANSFORMS = [
+    lambda r, c: (r, c),
+    lambda r, c: (c, N - 1 - r),
+    lambda r, c: (N - 1 - r, N - 1 - c),
+    lambda r, c: (N - 1 - c, r),
+    lambda r, c: (N - 1 - r, c),
+    lambda r, c: (r, N - 1 - c),
+    lambda r, c: (c, r),
+    lambda r, c: (N - 1 - c, N - 1 - r),
+]
+TRANSFORM_TARGETS = [
+    [t(idx // N, idx % N)[0] * N + t(idx // N, idx % N)[1] for idx in range(N * N)]
+    for t in TRANSFORMS
+]
+
+OUTCOMES = ('X', 'O', 'D')
+OUTCOME_LEVELS = {
+    'X': list(range(9, 26, 2)),   # 9, 11, ..., 25
+    'O': list(range(10, 25, 2)),  # 10, 12, ..., 24
+}
+DRAW_TABLE = "ttt_5_draw"
+
+# Bảng gộp (ingest.py --migrate): cột level, PARTITION BY level, draw nằm ở level 25
+CONSOLIDATED_TABLE = "ttt_5_outcomes"
+# --migrate chỉ đánh dấu bảng gộp (COMMENT của table) khi mọi table nguồn đã chuyển hết;
+# app chỉ đọc bảng gộp khi có dấu này và total_rows vẫn bằng số rows lúc đánh dấu
+CONSOLIDATED_READY_COMMENT = "migration complete, rows="
+CONSOLIDATED_OUTCOME_FILTER = "((win_actor = 'X' AND level % 2 = 1) OR (win_actor = 'O' AND level % 2 = 0) OR win_actor = 'D')"
+
+OUTCOME_INDEX_EXPR = "toUInt64(indexOf(['X', 'O', 'D'], toString(win_actor)) - 1)"
+
+# Table stats (ingest.py --collect-stats): số row, tỷ lệ row có quân X/O ở từng ô, min/max số quân X/O.
+# PREWHERE theo selectivity: tỷ lệ row có quân X/O ở từng ô của từng table.
+# Predicate hiếm nhất đưa vào PREWHERE để ClickHouse chỉ đọc các cột còn lại cho granule còn sống.
+# Tất cả cột cell cùng kích thước nên auto-PREWHERE của server không biết chọn ô nào.
+SELECTIVITY_STATS_PATH = os.path.join("data", "selectivity_stats.json")
+USE_PREWHERE = True
+PREWHERE_TARGET = 0.05         # dừng thêm predicate khi ước lượng tỷ lệ row còn lại <= 5%
+PREWHERE_MAX_PREDICATES = 3
+_selectivity_stats = None
+
+
+def load_selectivity_stats(path: str = SELECTIVITY_STATS_PATH) -> dict:
+    """
+    Đọc selectivity stats (một lần mỗi process)
+
+    Returns:
+        {table: {"rows": n, "cells": {col: {"X": fraction, "O": fraction}},
+                 "x_stones": [min, max], "o_stones": [min, max]}}, {} nếu chưa có file
+    """
+    global _selectivity_stats
+    if _selectivity_stats is None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                _selectivity_stats = json.load(f)
+            print(f"✅ Loaded selectivity stats for {len(_selectivity_stats)} tables")
+        except FileNotFoundError:
+            _selectivity_stats = {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Cannot read selectivity stats {path}: {e}")
+            _selectivity_stats = {}
+    return _selectivity_stats
+
+
+def predicate_selectivity(table: str, col: str, cell: int) -> float:
+    """
+    Tỷ lệ row của table thỏa col = quân (None nếu không có stats)
+    """
+    table_stats = load_selectivity_stats().get(table)
+    if not table_stats:
+        return None
+    return table_stats["cells"].get(col, {}).get('X' if cell == 1 else 'O')
+
+
+def split_prewhere(table: str, board: list) -> tuple[list[str], list[str]]:
+    """
+    Chia điều kiện của board thành (PREWHERE, WHERE) theo selectivity của table
+
+    Returns:
+        PREWHERE gồm các predicate hiếm nhất cho tới khi ước lượng <= PREWHERE_TARGET,
+        WHERE gồm phần còn lại theo thứ tự center-first. Không có stats thì PREWHERE rỗng.
+    """
+    stones = ordered_stones(board)
+    if not USE_PREWHERE or MATCH_ALL_ORIENTATIONS or not stones:
+        return [], [f"{col} = {mark_literal(cell)}" for col, cell in stones]
+
+    rated = []
+    for col, cell in stones:
+        selectivity = predicate_selectivity(table, col, cell)
+        if selectivity is None:
+            return [], [f"{c} = {mark_literal(v)}" for c, v in stones]
+        rated.append((selectivity, CELL_PRIORITY[col], col, cell))
+    rated.sort()
+
+    chosen = set()
+    estimate = 1.0
+    for selectivity, _, col, _ in rated[:PREWHERE_MAX_PREDICATES]:
+        chosen.add(col)
+        estimate *= selectivity
+        if estimate <= PREWHERE_TARGET:
+            break
+
+    prewhere = [f"{col} = {mark_literal(cell)}" for _, _, col, cell in rated if col in chosen]
+    where = [f"{col} = {mark_literal(cell)}" for col, cell in stones if col not in chosen]
+    return prewhere, where
+
+
+#==========================================Level Pruning==========================================
+# Summary của từng table (số row, min/max số quân mỗi bên, ô nào từng có X/O) cho biết chắc chắn
+# table không có row nào khớp board -> bỏ luôn scan. Số scan tiết kiệm được cộng vào MoveQueryScope.
+# Summary chỉ đúng với data lúc --collect-stats: table chỉ được prune khi total_rows hiện tại
+# (system.tables) vẫn bằng "rows" trong stats, ingest thêm data thì table lại được scan.
+LIVE_ROWS_RECHECK = 30  # giây giữa hai lần đọc total_rows
+_pruned_lock = threading.Lock()
+PRUNED_SCANS = 0
+# total_rows do một thread nền đọc lại: caller (kể cả coroutine trên event loop) chỉ đọc dict, không I/O
+_live_rows_lock = threading.Lock()
+_live_rows = {}
+_live_rows_router = None
+_live_rows_thread = None
+
+
+def watch_live_row_counts(router=None):
+    """
+    Đọc total_rows lần đầu (blocking, lúc khởi động) rồi để thread nền làm mới
+
+    Args:
+        router: ReplicaRouter của app (health/failover như các query đọc khác), None = CLICKHOUSE_HTTP
+    """
+    global _live_rows_router
+    _live_rows_router = router
+    refresh_live_row_counts()
+    live_row_counts()
+
+
+def refresh_live_row_counts() -> dict:
+    """
+    Đọc lại total_rows của các table ttt_5_* (blocking: chỉ gọi từ thread nền hoặc lúc khởi động)
+
+    Returns:
+        {table: rows}, {} nếu không đọc được (khi đó không table nào bị prune)
+    """
+    global _live_rows
+
+    def post(url: str):
+        response = requests.post(
+            url,
+            params={"database": DATABASE},
+            auth=(CLICKHOUSE_USER, CLICKHOUSE_PASS),
+            data="SELECT name, total_rows FROM system.tables "
+                 "WHERE database = currentDatabase() AND name LIKE 'ttt_5_%' AND total_rows IS NOT NULL "
+                 "FORMAT TabSeparated",
+            timeout=5
+        )
+        if response.status_code >= 500:
+            raise EndpointUnavailable(f"HTTP {response.status_code}: {response.text.strip()}")
+        return response
+
+    try:
+        response = _live_rows_router.call(post, 5) if _live_rows_router is not None else post(CLICKHOUSE_HTTP[0])
+        response.raise_for_status()
+        rows = {name: int(count) for name, count in
+                (line.split("\t") for line in response.text.splitlines() if line)}
+    except Exception as e:
+        print(f"⚠️ Cannot read table row counts, level pruning disabled: {e}")
+        rows = {}
+    with _live_rows_lock:
+        _live_rows = rows
+    return rows
+
+
+def _refresh_live_rows_loop():
+    while True:
+        refresh_live_row_counts()
+        time.sleep(LIVE_ROWS_RECHECK)
+
+
+def live_row_counts() -> dict:
+    """
+    total_rows theo lần đọc gần nhất của thread nền (làm mới mỗi LIVE_ROWS_RECHECK giây), không I/O
+
+    Returns:
+        {table: rows}, {} khi chưa đọc được (khi đó không table nào bị prune)
+    """
+    global _live_rows_thread
+    if _live_rows_thread is None:
+        with _live_rows_lock:
+            if _live_rows_thread is None:
+                _live_rows_thread = threading.Thread(target=_refresh_live_rows_loop, name="live-row-counts", daemon=True)
+                _live_rows_thread.start()
+    return _live_rows
+
+
+def table_may_match(table: str, board: list) -> bool:
+    """
+    False nếu summary của table chứng minh không row nào chứa đủ các quân của board
+
+    Args:
+        table: Tên table (ttt_5_l9 ... ttt_5_draw)
+        board: Board (1D, 25 elements)
+
+    Returns:
+        True nếu phải scan (chưa có stats, hoặc stats cũ hơn data hiện tại)
+    """
+    table_stats = load_selectivity_stats().get(table)
+    if not table_stats:
+        return True
+    if live_row_counts().get(table) != table_stats["rows"]:
+        return True
+    if table_stats["rows"] == 0:
+        return False
+
+    orientations = board_orientations(board) if MATCH_ALL_ORIENTATIONS else [board]
+    for oriented in orientations:
+        x_count = sum(1 for cell in oriented if cell == 1)
+        o_count = sum(1 for cell in oriented if cell == 2)
+        if "x_stones" in table_stats and x_count > table_stats["x_stones"][1]:
+            continue
+        if "o_stones" in table_stats and o_count > table_stats["o_stones"][1]:
+            continue
+        cells = table_stats["cells"]
+        if all(cells[col]['X' if cell == 1 else 'O'] > 0 for col, cell in ordered_stones(oriented)):
+            return True
+    return False
+
+
+def note_pruned_scans(count: int = 1):
+    """
+    Ghi nhận số scan đã bỏ qua (tổng của process và của nước đi hiện tại nếu có)
+    """
+    global PRUNED_SCANS
+    with _pruned_lock:
+        PRUNED_SCANS += count
+    scope = current_move_scope.get()
+    if scope is not None:
+        scope.add_pruned(count)
+
+
+def filter_clauses(table: str, board: list, extra: list[str]) -> str:
+    """
+    "[PREWHERE ...] WHERE ..." cho một table, extra là các điều kiện thêm (win_actor, level, ...)
+    """
+    if MATCH_ALL_ORIENTATIONS:
+        return "WHERE " + " AND ".join([where_clause(board)] + extra)
+    prewhere, where = split_prewhere(table, board)
+    where = where + extra
+    clause = "WHERE " + (" AND ".join(where) if where else "1")
+    return f"PREWHERE {' AND '.join(prewhere)} {clause}" if prewhere else clause
+
+
+def board_conditions(board: list) -> str:
+    """
+    Điều kiện khớp các quân của board (giống build_where_clause)
+    """
+    conditions = []
+    for col_name, cell in ordered_stones(board):
+        conditions.append(f"{col_name} = {mark_literal(cell)}")
+    return " AND ".join(conditions) if conditions else "1"
+
+
+def board_orientations(board: list) -> list[list[int]]:
+    """
+    Các orientation khác nhau của board (tối đa 8, bỏ trùng khi board tự đối xứng)
+    """
+    orientations = []
+    seen = set()
+    for targets in TRANSFORM_TARGETS:
+        oriented = [0] * (N * N)
+        for idx, new_idx in enumerate(targets):
+            oriented[new_idx] = board[idx]
+        key = tuple(oriented)
+        if key not in seen:
+            seen.add(key)
+            orientations.append(oriented)
+    return orientations
+
+
+def bitboard_mask(board: list) -> int:
+    mask = 0
+    for idx, cell in enumerate(board):
+        if cell != 0:
+            mask |= 1 << (idx + 25 * (cell - 1))
+    return mask
+
+
+def symmetric_conditions(board: list) -> str:
+    """
+    Điều kiện khớp bất kỳ orientation nào của board, trong một biểu thức OR
+    """
+    if count_stones(board) == 0:
+        return "1"
+    groups = []
+    for oriented in board_orientations(board):
+        if BITBOARD_KEY_COLUMN:
+            mask = bitboard_mask(oriented)
+            groups.append(f"bitAnd({BITBOARD_KEY_COLUMN}, {mask}) = {mask}")
+        else:
+            groups.append(f"({board_conditions(oriented)})")
+    # Thứ tự orientation phụ thuộc board đầu vào; sắp xếp để các board đối xứng nhau ra cùng text
+    return "(" + " OR ".join(sorted(groups)) + ")"
+
+
+def where_clause(board: list) -> str:
+    """
+    WHERE clause cho board theo mode hiện tại (một orientation hoặc cả 8)
+
+    Returns:
+        Biểu thức an toàn để nối thêm "AND ..." phía sau
+    """
+    if MATCH_ALL_ORIENTATIONS:
+        return symmetric_conditions(board)
+    return board_conditions(board)
+
+
+def mark_literal(cell: int) -> str:
+    """
+    Literal SQL của quân (1 = X, 2 = O) theo CELL_ENCODING, ví dụ 'X'
+    """
+    return CELL_LITERALS[CELL_ENCODING][cell]
+
+
+def query_settings() -> dict:
+    """
+    Settings gửi kèm mọi query đọc: bật query cache với TTL cấu hình
+    """
+    if not USE_QUERY_CACHE:
+        return {}
+    return {"use_query_cache": 1, "query_cache_ttl": QUERY_CACHE_TTL}
+
+
+def http_params() -> dict:
+    """
+    URL params cho HTTP interface: settings của query_settings()
+    """
+    return query_settings()
+
+
+def ordered_stones(board: list) -> list[tuple[str, int]]:
+    """
+    Các ô có quân dạng (column, cell), xếp theo CENTER_FIRST_COLUMNS
+    """
+    stones = [(CELL_COLUMNS[idx], cell) for idx, cell in enumerate(board) if cell != 0]
+    return sorted(stones, key=lambda stone: CELL_PRIORITY[stone[0]])
+
+
+def count_stones(board: list) -> int:
+    return sum(1 for cell in board if cell != 0)
+
+
+def build_candidate_counts_query(canonicals: list[list[int]], consolidated: bool = False) -> str:
+    """
+    Một query đếm X/O/D cho tất cả candidate board cùng lúc
+    Tất cả candidate có cùng số quân nên dùng chung tập level
+
+    Args:
+        canonicals: Danh sách canonical board (cùng số quân)
+        consolidated: True = đọc bảng gộp ttt_5_outcomes, chỉ scan các partition level >= số quân
+
+    Returns:
+        SQL trả về 1 dòng cho mỗi outcome: (outcome, count_candidate_0, count_candidate_1, ...)
+    """
+    move_count = count_stones(canonicals[0])
+    conditions = [f"({where_clause(board)})" for board in canonicals]
+    counts = ",\n    ".join(f"countIf({cond})" for cond in conditions)
+
+    if consolidated:
+        source = (
+            f"{CONSOLIDATED_TABLE}\n"
+            f"WHERE level >= {move_count} AND {CONSOLIDATED_OUTCOME_FILTER}\n"
+            f"  AND (" + " OR ".join(conditions) + ")"
+        )
+    else:
+        cells = ", ".join(CELL_COLUMNS)
+        sources = []
+        for actor in ('X', 'O'):
+            for level in OUTCOME_LEVELS[actor]:
+                if level < move_count:
+                    continue
+                sources.append(f"SELECT win_actor, {cells} FROM ttt_5_l{level} WHERE win_actor = '{actor}'")
+        sources.append(f"SELECT win_actor, {cells} FROM {DRAW_TABLE} WHERE win_actor = 'D'")
+        source = (
+            "(\n    " + "\n    UNION ALL\n    ".join(sources) + "\n)\n"
+            "WHERE " + " OR ".join(conditions)
+        )
+
+    return (
+        f"SELECT\n"
+        f"    {OUTCOME_INDEX_EXPR} AS outcome,\n"
+        f"    {counts}\n"
+        f"FROM {source}\n"
+        f"GROUP BY outcome"
+    )
+
+
+def build_level_count_query(table: str, actor: str, board: list) -> str:
+    """
+    COUNT một outcome của board trên một bảng level/draw (dạng chuẩn dùng chung mọi module)
+
+    Args:
+        actor: win_actor cần đếm, None = đếm mọi row của table
+    """
+    extra = [f"win_actor = '{actor}'"] if actor else []
+    return f"SELECT count() FROM {table} {filter_clauses(table, board, extra)}"
+
+
+def build_level_count_queries(board: list) -> dict:
+    """
+    Tất cả COUNT query của board trên các bảng level (chỉ level >= số quân) và bảng draw,
+    bỏ các table mà summary chứng minh không khớp
+
+    Returns:
+        {'X': [sql, ...], 'O': [sql, ...], 'D': [sql]}
+    """
+    move_count = count_stones(board)
+    queries = {actor: [] for actor in OUTCOMES}
+    if move_count == 0:
+        return queries
+    tables = [(actor, f"ttt_5_l{level}") for actor in ('X', 'O') for level in OUTCOME_LEVELS[actor] if level >= move_count]
+    tables.append(('D', DRAW_TABLE))
+    pruned = 0
+    for actor, table in tables:
+        if table_may_match(table, board):
+            queries[actor].append(build_level_count_query(table, actor, board))
+        else:
+            pruned += 1
+    if pruned:
+        note_pruned_scans(pruned)
+    return queries
+
+
+def build_outcome_counts_query(board: list) -> str:
+    """
+    Đếm X thắng, O thắng, hòa của một board trên bảng gộp bằng một câu lệnh
+
+    Returns:
+        SQL trả về 1 dòng: (x_win_count, o_win_count, draw_count)
+    """
+    extra = [f"level >= {count_stones(board)}", CONSOLIDATED_OUTCOME_FILTER]
+    return (
+        f"SELECT countIf(win_actor = 'X'), countIf(win_actor = 'O'), countIf(win_actor = 'D') "
+        f"FROM {CONSOLIDATED_TABLE} "
+        f"{filter_clauses(CONSOLIDATED_TABLE, board, extra)}"
+    )
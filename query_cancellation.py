@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import itertools
+import select
+import socket
+import threading
+import time
+import uuid
+
+import requests
+
+from clickhouse_config import CLICKHOUSE_USER, CLICKHOUSE_PASS
+
+#==========================================Move Query Scope==========================================
+# Mỗi nước đi của AI chạy trong một MoveQueryScope: mọi query được gắn query_id "<move_id>-<n>"
+# và được theo dõi cho đến khi trả kết quả. Khi nước đi đã quyết định xong, hết deadline hoặc
+# browser đóng request, các query còn chạy trên server bị KILL QUERY để không tốn CPU ClickHouse.
+
+# Query của một nước đi có thể chạy trên bất kỳ replica nào nên KILL gửi tới tất cả:
+# mỗi ReplicaRouter đăng ký endpoint của nó (register_endpoints) khi được tạo
+KILL_ENDPOINTS = []
+
+current_move_scope = contextvars.ContextVar("current_move_scope", default=None)
+
+
+class QueryCancelled(Exception):
+    """Query không có kết quả vì nước đi đã bị hủy/hết deadline hoặc query bị timeout (khác với COUNT = 0)"""
+    pass
+
+
+TIMEOUT_ERRORS = (TimeoutError, asyncio.TimeoutError, requests.Timeout)
+
+
+def as_cancelled(error: Exception, scope=None):
+    """
+    Lỗi của một query có nghĩa là "không có kết quả" không (nước đi đã bị hủy, hoặc timeout)
+
+    Returns:
+        QueryCancelled để raise thay cho error, None nếu error là lỗi thường
+    """
+    if scope is not None and not scope.is_active():
+        return QueryCancelled(f"move {scope.move_id[:8]} cancelled ({scope.cancel_reason})")
+    if isinstance(error, TIMEOUT_ERRORS):
+        return QueryCancelled(f"query timed out: {error!r}")
+    return None
+
+
+def register_endpoints(endpoints: list[str]):
+    """
+    Thêm endpoint vào danh sách nhận KILL QUERY
+    """
+    for url in endpoints:
+        if url not in KILL_ENDPOINTS:
+            KILL_ENDPOINTS.append(url)
+
+
+def kill_queries(query_ids: list[str], endpoints: list[str] = None) -> bool:
+    """
+    Hủy các query đang chạy trên server theo query_id
+
+    Args:
+        query_ids: Danh sách query_id cần hủy
+        endpoints: Server cần gửi KILL (mặc định tất cả KILL_ENDPOINTS)
+
+    Returns:
+        True nếu ít nhất một server nhận lệnh KILL
+    """
+    if not query_ids:
+        return True
+    id_list = ", ".join(f"'{query_id}'" for query_id in query_ids)
+    accepted = False
+    for url in endpoints or KILL_ENDPOINTS:
+        try:
+            response = requests.post(
+                url,
+                params={"user": CLICKHOUSE_USER, "password": CLICKHOUSE_PASS},
+                data=f"KILL QUERY WHERE query_id IN ({id_list}) ASYNC",
+                timeout=5
+            )
+            accepted = accepted or response.status_code == 200
+        except Exception as e:
+            print(f"❌ Failed to kill queries on {url}: {e}")
+    return accepted
+
+
+def standalone_query_id() -> str:
+    """
+    query_id cho query không thuộc nước đi nào: bản hedge thua trên replica khác vẫn KILL được theo id này
+    """
+    return f"q-{uuid.uuid4().hex}"
+
+
+class MoveQueryScope:
+    """
+    Theo dõi các query của một nước đi và hủy chúng khi không còn cần kết quả
+    """
+
+    def __init__(self, deadline: float = None):
+        """
+        Args:
+            deadline: Số giây tối đa cho nước đi (None = không giới hạn)
+        """
+        self.move_id = uuid.uuid4().hex
+        self.deadline_at = time.monotonic() + deadline if deadline else None
+        self.cancelled = False
+        self.cancel_reason = None
+        self.killed = 0
+        self.scans_pruned = 0
+        self._counter = itertools.count()
+        self._outstanding = set()
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self):
+        self._token = current_move_scope.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_move_scope.reset(self._token)
+        # Nước đi đã quyết định (hoặc lỗi): query nào còn chạy đều vô ích
+        self.cancel("move decided" if exc_type is None else "move failed")
+        if self.scans_pruned:
+            print(f"✂️  Skipped {self.scans_pruned} level-table scans (occupancy summary)")
+        return False
+
+    def is_active(self) -> bool:
+        if self.cancelled:
+            return False
+        if self.deadline_at is not None and time.monotonic() >= self.deadline_at:
+            self.cancel("deadline")
+            return False
+        return True
+
+    def ensure_active(self):
+        """Raise QueryCancelled nếu nước đi không còn cần query nữa"""
+        if not self.is_active():
+            raise QueryCancelled(f"move {self.move_id[:8]} cancelled ({self.cancel_reason})")
+
+    def remaining(self, default: float) -> float:
+        """Timeout cho query tiếp theo: không vượt quá deadline của nước đi"""
+        if self.deadline_at is None:
+            return default
+        return max(0.0, min(default, self.deadline_at - time.monotonic()))
+
+    def begin_query(self) -> str:
+        query_id = f"{self.move_id}-{next(self._counter)}"
+        with self._lock:
+            self._outstanding.add(query_id)
+        return query_id
+
+    def end_query(self, query_id: str):
+        with self._lock:
+            self._outstanding.discard(query_id)
+
+    def add_pruned(self, count: int):
+        with self._lock:
+            self.scans_pruned += count
+
+    def cancel(self, reason: str):
+        with self._lock:
+            if not self.cancelled:
+                self.cancelled = True
+                self.cancel_reason = reason
+            outstanding = list(self._outstanding)
+            self._outstanding.clear()
+        if outstanding and kill_queries(outstanding):
+            self.killed += len(outstanding)
+            print(f"🛑 Killed {len(outstanding)} outstanding queries ({reason})")
+
+
+#==========================================Client Disconnect==========================================
+def client_disconnected(environ: dict) -> bool:
+    """
+    Kiểm tra browser đã đóng connection của request chưa (Werkzeug dev server)
+
+    Args:
+        environ: WSGI environ của request
+
+    Returns:
+        True nếu socket đã bị đóng phía client
+    """
+    sock = environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
+
+def watch_client_disconnect(environ: dict, scope: MoveQueryScope, interval: float = 0.2) -> threading.Thread:
+    """
+    Thread nền: hủy scope ngay khi client ngắt kết nối
+    """
+    def watch():
+        while not scope.cancelled:
+            if client_disconnected(environ):
+                scope.cancel("client disconnected")
+                return
+            time.sleep(interval)
+
+    thread = threading.Thread(target=watch, name=f"disconnect-{scope.move_id[:8]}", daemon=True)
+    thread.start()
+    return thread
+
+
+async def run_in_scope(scope: MoveQueryScope, coro):
+    """
+    Chạy coroutine với scope làm current_move_scope (task con tạo bởi gather kế thừa scope)
+    """
+    current_move_scope.set(scope)
+    return await coro
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+
+#==========================================Singleflight==========================================
+# Concurrent callers asking for the same key share one in-flight call.
+# Nothing is cached: once the call finishes the key is forgotten and the next caller queries again.
+# The shared call runs in the leader's context (its MoveQueryScope). If it fails with one of `retry_on`
+# (the leader's move was cancelled), waiting callers do not take that failure: they call again themselves.
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Gộp các request giống nhau đang chạy đồng thời thành một query duy nhất
+    """
+
+    def __init__(self, retry_on: tuple = ()):
+        """
+        Args:
+            retry_on: Exception của leader mà follower không nhận, tự chạy lại (ví dụ QueryCancelled)
+        """
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.retry_on = retry_on
+        self.executed = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Chạy fn(*args, **kwargs) một lần cho mỗi key đang in-flight
+
+        Args:
+            key: Hashable key (ví dụ tuple(canonical_board))
+            fn: Hàm thực hiện query
+
+        Returns:
+            Kết quả của fn, dùng chung cho tất cả caller cùng key
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = _Call()
+                    self._calls[key] = call
+                    self.executed += 1
+                    break
+                self.coalesced += 1
+
+            call.done.wait()
+            if call.error is None:
+                return call.result
+            if not isinstance(call.error, self.retry_on):
+                raise call.error
+            with self._lock:
+                self.retried += 1
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "retried": self.retried,
+                "in_flight": len(self._calls),
+            }
+
+
+class AsyncSingleFlight:
+    """
+    Bản asyncio của SingleFlight: các coroutine cùng key await chung một Task
+    """
+
+    def __init__(self, retry_on: tuple = ()):
+        self._tasks = {}
+        self.retry_on = retry_on
+        self.executed = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        while True:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                # Task chạy trong context (scope) của caller đầu tiên
+                task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+                self._tasks[key] = task
+                task.add_done_callback(lambda t, k=key: self._tasks.pop(k, None) if self._tasks.get(k) is t else None)
+                self.executed += 1
+            else:
+                self.coalesced += 1
+            try:
+                # shield: một caller bị cancel không hủy query mà caller khác đang chờ
+                return await asyncio.shield(task)
+            except self.retry_on:
+                if leader:
+                    raise
+                self.retried += 1
+
+    def stats(self) -> dict:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "in_flight": len(self._tasks),
+        }
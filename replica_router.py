@@ -0,0 +1,284 @@
+import asyncio
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from query_cancellation import kill_queries, register_endpoints
+
+#==========================================Replica Routing==========================================
+# Một danh sách endpoint đọc tương đương (replica, hoặc các node của ttt_cluster đều có Distributed table).
+# Mỗi query đi tới endpoint khỏe và nhanh nhất; nếu chưa có kết quả sau hedge delay (p95 latency gần đây)
+# thì gửi bản sao tới endpoint kế tiếp và lấy kết quả về trước. Endpoint lỗi bị tạm loại (cooldown tăng dần).
+
+LATENCY_WINDOW = 256       # số mẫu latency gần nhất dùng để tính p95
+MIN_SAMPLES = 20           # chưa đủ mẫu thì dùng DEFAULT_HEDGE_DELAY
+DEFAULT_HEDGE_DELAY = 0.5  # giây
+MIN_HEDGE_DELAY = 0.02
+BASE_COOLDOWN = 1.0        # giây, nhân đôi mỗi lần lỗi liên tiếp
+MAX_COOLDOWN = 30.0
+EWMA_ALPHA = 0.2
+
+
+class EndpointUnavailable(Exception):
+    """Endpoint trả lỗi phía server (5xx) hoặc không kết nối được, nên thử replica khác"""
+    pass
+
+
+# Lỗi của endpoint (thử replica khác); lỗi còn lại (ví dụ SQL sai) replica nào cũng như nhau nên raise luôn
+RETRYABLE_ERRORS = (EndpointUnavailable, OSError, EOFError, TimeoutError, asyncio.TimeoutError)
+
+
+class _EndpointState:
+    def __init__(self, url: str):
+        self.url = url
+        self.ewma = None
+        self.failures = 0
+        self.down_until = 0.0
+
+
+class ReplicaRouter:
+    """
+    Chọn endpoint theo health + latency và gửi hedged request cho cả code sync lẫn asyncio
+    """
+
+    def __init__(self, endpoints: list[str], max_hedges: int = 1):
+        """
+        Args:
+            endpoints: Danh sách URL tương đương (http://host:port)
+            max_hedges: Số bản sao tối đa gửi thêm cho một query (ngoài failover khi lỗi)
+        """
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = list(endpoints)
+        self.max_hedges = max_hedges
+        self._states = {url: _EndpointState(url) for url in self.endpoints}
+        self._samples = collections.deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        register_endpoints(self.endpoints)
+
+    #---------------------------------------Health / Latency---------------------------------------
+    def ordered(self) -> list[str]:
+        """
+        Endpoint khỏe trước (latency EWMA tăng dần), endpoint đang cooldown xếp sau cùng
+        """
+        now = time.monotonic()
+        with self._lock:
+            states = list(self._states.values())
+        healthy = [s for s in states if s.down_until <= now]
+        down = [s for s in states if s.down_until > now]
+        healthy.sort(key=lambda s: s.ewma if s.ewma is not None else 0.0)
+        down.sort(key=lambda s: s.down_until)
+        return [s.url for s in healthy + down]
+
+    def hedge_delay(self) -> float:
+        """
+        Thời gian chờ trước khi gửi bản sao: p95 latency của các query gần đây
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return max(MIN_HEDGE_DELAY, samples[int(len(samples) * 0.95) - 1])
+
+    def record_success(self, url: str, latency: float):
+        with self._lock:
+            state = self._states[url]
+            state.ewma = latency if state.ewma is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * state.ewma
+            state.failures = 0
+            state.down_until = 0.0
+            self._samples.append(latency)
+
+    def record_slow(self, url: str, elapsed: float):
+        """Request bị bỏ vì replica khác trả trước: elapsed là cận dưới của latency thật"""
+        with self._lock:
+            state = self._states[url]
+            if state.ewma is None or elapsed > state.ewma:
+                state.ewma = EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * (state.ewma or elapsed)
+
+    def record_failure(self, url: str):
+        with self._lock:
+            state = self._states[url]
+            state.failures += 1
+            cooldown = min(MAX_COOLDOWN, BASE_COOLDOWN * 2 ** (state.failures - 1))
+            state.down_until = time.monotonic() + cooldown
+
+    #---------------------------------------Sync---------------------------------------
+    def call(self, fn, timeout: float, query_id: str = None):
+        """
+        Gọi fn(url) trên endpoint tốt nhất, hedge/failover sang endpoint khác khi cần
+
+        Args:
+            fn: Hàm thực hiện request trên một endpoint; raise EndpointUnavailable/ConnectionError khi lỗi
+            timeout: Thời gian tối đa cho cả query (giây)
+            query_id: query_id đã gắn vào request, dùng để KILL bản sao chậm hơn
+                (None thì bản sao thua chỉ bị bỏ, vẫn chạy tiếp trên replica)
+
+        Returns:
+            Kết quả của request về trước
+        """
+        endpoints = self.ordered()
+        if len(endpoints) == 1:
+            return self._call_one(fn, endpoints[0])
+
+        deadline = time.monotonic() + timeout
+        pending = {}
+        next_index = 0
+        hedges = 0
+        last_error = None
+
+        def launch():
+            nonlocal next_index
+            url = endpoints[next_index]
+            next_index += 1
+            pending[self._pool.submit(self._call_one, fn, url)] = (url, time.monotonic())
+
+        launch()
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            can_hedge = next_index < len(endpoints) and hedges < self.max_hedges
+            done, _ = wait(pending, timeout=min(self.hedge_delay(), remaining) if can_hedge else remaining,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                if can_hedge:
+                    hedges += 1
+                    with self._lock:
+                        self.hedged += 1
+                    launch()
+                continue
+
+            for future in done:
+                url, _ = pending.pop(future)
+                try:
+                    result = future.result()
+                except RETRYABLE_ERRORS as e:
+                    last_error = e
+                    continue
+                except Exception:
+                    self._abandon(pending, query_id)
+                    raise
+                if url != endpoints[0]:
+                    with self._lock:
+                        self.hedge_wins += 1
+                self._abandon(pending, query_id)
+                return result
+
+            # Lỗi trả về nhanh: chuyển ngay sang endpoint kế tiếp, không đợi hedge delay
+            if not pending and next_index < len(endpoints):
+                with self._lock:
+                    self.failovers += 1
+                launch()
+
+        self._abandon(pending, query_id)
+        raise last_error or TimeoutError(f"No endpoint answered within {timeout:.1f}s")
+
+    def _call_one(self, fn, url: str):
+        started = time.monotonic()
+        try:
+            result = fn(url)
+        except RETRYABLE_ERRORS:
+            self.record_failure(url)
+            raise
+        self.record_success(url, time.monotonic() - started)
+        return result
+
+    def _abandon(self, pending: dict, query_id: str):
+        now = time.monotonic()
+        for url, started in pending.values():
+            self.record_slow(url, now - started)
+            if query_id is not None:
+                self._pool.submit(kill_queries, [query_id], [url])
+        pending.clear()
+
+    #---------------------------------------Asyncio---------------------------------------
+    async def call_async(self, coro_fn, timeout: float):
+        """
+        Bản asyncio của call: coro_fn(url) trả về coroutine.
+        Bản sao thua bị cancel, connection của nó bị đóng nên ClickHouse tự hủy query.
+        """
+        endpoints = self.ordered()
+        if len(endpoints) == 1:
+            return await self._call_one_async(coro_fn, endpoints[0])
+
+        deadline = time.monotonic() + timeout
+        pending = {}
+        next_index = 0
+        hedges = 0
+        last_error = None
+
+        def launch():
+            nonlocal next_index
+            url = endpoints[next_index]
+            next_index += 1
+            task = asyncio.ensure_future(self._call_one_async(coro_fn, url))
+            pending[task] = (url, time.monotonic())
+
+        launch()
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                can_hedge = next_index < len(endpoints) and hedges < self.max_hedges
+                done, _ = await asyncio.wait(pending, timeout=min(self.hedge_delay(), remaining) if can_hedge else remaining,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if can_hedge:
+                        hedges += 1
+                        self.hedged += 1
+                        launch()
+                    continue
+
+                for task in done:
+                    url, _ = pending.pop(task)
+                    error = task.exception()
+                    if isinstance(error, RETRYABLE_ERRORS):
+                        last_error = error
+                        continue
+                    if error is not None:
+                        raise error
+                    if url != endpoints[0]:
+                        self.hedge_wins += 1
+                    return task.result()
+
+                if not pending and next_index < len(endpoints):
+                    self.failovers += 1
+                    launch()
+        finally:
+            now = time.monotonic()
+            for task, (url, started) in pending.items():
+                self.record_slow(url, now - started)
+                task.cancel()
+
+        raise last_error or asyncio.TimeoutError(f"No endpoint answered within {timeout:.1f}s")
+
+    async def _call_one_async(self, coro_fn, url: str):
+        started = time.monotonic()
+        try:
+            result = await coro_fn(url)
+        except RETRYABLE_ERRORS:
+            self.record_failure(url)
+            raise
+        self.record_success(url, time.monotonic() - started)
+        return result
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        hedge_delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "hedge_delay": hedge_delay,
+                "endpoints": {
+                    s.url: {"ewma": s.ewma, "failures": s.failures, "down": s.down_until > now}
+                    for s in self._states.values()
+                },
+            }
@@ -0,0 +1,34 @@
+CREATE TABLE tictactoe_compact.ttt_5_draw
+(
+    `canonical_key` UInt64 CODEC(T64, ZSTD(3)),
+    `win_actor` Enum8('X' = 1, 'O' = 2, 'D' = 3) CODEC(ZSTD(1)),
+    `i11` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i12` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i13` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i14` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i15` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i21` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i22` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i23` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i24` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i25` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i31` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i32` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i33` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i34` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i35` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i41` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i42` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i43` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i44` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i45` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i51` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i52` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i53` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i54` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1)),
+    `i55` Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1))
+)
+ENGINE = MergeTree
+PRIMARY KEY (i33, i22, i23, i24, i32, i34, i42, i43, i44)
+ORDER BY (i33, i22, i23, i24, i32, i34, i42, i43, i44, canonical_key)
+SETTINGS index_granularity = 8192
@@ -1 +1,34 @@
-CREATE TABLE tictactoe.ttt_5_draw\n(\n    `canonical_form` String,\n    `win_actor` FixedString(1),\n    `i11` FixedString(1),\n    `i12` FixedString(1),\n    `i13` FixedString(1),\n    `i14` FixedString(1),\n    `i15` FixedString(1),\n    `i21` FixedString(1),\n    `i22` FixedString(1),\n    `i23` FixedString(1),\n    `i24` FixedString(1),\n    `i25` FixedString(1),\n    `i31` FixedString(1),\n    `i32` FixedString(1),\n    `i33` FixedString(1),\n    `i34` FixedString(1),\n    `i35` FixedString(1),\n    `i41` FixedString(1),\n    `i42` FixedString(1),\n    `i43` FixedString(1),\n    `i44` FixedString(1),\n    `i45` FixedString(1),\n    `i51` FixedString(1),\n    `i52` FixedString(1),\n    `i53` FixedString(1),\n    `i54` FixedString(1),\n    `i55` FixedString(1)\n)\nENGINE = MergeTree\nPRIMARY KEY canonical_form\nORDER BY canonical_form\nSETTINGS index_granularity = 8192
+CREATE TABLE tictactoe.ttt_5_draw
+(
+    `canonical_form` String,
+    `win_actor` FixedString(1),
+    `i11` FixedString(1),
+    `i12` FixedString(1),
+    `i13` FixedString(1),
+    `i14` FixedString(1),
+    `i15` FixedString(1),
+    `i21` FixedString(1),
+    `i22` FixedString(1),
+    `i23` FixedString(1),
+    `i24` FixedString(1),
+    `i25` FixedString(1),
+    `i31` FixedString(1),
+    `i32` FixedString(1),
+    `i33` FixedString(1),
+    `i34` FixedString(1),
+    `i35` FixedString(1),
+    `i41` FixedString(1),
+    `i42` FixedString(1),
+    `i43` FixedString(1),
+    `i44` FixedString(1),
+    `i45` FixedString(1),
+    `i51` FixedString(1),
+    `i52` FixedString(1),
+    `i53` FixedString(1),
+    `i54` FixedString(1),
+    `i55` FixedString(1)
+)
+ENGINE = MergeTree
+PRIMARY KEY canonical_form
+ORDER BY canonical_form
+SETTINGS index_granularity = 8192
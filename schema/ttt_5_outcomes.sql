@@ -0,0 +1,52 @@
+CREATE TABLE tictactoe.ttt_5_outcomes
+(
+    `level` UInt8,
+    `canonical_form` String,
+    `win_actor` FixedString(1),
+    `i11` FixedString(1),
+    `i12` FixedString(1),
+    `i13` FixedString(1),
+    `i14` FixedString(1),
+    `i15` FixedString(1),
+    `i21` FixedString(1),
+    `i22` FixedString(1),
+    `i23` FixedString(1),
+    `i24` FixedString(1),
+    `i25` FixedString(1),
+    `i31` FixedString(1),
+    `i32` FixedString(1),
+    `i33` FixedString(1),
+    `i34` FixedString(1),
+    `i35` FixedString(1),
+    `i41` FixedString(1),
+    `i42` FixedString(1),
+    `i43` FixedString(1),
+    `i44` FixedString(1),
+    `i45` FixedString(1),
+    `i51` FixedString(1),
+    `i52` FixedString(1),
+    `i53` FixedString(1),
+    `i54` FixedString(1),
+    `i55` FixedString(1),
+    INDEX idx_i11 i11 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i12 i12 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i13 i13 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i14 i14 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i15 i15 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i21 i21 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i25 i25 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i31 i31 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i35 i35 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i41 i41 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i45 i45 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i51 i51 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i52 i52 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i53 i53 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i54 i54 TYPE set(3) GRANULARITY 1,
+    INDEX idx_i55 i55 TYPE set(3) GRANULARITY 1
+)
+ENGINE = MergeTree
+PARTITION BY level
+PRIMARY KEY (win_actor, i33, i22, i23, i24, i32, i34, i42, i43, i44)
+ORDER BY (win_actor, i33, i22, i23, i24, i32, i34, i42, i43, i44, canonical_form)
+SETTINGS index_granularity = 8192
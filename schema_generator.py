@@ -0,0 +1,205 @@
+import os
+import re
+import sys
+
+from query_builder import CELL_COLUMNS, CENTER_FIRST_COLUMNS, CENTER_FIRST_KEY
+
+#==========================================Schema Template==========================================
+# Một template cho tất cả ttt_5_* tables thay cho 18 file .sql copy tay.
+#
+# Layouts:
+#   legacy        canonical_form String + 26 FixedString(1), ORDER BY canonical_form (như cũ)
+#   compact       canonical_key UInt64 (bitboard đóng gói) + cell Enum8/UInt8 + codec cho từng cột
+#   consolidated  bảng gộp ttt_5_outcomes: legacy columns + level, PARTITION BY level, center-first key
+
+DATABASE = "tictactoe"
+COMPACT_DATABASE = "tictactoe_compact"
+SCHEMA_FOLDER = "schema"
+COMPACT_SCHEMA_FOLDER = os.path.join(SCHEMA_FOLDER, "compact")
+
+LEVEL_TABLES = [f"ttt_5_l{layer}" for layer in range(9, 26)]
+DRAW_TABLE = "ttt_5_draw"
+CONSOLIDATED_TABLE = "ttt_5_outcomes"
+NEXT_MOVES_TABLE = "ttt_5_next_moves"
+
+CELL_TYPES = {
+    # Enum8 vẫn so sánh được với literal 'X'/'O' nên query không phải đổi
+    "enum8": "Enum8('' = 0, 'X' = 1, 'O' = 2) CODEC(ZSTD(1))",
+    "uint8": "UInt8 CODEC(T64, ZSTD(1))",
+}
+# ReplacingMergeTree gộp các row cùng sorting key khi merge (mọi layout đều có canonical_form/canonical_key
+# trong key), nên row trùng từ lần load lặp lại sẽ biến mất; trước khi merge xong vẫn đếm trùng,
+# OPTIMIZE TABLE ... FINAL (ingest.py --check-duplicates --fix) ép gộp ngay
+ENGINES = {"mergetree": "MergeTree", "replacing": "ReplacingMergeTree"}
+WIN_ACTOR_TYPE = "Enum8('X' = 1, 'O' = 2, 'D' = 3) CODEC(ZSTD(1))"
+CANONICAL_KEY_TYPE = "UInt64 CODEC(T64, ZSTD(3))"
+
+
+def packed_key_expr(columns: list[str] = CELL_COLUMNS) -> str:
+    """
+    Biểu thức SQL đóng gói 25 ô thành UInt64: x_mask | (o_mask << 25)
+    (cùng cách encode với position_filter.pattern_key)
+    """
+    terms = []
+    for idx, col in enumerate(columns):
+        terms.append(f"multiIf({col} = 'X', bitShiftLeft(toUInt64(1), {idx}), "
+                     f"{col} = 'O', bitShiftLeft(toUInt64(1), {idx + 25}), toUInt64(0))")
+    return " + ".join(terms)
+
+
+def cell_value_expr(col: str, cell_type: str) -> str:
+    """
+    Biểu thức chuyển cell FixedString(1) cũ sang kiểu cell của compact layout
+    """
+    if cell_type == "uint8":
+        return f"multiIf({col} = 'X', 1, {col} = 'O', 2, 0)::UInt8"
+    return f"multiIf({col} = 'X', 'X', {col} = 'O', 'O', '')"
+
+
+def render_create_table(table_name: str, layout: str = "legacy", database: str = DATABASE,
+                        cell_type: str = "enum8", engine: str = "mergetree") -> str:
+    """
+    Sinh câu CREATE TABLE từ template
+
+    Args:
+        table_name: Tên table (ttt_5_l9 ... ttt_5_l25, ttt_5_draw, ttt_5_outcomes)
+        layout: legacy | compact | consolidated
+        database: Database chứa table
+        cell_type: enum8 | uint8 (chỉ dùng cho compact)
+        engine: mergetree | replacing
+
+    Returns:
+        SQL (newline thật, không còn literal \\n)
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+    columns = []
+    indexes = []
+    settings = "SETTINGS index_granularity = 8192"
+
+    if layout == "legacy":
+        columns.append("`canonical_form` String")
+        columns.append("`win_actor` FixedString(1)")
+        columns += [f"`{col}` FixedString(1)" for col in CELL_COLUMNS]
+        tail = "ENGINE = MergeTree\nPRIMARY KEY canonical_form\nORDER BY canonical_form"
+    elif layout == "consolidated":
+        columns.append("`level` UInt8")
+        columns.append("`canonical_form` String")
+        columns.append("`win_actor` FixedString(1)")
+        columns += [f"`{col}` FixedString(1)" for col in CELL_COLUMNS]
+        key = ", ".join(CENTER_FIRST_KEY)
+        indexes = [f"INDEX idx_{col} {col} TYPE set(3) GRANULARITY 1"
+                   for col in CENTER_FIRST_COLUMNS[len(CENTER_FIRST_KEY):]]
+        tail = (
+            "ENGINE = MergeTree\n"
+            "PARTITION BY level\n"
+            f"PRIMARY KEY (win_actor, {key})\n"
+            f"ORDER BY (win_actor, {key}, canonical_form)"
+        )
+    elif layout == "compact":
+        if cell_type not in CELL_TYPES:
+            raise ValueError(f"Unknown cell type: {cell_type}")
+        columns.append(f"`canonical_key` {CANONICAL_KEY_TYPE}")
+        columns.append(f"`win_actor` {WIN_ACTOR_TYPE}")
+        columns += [f"`{col}` {CELL_TYPES[cell_type]}" for col in CELL_COLUMNS]
+        key = ", ".join(CENTER_FIRST_KEY)
+        tail = (
+            "ENGINE = MergeTree\n"
+            f"PRIMARY KEY ({key})\n"
+            f"ORDER BY ({key}, canonical_key)"
+        )
+    else:
+        raise ValueError(f"Unknown layout: {layout}")
+
+    body = ",\n".join(f"    {line}" for line in columns + indexes)
+    return with_engine(f"CREATE TABLE {database}.{table_name}\n(\n{body}\n)\n{tail}\n{settings}\n", engine)
+
+
+def with_engine(create_sql: str, engine: str) -> str:
+    """
+    Đổi ENGINE = MergeTree của một câu CREATE TABLE (template hoặc file schema/*.sql) sang engine khác
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+    return re.sub(r"ENGINE\s*=\s*MergeTree\b(\(\))?", f"ENGINE = {ENGINES[engine]}", create_sql, count=1)
+
+
+def render_next_moves_table(database: str = DATABASE) -> str:
+    """
+    Bảng next-move stats: một row cho mỗi (canonical parent, player), key là bitboard của parent
+    ReplacingMergeTree để build lại một parent thì thay row cũ
+    """
+    return (
+        f"CREATE TABLE IF NOT EXISTS {database}.{NEXT_MOVES_TABLE}\n"
+        "(\n"
+        "    `parent_key` UInt64,\n"
+        "    `player` UInt8,\n"
+        "    `children` Array(Tuple(cell UInt8, x UInt64, o UInt64, d UInt64)) CODEC(ZSTD(3))\n"
+        ")\n"
+        "ENGINE = ReplacingMergeTree\n"
+        "ORDER BY (parent_key, player)\n"
+        "SETTINGS index_granularity = 1024\n"
+    )
+
+
+CLUSTER = "ttt_cluster"
+SHARDING_KEY = "CRC32(canonical_form)"  # trùng với zlib.crc32 phía client khi ingest trực tiếp vào shard
+
+
+def render_distributed_table(table_name: str, database: str = DATABASE, cluster: str = CLUSTER,
+                             sharding_key: str = SHARDING_KEY) -> str:
+    """
+    Distributed table cùng tên với table cũ, đọc/ghi {table_name}_local trên mọi shard
+    Query layer không phải đổi gì: SELECT trên table này tự fan-out ra tất cả shard
+    """
+    return (
+        f"CREATE TABLE {database}.{table_name} AS {database}.{table_name}_local\n"
+        f"ENGINE = Distributed({cluster}, {database}, {table_name}_local, {sharding_key})\n"
+    )
+
+
+def write_schema_files(layout: str = "legacy", cell_type: str = "enum8", engine: str = "mergetree") -> list[str]:
+    """
+    Ghi file .sql cho tất cả tables của layout
+
+    Returns:
+        Danh sách file đã ghi
+    """
+    if layout == "compact":
+        folder, database = COMPACT_SCHEMA_FOLDER, COMPACT_DATABASE
+        tables = [DRAW_TABLE] + LEVEL_TABLES
+    elif layout == "consolidated":
+        folder, database = SCHEMA_FOLDER, DATABASE
+        tables = [CONSOLIDATED_TABLE]
+    else:
+        folder, database = SCHEMA_FOLDER, DATABASE
+        tables = [DRAW_TABLE] + LEVEL_TABLES
+
+    os.makedirs(folder, exist_ok=True)
+    written = []
+    for table_name in tables:
+        path = os.path.join(folder, f"{table_name}.sql")
+        with open(path, "w", newline="\n") as f:
+            f.write(render_create_table(table_name, layout, database, cell_type, engine))
+        written.append(path)
+    return written
+
+
+#============================================Main============================================
+if __name__ == "__main__":
+    layout = "legacy"
+    for name in ("compact", "consolidated"):
+        if f"--{name}" in sys.argv:
+            layout = name
+    cell_type = "uint8" if "--uint8" in sys.argv else "enum8"
+    engine = "replacing" if "--replacing" in sys.argv else "mergetree"
+
+    for path in write_schema_files(layout, cell_type, engine):
+        print(f"✅ Wrote {path}")
+
+    print("\n💡 Usage:")
+    print("   python schema_generator.py                  # schema/ttt_5_*.sql (legacy layout)")
+    print("   python schema_generator.py --consolidated   # schema/ttt_5_outcomes.sql")
+    print("   python schema_generator.py --compact        # schema/compact/*.sql (Enum8 cells)")
+    print("   python schema_generator.py --compact --uint8  # schema/compact/*.sql (UInt8 cells)")
+    print("   python schema_generator.py --replacing      # ReplacingMergeTree (thêm vào bất kỳ layout nào)")
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import time
+
+import requests
+
+#==========================================Dataset Snapshot==========================================
+# Chụp lại các table ttt_5_* đã load xong để dựng môi trường mới mà không phải đi lại đường CSV -> ClickHouse.
+# Mỗi table là một file Native do chính server nén (enable_http_compression + Accept-Encoding), client chỉ
+# chép bytes ra disk; restore gửi nguyên file với Content-Encoding và INSERT ... FORMAT Native, server không
+# phải parse text. Thư mục snapshot:
+#   manifest.json               nguồn, version server, từng table: engine, rows, file, kích thước, checksum
+#   schema/<table>.sql          SHOW CREATE TABLE lúc export
+#   data/<table>.native.<ext>   dữ liệu Native đã nén
+#   ingest_manifest.json        bản sao data/ingest_manifest.json (file CSV nào đã load vào table nào)
+
+SNAPSHOT_DIR = os.path.join("data", "snapshots")
+MANIFEST_FILE = "manifest.json"
+INGEST_MANIFEST_FILE = "ingest_manifest.json"
+CODEC_SUFFIXES = {"zstd": ".zst", "lz4": ".lz4", "gzip": ".gz"}
+DEFAULT_CODEC = "zstd"
+TABLE_PATTERN = "ttt_5_%"
+PIECE_BYTES = 1024 * 1024
+REQUEST_TIMEOUT = 3600
+
+
+def run_sql(url: str, sql: str, auth=None, params: dict = None) -> str:
+    """
+    Chạy một câu lệnh qua HTTP, trả về response text; lỗi thì raise
+    """
+    response = requests.post(url, params=params, data=sql.encode(), auth=auth, timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise Exception(f"HTTP {response.status_code} - {response.text.strip()[:300]}")
+    return response.text
+
+
+def list_tables(url: str, database: str, auth=None, pattern: str = TABLE_PATTERN) -> list[dict]:
+    """
+    Các table có data (engine họ MergeTree) khớp pattern, lớn trước
+
+    Returns:
+        [{"table", "engine", "rows", "bytes"}]
+    """
+    text = run_sql(
+        url,
+        "SELECT name, engine, ifNull(total_rows, 0), ifNull(total_bytes, 0) FROM system.tables "
+        "WHERE database = {db:String} AND name LIKE {pattern:String} AND engine LIKE '%MergeTree' "
+        "ORDER BY total_bytes DESC FORMAT TabSeparated",
+        auth,
+        {"param_db": database, "param_pattern": pattern},
+    )
+    tables = []
+    for line in text.splitlines():
+        name, engine, rows, size = line.split("\t")
+        tables.append({"table": name, "engine": engine, "rows": int(rows), "bytes": int(size)})
+    return tables
+
+
+def data_file(table: str, codec: str) -> str:
+    # Đường dẫn trong manifest luôn dùng "/" để snapshot chép được giữa Windows và Linux
+    return f"data/{table}.native{CODEC_SUFFIXES[codec]}"
+
+
+def export_table(url: str, database: str, table: str, snapshot_dir: str, auth=None, codec: str = DEFAULT_CODEC,
+                 on_progress=None) -> dict:
+    """
+    Ghi schema và data Native đã nén của một table vào snapshot_dir
+
+    Args:
+        url: ClickHouse HTTP endpoint
+        database, table: Table nguồn
+        snapshot_dir: Thư mục snapshot
+        auth: (user, password) hoặc None
+        codec: Nén HTTP của server (zstd | lz4 | gzip), bytes được ghi nguyên như server gửi
+        on_progress: Callback(bytes) sau mỗi miếng đã ghi
+
+    Returns:
+        Entry của table trong manifest
+    """
+    full_name = f"{database}.{table}"
+    create_sql = run_sql(url, f"SHOW CREATE TABLE {full_name} FORMAT TSVRaw", auth).strip()
+    schema_path = f"schema/{table}.sql"
+    os.makedirs(os.path.join(snapshot_dir, "schema"), exist_ok=True)
+    with open(os.path.join(snapshot_dir, schema_path), "w", encoding="utf-8", newline="\n") as f:
+        f.write(create_sql + "\n")
+
+    rows = int(run_sql(url, f"SELECT count() FROM {full_name}", auth).strip())
+    path = data_file(table, codec)
+    target = os.path.join(snapshot_dir, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    started = time.monotonic()
+    digest = hashlib.blake2b(digest_size=16)
+    written = 0
+    with requests.post(
+        url,
+        # wait_end_of_query: server buffer kết quả (tràn ra disk) tới khi query xong mới gửi status, nên lỗi
+        # giữa chừng thành HTTP 500 thay vì một response 200 bị cụt mà vẫn ghi manifest
+        params={"query": f"SELECT * FROM {full_name} FORMAT Native", "enable_http_compression": 1, "wait_end_of_query": 1},
+        headers={"Accept-Encoding": codec},
+        auth=auth,
+        stream=True,
+        timeout=REQUEST_TIMEOUT,
+    ) as response:
+        if response.status_code != 200 or "X-ClickHouse-Exception-Code" in response.headers:
+            raise Exception(f"HTTP {response.status_code} - {response.text.strip()[:300]}")
+        if response.headers.get("Content-Encoding") != codec:
+            raise Exception(f"server did not {codec}-compress the response (Content-Encoding: "
+                            f"{response.headers.get('Content-Encoding')})")
+        with open(f"{target}.tmp", "wb") as f:
+            # decode_content=False: giữ nguyên bytes đã nén
+            for piece in response.raw.stream(PIECE_BYTES, decode_content=False):
+                f.write(piece)
+                digest.update(piece)
+                written += len(piece)
+                if on_progress is not None:
+                    on_progress(len(piece))
+    os.replace(f"{target}.tmp", target)
+
+    return {
+        "table": table,
+        "rows": rows,
+        "schema": schema_path,
+        "file": path,
+        "codec": codec,
+        "file_bytes": written,
+        "blake2b": digest.hexdigest(),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def write_manifest(snapshot_dir: str, manifest: dict):
+    tmp = os.path.join(snapshot_dir, f"{MANIFEST_FILE}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(snapshot_dir, MANIFEST_FILE))
+
+
+def load_manifest(snapshot_dir: str) -> dict:
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found (export incomplete or not a snapshot)")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def retarget_create(create_sql: str, source_database: str, database: str, table: str) -> str:
+    """
+    Câu CREATE TABLE của snapshot, đổi database nguồn sang database đích
+    """
+    for quoted in (f"{source_database}.{table}", f"`{source_database}`.`{table}`", f"{source_database}.`{table}`"):
+        if quoted in create_sql:
+            return create_sql.replace(quoted, f"{database}.{table}", 1)
+    return create_sql
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while piece := f.read(PIECE_BYTES):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+def _file_pieces(path: str, digest, on_progress):
+    with open(path, "rb") as f:
+        while piece := f.read(PIECE_BYTES):
+            digest.update(piece)
+            yield piece
+            if on_progress is not None:
+                on_progress(len(piece))
+
+
+def restore_table(url: str, database: str, snapshot_dir: str, entry: dict, auth=None, on_progress=None) -> int:
+    """
+    INSERT file Native của một table vào database.table (table phải đã được tạo và đang trống)
+
+    Args:
+        url: ClickHouse HTTP endpoint
+        database: Database đích
+        snapshot_dir: Thư mục snapshot
+        entry: Entry của table trong manifest
+        auth: (user, password) hoặc None
+        on_progress: Callback(bytes) sau mỗi miếng đã gửi
+
+    Returns:
+        Số rows trong table sau khi restore (bằng entry["rows"], nếu không thì raise)
+    """
+    full_name = f"{database}.{entry['table']}"
+    path = os.path.join(snapshot_dir, entry["file"])
+    # Kiểm tra trước khi gửi: INSERT đã commit thì file hỏng đã nằm trong table
+    if file_digest(path) != entry["blake2b"]:
+        raise Exception(f"{entry['file']} does not match its checksum; {full_name} left untouched")
+    digest = hashlib.blake2b(digest_size=16)
+    response = requests.post(
+        url,
+        params={"query": f"INSERT INTO {full_name} FORMAT Native", "async_insert": 0},
+        data=_file_pieces(path, digest, on_progress),
+        headers={"Content-Encoding": entry["codec"]},
+        auth=auth,
+        timeout=REQUEST_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise Exception(f"HTTP {response.status_code} - {response.text.strip()[:300]}")
+    if digest.hexdigest() != entry["blake2b"]:
+        # File bị sửa trong lúc đang gửi
+        run_sql(url, f"TRUNCATE TABLE {full_name}", auth)
+        raise Exception(f"{entry['file']} changed during restore; {full_name} truncated")
+    rows = int(run_sql(url, f"SELECT count() FROM {full_name}", auth).strip())
+    if rows != entry["rows"]:
+        raise Exception(f"{full_name} has {rows:,} rows after restore, snapshot recorded {entry['rows']:,}")
+    return rows
@@ -4,6 +4,10 @@ import copy
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import query_builder
+from query_builder import (where_clause, build_level_count_query, http_params, DRAW_TABLE,
+                           table_may_match, note_pruned_scans)
+
 #==========================================Database Configuration==========================================
 CLICKHOUSE_HTTP = "http://localhost:8123"
 CLICKHOUSE_USER = "default"
@@ -36,7 +40,8 @@ def execute_query(sql: str) -> int:
             params={
                 "user": CLICKHOUSE_USER,
                 "password": CLICKHOUSE_PASS,
-                "database": DATABASE
+                "database": DATABASE,
+                **http_params()
             },
             data=sql,
             timeout=10
@@ -105,18 +110,8 @@ def build_where_clause(board: list) -> str:
     Returns:
         WHERE clause string
     """
-    n = 5
-    conditions = []
-    
-    for idx, cell in enumerate(board):
-        if cell != 0:
-            row = (idx // n) + 1  # +1 vì index bắt đầu từ 1
-            col = (idx % n) + 1
-            col_name = f"i{row}{col}"
-            player_mark = 'X' if cell == 1 else 'O'
-            conditions.append(f"{col_name} = '{player_mark}'")
-    
-    return " AND ".join(conditions) if conditions else "1=1"
+    # Cùng SQL builder với app.py/statistic_ai_100_x_100.py để text query giống hệt nhau (query cache)
+    return where_clause(board)
 
 
 def query_odd_table(board: list) -> int:
@@ -134,8 +129,6 @@ def query_odd_table(board: list) -> int:
     if move_count == 0:
         return 0
     
-    where_clause = build_where_clause(board)
-    
     # Đếm trực tiếp từng bảng và cộng lại
     total_count = 0
     for level in range(9, 26, 2):  # 9, 11, 13, ..., 25
@@ -143,7 +136,11 @@ def query_odd_table(board: list) -> int:
             continue
         
         table_name = f"ttt_5_l{level}"
-        sql = f"SELECT COUNT(win_actor) FROM {table_name} WHERE {where_clause}"
+        # Đếm mọi row của table (script này không lọc win_actor)
+        if not table_may_match(table_name, board):
+            note_pruned_scans()
+            continue
+        sql = build_level_count_query(table_name, None, board)
         
         count = execute_query(sql)
         total_count += count
@@ -166,8 +163,6 @@ def query_even_table(board: list) -> int:
     if move_count == 0:
         return 0
     
-    where_clause = build_where_clause(board)
-    
     # Đếm trực tiếp từng bảng và cộng lại
     total_count = 0
     for level in range(10, 25, 2):  # 10, 12, 14, ..., 24
@@ -175,7 +170,11 @@ def query_even_table(board: list) -> int:
             continue
         
         table_name = f"ttt_5_l{level}"
-        sql = f"SELECT COUNT(win_actor) FROM {table_name} WHERE {where_clause}"
+        # Đếm mọi row của table (script này không lọc win_actor)
+        if not table_may_match(table_name, board):
+            note_pruned_scans()
+            continue
+        sql = build_level_count_query(table_name, None, board)
         
         count = execute_query(sql)
         total_count += count
@@ -198,10 +197,11 @@ def query_draw_table(board: list) -> int:
     if move_count == 0:
         return 0
     
-    where_clause = build_where_clause(board)
-    
     # Query table ttt_5_draw
-    sql = f"SELECT COUNT(win_actor) FROM ttt_5_draw WHERE {where_clause}"
+    if not table_may_match(DRAW_TABLE, board):
+        note_pruned_scans()
+        return 0
+    sql = build_level_count_query(DRAW_TABLE, None, board)
     
     return execute_query(sql)
 
@@ -323,6 +323,7 @@ def best_step(currBoard: list, player: int):
         Index của nước đi tốt nhất, hoặc -1 nếu không tìm thấy
     """
     start_time = time.time()
+    pruned_before = query_builder.PRUNED_SCANS
 
     best_move = -1
     win_rate = 0
@@ -405,6 +406,7 @@ def best_step(currBoard: list, player: int):
     
     print(f"⏱️  Thời gian suy nghĩ: {elapsed_time:.3f}s")
     print(f"📊 Đã kiểm tra {moves_checked} nước đi, {moves_with_data} có data")
+    print(f"✂️  Bỏ qua {query_builder.PRUNED_SCANS - pruned_before} lần scan level table (occupancy summary)")
     
     return best_move
 
@@ -4,12 +4,18 @@ import copy
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-#==========================================Database Configuration==========================================
-CLICKHOUSE_HTTP = "http://localhost:8123"
-CLICKHOUSE_USER = "default"
-CLICKHOUSE_PASS = "admin"
-DATABASE = "tictactoe"
+from clickhouse_config import CLICKHOUSE_HTTP, CLICKHOUSE_USER, CLICKHOUSE_PASS, DATABASE
+from position_filter import load_position_filter
+from query_cancellation import current_move_scope, QueryCancelled, as_cancelled, standalone_query_id
+from replica_router import ReplicaRouter, EndpointUnavailable
+from query_coalescer import SingleFlight
+import query_builder
+from query_builder import (where_clause, board_orientations, build_level_count_query, http_params, DRAW_TABLE,
+                           table_may_match, note_pruned_scans, live_row_counts, watch_live_row_counts)
+from native_query import query_candidate_counts, consolidated_table_available
+from next_move_stats import lookup_next_moves
 
+#==========================================Database Configuration==========================================
 # Connection pooling
 session = requests.Session()
 adapter = requests.adapters.HTTPAdapter(
@@ -19,6 +25,32 @@ adapter = requests.adapters.HTTPAdapter(
 )
 session.mount('http://', adapter)
 
+# Chọn replica theo health/latency, hedge sang replica thứ hai khi quá p95
+read_router = ReplicaRouter(CLICKHOUSE_HTTP)
+# total_rows cho level pruning và position filter: đọc qua read_router, thread nền làm mới
+watch_live_row_counts(read_router)
+
+# Negative-result filter: positions chắc chắn không có data sẽ không query DB
+POSITION_FILTER = load_position_filter()
+
+
+def position_may_have_data(canonical: list) -> bool:
+    """
+    Kiểm tra nhanh (không round trip DB) canonical board có thể có data không
+    
+    Args:
+        canonical: Canonical board (1D, 25 elements)
+        
+    Returns:
+        False nếu filter loại trừ được board, True nếu cần query
+    """
+    # Filter build từ data cũ hơn (load/migrate sau đó) có thể báo nhầm "không có data": không dùng
+    if POSITION_FILTER is None or not POSITION_FILTER.is_current(live_row_counts()):
+        return True
+    if query_builder.MATCH_ALL_ORIENTATIONS:
+        return any(POSITION_FILTER.may_have_data(oriented) for oriented in board_orientations(canonical))
+    return POSITION_FILTER.may_have_data(canonical)
+
 
 def execute_query(sql: str) -> int:
     """
@@ -30,17 +62,37 @@ def execute_query(sql: str) -> int:
     Returns:
         Số lượng rows (int)
     """
-    try:
+    # Query thuộc nước đi đã bị hủy/hết deadline thì không gửi nữa
+    scope = current_move_scope.get()
+    timeout = 10
+    params = {
+        "user": CLICKHOUSE_USER,
+        "password": CLICKHOUSE_PASS,
+        "database": DATABASE,
+        **http_params()
+    }
+    if scope is not None:
+        scope.ensure_active()
+        query_id = scope.begin_query()
+        timeout = scope.remaining(timeout)
+    else:
+        query_id = standalone_query_id()
+    # Luôn có query_id: bản hedge thua bị KILL theo id (sync request không tự hủy khi bị bỏ)
+    params["query_id"] = query_id
+    
+    def post(url: str):
         response = session.post(
-            CLICKHOUSE_HTTP,
-            params={
-                "user": CLICKHOUSE_USER,
-                "password": CLICKHOUSE_PASS,
-                "database": DATABASE
-            },
+            url,
+            params=params,
             data=sql,
-            timeout=10
+            timeout=timeout
         )
+        if response.status_code >= 500:
+            raise EndpointUnavailable(f"HTTP {response.status_code}: {response.text.strip()}")
+        return response
+    
+    try:
+        response = read_router.call(post, timeout, query_id)
         
         if response.status_code != 200:
             print(f"❌ Query error {response.status_code}: {response.text}")
@@ -53,8 +105,15 @@ def execute_query(sql: str) -> int:
         return int(result)
         
     except Exception as e:
+        # Bị hủy/timeout thì không có COUNT: raise thay vì trả 0, request khác có thể đang chờ chung kết quả
+        cancelled = as_cancelled(e, scope)
+        if cancelled is not None:
+            raise cancelled from e
         print(f"❌ Database error: {e}")
         return 0
+    finally:
+        if scope is not None:
+            scope.end_query(query_id)
 
 
 def get_odd_table_names(move_count: int) -> str:
@@ -105,18 +164,9 @@ def build_where_clause(board: list) -> str:
     Returns:
         WHERE clause string
     """
-    n = 5
-    conditions = []
-    
-    for idx, cell in enumerate(board):
-        if cell != 0:
-            row = (idx // n) + 1  # +1 vì index bắt đầu từ 1
-            col = (idx % n) + 1
-            col_name = f"i{row}{col}"
-            player_mark = 'X' if cell == 1 else 'O'
-            conditions.append(f"{col_name} = '{player_mark}'")
-    
-    return " AND ".join(conditions) if conditions else "1=1"
+    # Predicate theo thứ tự cố định tâm -> vòng trong -> vòng ngoài (cùng board = cùng text SQL),
+    # khớp cả 8 orientation nếu bật query_builder.MATCH_ALL_ORIENTATIONS
+    return where_clause(board)
 
 
 def query_odd_table(board: list) -> int:
@@ -134,8 +184,6 @@ def query_odd_table(board: list) -> int:
     if move_count == 0:
         return 0
     
-    where_clause = build_where_clause(board)
-    
     # Đếm trực tiếp từng bảng và cộng lại
     total_count = 0
     for level in range(9, 26, 2):  # 9, 11, 13, ..., 25
@@ -143,7 +191,10 @@ def query_odd_table(board: list) -> int:
             continue
         
         table_name = f"ttt_5_l{level}"
-        sql = f"SELECT COUNT(win_actor) FROM {table_name} WHERE {where_clause} AND win_actor = 'X'"
+        if not table_may_match(table_name, board):
+            note_pruned_scans()
+            continue
+        sql = build_level_count_query(table_name, 'X', board)
         
         count = execute_query(sql)
         total_count += count
@@ -166,8 +217,6 @@ def query_even_table(board: list) -> int:
     if move_count == 0:
         return 0
     
-    where_clause = build_where_clause(board)
-    
     # Đếm trực tiếp từng bảng và cộng lại
     total_count = 0
     for level in range(10, 25, 2):  # 10, 12, 14, ..., 24
@@ -175,7 +224,10 @@ def query_even_table(board: list) -> int:
             continue
         
         table_name = f"ttt_5_l{level}"
-        sql = f"SELECT COUNT(win_actor) FROM {table_name} WHERE {where_clause} AND win_actor = 'O'"
+        if not table_may_match(table_name, board):
+            note_pruned_scans()
+            continue
+        sql = build_level_count_query(table_name, 'O', board)
         
         count = execute_query(sql)
         total_count += count
@@ -198,13 +250,46 @@ def query_draw_table(board: list) -> int:
     if move_count == 0:
         return 0
     
-    where_clause = build_where_clause(board)
-    
     # Query table ttt_5_draw
-    sql = f"SELECT COUNT(win_actor) FROM ttt_5_draw WHERE {where_clause} AND win_actor = 'D'"
+    if not table_may_match(DRAW_TABLE, board):
+        note_pruned_scans()
+        return 0
+    sql = build_level_count_query(DRAW_TABLE, 'D', board)
     
     return execute_query(sql)
 
+# Các game/thread hỏi cùng canonical board cùng lúc chỉ gửi 1 lượt query xuống DB.
+# Nước đi của request dẫn đầu bị hủy -> các request đang chờ tự query lại trong scope của mình
+outcome_flight = SingleFlight(retry_on=(QueryCancelled,))
+
+
+def _query_outcome_counts(canonical: list) -> tuple[int, int, int]:
+    # Đã migrate bảng gộp: 1 câu lệnh, chỉ scan các partition level cần thiết
+    if consolidated_table_available():
+        return tuple(query_candidate_counts([canonical])[0].tolist())
+    return (
+        query_odd_table(canonical),
+        query_even_table(canonical),
+        query_draw_table(canonical)
+    )
+
+
+def query_outcome_counts(canonical: list) -> tuple[int, int, int]:
+    """
+    Đếm số trận X thắng, O thắng và hòa của canonical board
+    Request đồng thời cho cùng board sẽ chờ chung một query đang chạy
+    
+    Args:
+        canonical: Canonical board (list of int, size 25)
+        
+    Returns:
+        (x_win_count, o_win_count, draw_count)
+        
+    Raises:
+        QueryCancelled: Nước đi hiện tại đã bị hủy/hết deadline hoặc query timeout
+    """
+    return outcome_flight.do(tuple(canonical), _query_outcome_counts, canonical)
+
 #=========================================Symmetric==========================================
 N = 5  # Board size constant
 
@@ -334,22 +419,35 @@ def get_best_step_5x5(currBoard: list[list[int]], player: int, glob_r: int, glob
 
     moves_checked = 0
     moves_with_data = 0
+    moves_skipped = 0
+
+    # Parent đã có trong ttt_5_next_moves: stats của mọi ô trống bằng một lookup
+    next_moves = lookup_next_moves(convert_to_db_schema_1d(currBoard), player)
 
     for c in range(5):
         for r in range(5):
             if currBoard[r][c] != 0:
                 continue
             
-            # Tìm canonical form
-            newBoard = copy.deepcopy(currBoard)
-            newBoard[r][c] = player
-            board_1d = convert_to_db_schema_1d(newBoard)
-            canonical = canonical_board(board_1d)
-            
-            # Query với canonical form
-            x_win_count = query_odd_table(canonical)
-            o_win_count = query_even_table(canonical)
-            draw_count = query_draw_table(canonical)
+            if next_moves is not None:
+                x_win_count, o_win_count, draw_count = next_moves.get(r * 5 + c, (0, 0, 0))
+            else:
+                # Tìm canonical form
+                newBoard = copy.deepcopy(currBoard)
+                newBoard[r][c] = player
+                board_1d = convert_to_db_schema_1d(newBoard)
+                canonical = canonical_board(board_1d)
+                
+                # Filter loại trừ được -> không có data, khỏi query 18 bảng
+                if not position_may_have_data(canonical):
+                    moves_skipped += 1
+                    continue
+                
+                # Query với canonical form; nước đi đã hết deadline thì ô chưa có kết quả coi như không có data
+                try:
+                    x_win_count, o_win_count, draw_count = query_outcome_counts(canonical)
+                except QueryCancelled:
+                    continue
             
             total_count = x_win_count + o_win_count + draw_count
             
@@ -379,6 +477,9 @@ def get_best_step_5x5(currBoard: list[list[int]], player: int, glob_r: int, glob
                 f"win={current_win_rate:.2%}, lose={current_lose_rate:.2%}, draw={draw_rate:.2%} "
                 f"(X:{x_win_count}, O:{o_win_count}, D:{draw_count}, total:{total_count})")
             
+    if moves_skipped:
+        print(f"   ⏭️  Filter bỏ qua {moves_skipped} nước đi không có data")
+
     # Nếu không tìm thấy nước thắng, chọn nước ít thua nhất
     if best_move == (-1, -1):
         best_move = best_move_by_lose
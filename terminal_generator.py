@@ -0,0 +1,368 @@
+import csv
+import glob
+import gzip
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from query_builder import N, DRAW_TABLE
+from native_ingest import CSV_COLUMNS, build_columns, table_columns, check_columns
+from canonical_dedup import canonical_keys
+
+#==========================================Terminal-State Generator==========================================
+# Sinh lại dataset ttt_5_l9..l25 / ttt_5_draw: chơi mọi ván 5x5 (X đi trước) theo từng level (= số quân),
+# dừng ở nước tạo 5 quân liên tiếp; bàn cờ đầy mà không ai thắng là hòa.
+# Mỗi level chỉ giữ các trạng thái khác nhau theo canonical form (canonical_dedup.canonical_keys: cùng 8 phép
+# biến đổi và cùng thứ tự lexicographic như get_symmetries/canonical_board), nên trạng thái đối xứng chỉ được
+# mở rộng một lần.
+#
+# Trạng thái là canonical key uint64 (x_mask | o_mask << 25, giống bitboard_mask). Mỗi level chia theo
+# hash của key thành các partition trên disk (WORK_DIR) để RAM không phụ thuộc kích thước level:
+#   1) expand  mỗi process mở rộng một partition của level trước, ghi child vào fragment theo partition đích
+#   2) dedup   mỗi process gộp fragment của một partition (np.unique), giữ child chưa kết thúc làm frontier
+#              của level này và ghi các trạng thái kết thúc ra sink (file CSV.gz theo shard hoặc ClickHouse)
+# Level đã xong có done.json, chạy lại sẽ tiếp tục từ level cuối cùng đã xong.
+# Level dở được sinh lại từ đầu; với sink ClickHouse mỗi block INSERT mang insert_deduplication_token cố định
+# theo (level, partition, kind, offset), nên các block đã commit trước khi crash bị server bỏ qua khi gửi lại.
+
+CELLS = N * N
+WIN_LENGTH = 5
+DEFAULT_PARTITIONS = 256
+DEFAULT_BATCH = 50_000        # số parent mở rộng mỗi lượt trong một process
+INSERT_BLOCK_ROWS = 1_000_000
+WORK_DIR = os.path.join("data", "generate_work")
+OUTPUT_DIR = os.path.join("data", "generated")
+# canonical_form: 25 ký tự của canonical board theo thứ tự i11 -> i55
+CANONICAL_MARKS = np.frombuffer(b"-XO", dtype=np.uint8)
+
+FULL_MASK = np.uint64((1 << CELLS) - 1)
+SHIFT_O = np.uint64(CELLS)
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+LEGACY_COLUMNS = [(name, "FixedString(1)") for name in CSV_COLUMNS]
+
+
+def _win_lines() -> list[int]:
+    lines = []
+    for r in range(N):
+        for c in range(N):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                cells = [(r + dr * k, c + dc * k) for k in range(WIN_LENGTH)]
+                if all(0 <= rr < N and 0 <= cc < N for rr, cc in cells):
+                    lines.append(sum(1 << (rr * N + cc) for rr, cc in cells))
+    return lines
+
+
+WIN_LINES = _win_lines()
+# Chỉ cần kiểm tra các đường đi qua ô vừa đánh (giống check_winner_5_in_row)
+LINES_THROUGH = [[np.uint64(line) for line in WIN_LINES if line >> idx & 1] for idx in range(CELLS)]
+
+
+#==========================================Board Math==========================================
+def expand(parents: np.ndarray, level: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Đánh quân thứ `level` vào mọi ô trống của các parent (level - 1 quân, chưa kết thúc)
+
+    Returns:
+        (canonical key child chưa kết thúc, child vừa thắng, child hòa), mỗi mảng đã bỏ trùng
+    """
+    x_mask = parents & FULL_MASK
+    o_mask = parents >> SHIFT_O
+    x_moves = level % 2 == 1
+    own = x_mask if x_moves else o_mask
+    occupied = x_mask | o_mask
+
+    x_parts, o_parts, wins = [], [], []
+    for idx in range(CELLS):
+        bit = np.uint64(1 << idx)
+        free = (occupied & bit) == 0
+        if not free.any():
+            continue
+        placed = own[free] | bit
+        won = np.zeros(len(placed), dtype=bool)
+        for line in LINES_THROUGH[idx]:
+            won |= (placed & line) == line
+        x_parts.append(placed if x_moves else x_mask[free])
+        o_parts.append(o_mask[free] if x_moves else placed)
+        wins.append(won)
+    if not x_parts:
+        empty = np.empty(0, dtype=np.uint64)
+        return empty, empty, empty
+
+    keys = canonical_keys(np.concatenate(x_parts), np.concatenate(o_parts))
+    won = np.concatenate(wins)
+    if level == CELLS:
+        return np.empty(0, dtype=np.uint64), np.unique(keys[won]), np.unique(keys[~won])
+    return np.unique(keys[~won]), np.unique(keys[won]), np.empty(0, dtype=np.uint64)
+
+
+def key_cells(keys: np.ndarray) -> np.ndarray:
+    """
+    Ma trận (rows x 25) giá trị ô 0/1/2 của các canonical key
+    """
+    cells = np.zeros((len(keys), CELLS), dtype=np.uint8)
+    one = np.uint64(1)
+    for idx in range(CELLS):
+        cells[:, idx] = ((keys >> np.uint64(idx)) & one) + (((keys >> np.uint64(idx + CELLS)) & one) << one)
+    return cells
+
+
+def canonical_forms(cells: np.ndarray) -> list[str]:
+    marks = np.ascontiguousarray(CANONICAL_MARKS[cells])
+    return marks.view(f"S{CELLS}").ravel().astype(f"U{CELLS}").tolist()
+
+
+def partition_of(keys: np.ndarray, partitions: int) -> np.ndarray:
+    return ((keys * HASH_MULTIPLIER) >> np.uint64(40)) % np.uint64(partitions)
+
+
+def outcome_table(level: int, kind: str) -> tuple[str, str]:
+    """
+    (table, win_actor) của trạng thái kết thúc: X thắng ở level lẻ, O ở level chẵn, hòa vào ttt_5_draw
+    """
+    if kind == "draw":
+        return DRAW_TABLE, "D"
+    return f"ttt_5_l{level}", "X" if level % 2 == 1 else "O"
+
+
+#==========================================Workers==========================================
+def _level_dir(work_dir: str, level: int) -> str:
+    return os.path.join(work_dir, f"level_{level:02d}")
+
+
+def _frontier_path(work_dir: str, level: int, partition: int) -> str:
+    return os.path.join(_level_dir(work_dir, level), f"frontier_p{partition:04d}.u64")
+
+
+def expand_partition(work_dir: str, level: int, source: int, partitions: int, batch: int) -> tuple[int, int]:
+    """
+    Mở rộng partition `source` của level - 1, ghi child vào fragment <kind>_p<đích>.t<source>.u64
+
+    Returns:
+        (số parent, số child sau khi bỏ trùng trong từng lượt)
+    """
+    parents = np.fromfile(_frontier_path(work_dir, level - 1, source), dtype=np.uint64)
+    out_dir = _level_dir(work_dir, level)
+    handles = {}
+    children = 0
+    try:
+        for start in range(0, len(parents), batch):
+            for kind, keys in zip(("open", "win", "draw"), expand(parents[start:start + batch], level)):
+                if len(keys) == 0:
+                    continue
+                children += len(keys)
+                targets = partition_of(keys, partitions)
+                for partition in np.unique(targets).tolist():
+                    handle = handles.get((kind, partition))
+                    if handle is None:
+                        path = os.path.join(out_dir, f"{kind}_p{partition:04d}.t{source:04d}.u64")
+                        handle = handles[(kind, partition)] = open(path, "wb")
+                    keys[targets == partition].tofile(handle)
+    finally:
+        for handle in handles.values():
+            handle.close()
+    return len(parents), children
+
+
+def _merge_fragments(out_dir: str, kind: str, partition: int) -> np.ndarray:
+    paths = glob.glob(os.path.join(out_dir, f"{kind}_p{partition:04d}.t*.u64"))
+    if not paths:
+        return np.empty(0, dtype=np.uint64)
+    keys = np.unique(np.concatenate([np.fromfile(path, dtype=np.uint64) for path in paths]))
+    for path in paths:
+        os.remove(path)
+    return keys
+
+
+def _write_terminal(keys: np.ndarray, level: int, kind: str, partition: int, output_dir: str):
+    table, actor = outcome_table(level, kind)
+    if output_dir:
+        # Mỗi partition một shard CSV.gz (format giống file ttt_5_*.csv); các gzip member nối lại vẫn hợp lệ
+        table_dir = os.path.join(output_dir, table)
+        os.makedirs(table_dir, exist_ok=True)
+        path = os.path.join(table_dir, f"l{level:02d}-p{partition:04d}.csv.gz")
+        with gzip.open(f"{path}.tmp", "wt", encoding="utf-8", newline="", compresslevel=3) as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            for start in range(0, len(keys), INSERT_BLOCK_ROWS):
+                writer.writerows(zip(*_terminal_columns(keys[start:start + INSERT_BLOCK_ROWS], actor, LEGACY_COLUMNS)))
+        os.replace(f"{path}.tmp", path)
+        return
+
+    # Import ở đây: chỉ sink ClickHouse cần clickhouse-connect
+    from native_query import get_native_client
+    client = get_native_client()
+    columns = table_columns(client, table)
+    check_columns(columns)
+    names = [name for name, _ in columns]
+    for start in range(0, len(keys), INSERT_BLOCK_ROWS):
+        data = _terminal_columns(keys[start:start + INSERT_BLOCK_ROWS], actor, columns)
+        # keys đã sort (np.unique) nên sinh lại level cho đúng block này -> cùng token, chạy lại không nhân đôi rows
+        settings = {"async_insert": 0, "insert_deduplicate": 1,
+                    "insert_deduplication_token": f"gen-l{level}-p{partition}-{kind}-{start}"}
+        client.insert(table, data, column_names=names, column_oriented=True, settings=settings)
+
+
+def _enable_deduplication(max_level: int):
+    """
+    Bật non_replicated_deduplication_window trên các table đích để token của _write_terminal có hiệu lực
+    """
+    from native_query import get_native_client
+    from chunked_upload import DEDUP_WINDOW
+    client = get_native_client()
+    tables = {outcome_table(level, kind)[0] for level in range(1, max_level + 1) for kind in ("win", "draw")}
+    for table in sorted(tables):
+        if not int(client.command(f"EXISTS TABLE {table}")):
+            continue
+        try:
+            client.command(f"ALTER TABLE {table} MODIFY SETTING non_replicated_deduplication_window = {DEDUP_WINDOW}")
+        except Exception as e:
+            print(f"⚠️  Could not enable deduplication on {table} (a resumed level may duplicate rows): {e}")
+
+
+def _terminal_columns(keys: np.ndarray, actor: str, columns: list[tuple[str, str]]) -> list:
+    cells = key_cells(keys)
+    forms = canonical_forms(cells)
+    return build_columns(columns, forms, [actor] * len(keys), cells, keys & FULL_MASK, keys >> SHIFT_O)
+
+
+def finish_partition(work_dir: str, level: int, partition: int, output_dir: str) -> tuple[int, int, int]:
+    """
+    Bỏ trùng partition của level: child chưa kết thúc thành frontier, trạng thái kết thúc ghi ra sink
+
+    Args:
+        output_dir: Thư mục shard CSV.gz, None = INSERT thẳng vào ClickHouse
+
+    Returns:
+        (số trạng thái chưa kết thúc, số thắng, số hòa)
+    """
+    out_dir = _level_dir(work_dir, level)
+    frontier = _merge_fragments(out_dir, "open", partition)
+    frontier.tofile(_frontier_path(work_dir, level, partition))
+    counts = [len(frontier)]
+    for kind in ("win", "draw"):
+        keys = _merge_fragments(out_dir, kind, partition)
+        if len(keys):
+            _write_terminal(keys, level, kind, partition, output_dir)
+        counts.append(len(keys))
+    return tuple(counts)
+
+
+#==========================================Driver==========================================
+def _level_done(work_dir: str, level: int) -> dict:
+    path = os.path.join(_level_dir(work_dir, level), "done.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def generate_terminal_states(max_level: int = CELLS, workers: int = None, partitions: int = DEFAULT_PARTITIONS,
+                             output_dir: str = OUTPUT_DIR, work_dir: str = WORK_DIR, batch: int = DEFAULT_BATCH,
+                             recreate: bool = False) -> dict:
+    """
+    Sinh toàn bộ trạng thái kết thúc 5x5 theo level bằng process pool
+
+    Args:
+        max_level: Dừng sau level này (chạy lại với max_level lớn hơn sẽ tiếp tục)
+        workers: Số worker process (mặc định số CPU)
+        partitions: Số partition theo hash canonical key mỗi level (nhiều hơn = ít RAM hơn mỗi process)
+        output_dir: Thư mục shard CSV.gz, None = INSERT vào các table ttt_5_* đã tạo sẵn
+        work_dir: Thư mục frontier/fragment trung gian
+        batch: Số parent mở rộng mỗi lượt trong một process
+        recreate: Xóa work_dir, sinh lại từ level 0
+
+    Returns:
+        {level: thống kê của level}
+    """
+    workers = workers or os.cpu_count() or 1
+    sink = output_dir or "ClickHouse"
+    print("\n" + "=" * 70)
+    print(f"🌱 Generating 5x5 terminal states up to level {max_level} → {sink}")
+    print(f"   {workers} worker(s), {partitions} partition(s), work dir {work_dir}")
+    print("=" * 70)
+
+    if recreate and os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+
+    # Level cuối cùng đã xong (frontier của nó còn trên disk)
+    stats = {}
+    start_level = 0
+    for level in range(CELLS + 1):
+        done = _level_done(work_dir, level)
+        if done is None:
+            break
+        if done["partitions"] != partitions:
+            raise ValueError(f"{work_dir} was generated with {done['partitions']} partitions, "
+                             f"rerun with --partitions {done['partitions']} or --recreate")
+        stats[level] = done
+        start_level = level
+    if stats:
+        print(f"↻ Resuming after level {start_level}")
+    else:
+        os.makedirs(_level_dir(work_dir, 0), exist_ok=True)
+        root = np.zeros(1, dtype=np.uint64)
+        for partition in range(partitions):
+            (root if partition == int(partition_of(root, partitions)[0]) else root[:0]).tofile(_frontier_path(work_dir, 0, partition))
+        stats[0] = {"partitions": partitions, "open": 1, "wins": 0, "draws": 0, "seconds": 0.0}
+        with open(os.path.join(_level_dir(work_dir, 0), "done.json"), "w", encoding="utf-8") as f:
+            json.dump(stats[0], f)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    else:
+        _enable_deduplication(max_level)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for level in range(start_level + 1, max_level + 1):
+            if stats[level - 1]["open"] == 0:
+                break
+            started = time.monotonic()
+            out_dir = _level_dir(work_dir, level)
+            if os.path.exists(out_dir):
+                # Level dở của lần chạy trước: sinh lại, block đã INSERT bị bỏ qua nhờ dedup token
+                shutil.rmtree(out_dir)
+            os.makedirs(out_dir)
+
+            sources = [p for p in range(partitions) if os.path.getsize(_frontier_path(work_dir, level - 1, p)) > 0]
+            parents = children = 0
+            futures = [executor.submit(expand_partition, work_dir, level, p, partitions, batch) for p in sources]
+            with tqdm(total=len(futures), desc=f"L{level:02d} expand", unit="part") as bar:
+                for future in as_completed(futures):
+                    done_parents, done_children = future.result()
+                    parents += done_parents
+                    children += done_children
+                    bar.update(1)
+                    bar.set_postfix(states_per_s=f"{children / max(time.monotonic() - started, 1e-9):,.0f}")
+
+            totals = [0, 0, 0]
+            futures = [executor.submit(finish_partition, work_dir, level, p, output_dir) for p in range(partitions)]
+            with tqdm(total=len(futures), desc=f"L{level:02d} dedup ", unit="part") as bar:
+                for future in as_completed(futures):
+                    for index, count in enumerate(future.result()):
+                        totals[index] += count
+                    bar.update(1)
+
+            elapsed = time.monotonic() - started
+            stats[level] = {"partitions": partitions, "open": totals[0], "wins": totals[1], "draws": totals[2],
+                            "parents": parents, "seconds": round(elapsed, 3)}
+            with open(os.path.join(out_dir, "done.json"), "w", encoding="utf-8") as f:
+                json.dump(stats[level], f)
+            # Frontier của level trước không còn cần cho việc resume
+            for path in glob.glob(os.path.join(_level_dir(work_dir, level - 1), "frontier_p*.u64")):
+                os.remove(path)
+
+            table, _ = outcome_table(level, "win")
+            print(f"✅ Level {level:2d}: {totals[0]:>13,} open"
+                  + (f"  {totals[1]:,} wins → {table}" if totals[1] else "")
+                  + (f"  {totals[2]:,} draws → {DRAW_TABLE}" if totals[2] else "")
+                  + f"  ({elapsed:.1f}s, {parents / max(elapsed, 1e-9):,.0f} parents/s)")
+
+    wins = sum(s["wins"] for s in stats.values())
+    draws = sum(s["draws"] for s in stats.values())
+    print(f"\n🏁 {wins:,} winning and {draws:,} drawn terminal states")
+    if output_dir:
+        print(f"   Shards in {output_dir}/<table>/ (concatenate a table's shards into data/<table>.csv.gz to ingest)")
+    return stats